@@ -0,0 +1,221 @@
+''' Run chip8 applications headlessly across a pool of processes.
+
+Every application is run on its own Cpu for a number of frames or cycles,
+optionally fed key presses from an input script, and summarized in one row
+of a CSV results file: the hash of the final display, why the run stopped,
+the number of instructions executed and how long it took.
+
+An input script has one event per line, "frame key down" or "frame key up",
+frame being the number of the frame at the start of which the chip8 keypad
+key (hexadecimal) changes state. Everything after a # is ignored. '''
+
+import argparse
+import chip8
+import collections
+import csv
+import multiprocessing
+import os
+import queue
+import roms
+import sys
+import time
+import zipfile
+
+# One application to run: name, image, input events as (frame, key,
+# is_down), budget in cycles and budget in seconds (None for no limit).
+Job = collections.namedtuple('Job', 'name image inputs cycles seconds')
+
+# Outcome of a job. reason is 'done' if the cycle budget was used up,
+# 'timeout' if the time budget was, 'watchdog' if the worker stopped
+# responding, 'skipped' if every worker stopped responding before the job
+# could start, or the name of the exception that stopped the Cpu or, for
+# any other, the worker.
+Result = collections.namedtuple('Result', 'name rom reason cycles seconds display')
+
+# Exceptions ending a run with their name as the reason.
+errors = (chip8.UnsupportedOpcode, chip8.StackPointerOutOfRange,
+    chip8.ProgramCounterOutOfRange)
+
+# Extra time the parent waits for a job past its own time budget before
+# giving up on the worker.
+watchdog_grace = 5.0
+
+# Seconds between two checks of the jobs by the parent.
+poll_interval = 0.01
+
+# Queue the workers report the jobs they start on, as (index, time).
+_started = None
+
+def _init_worker(started):
+  global _started
+  _started = started
+
+def _run_reported(index, job):
+  _started.put((index, time.time()))
+  return run_job(job)
+
+def parse_inputs(lines):
+  ''' Parse an input script into a sorted list of (frame, key, is_down). '''
+  events = []
+  for number, line in enumerate(lines, 1):
+    fields = line.split('#', 1)[0].split()
+    if not fields:
+      continue
+    if 3 != len(fields) or fields[2] not in ('down', 'up'):
+      raise ValueError('line {}: expected "frame key down|up"'.format(number))
+    key = int(fields[1], 16)
+    if not 0 <= key < 16:
+      raise ValueError('line {}: key = {}'.format(number, fields[1]))
+    events.append((int(fields[0]), key, 'down' == fields[2]))
+  return sorted(events, key=lambda event: event[0])
+
+def run_job(job):
+  ''' Run job and return its Result. '''
+  cpu = chip8.Cpu()
+  cpu.load_image(job.image)
+  frame_cycles = cpu.cycles_per_frame
+  inputs = collections.deque(job.inputs)
+  start = time.perf_counter()
+  deadline = None if job.seconds is None else start + job.seconds
+  reason = 'done'
+  try:
+    while cpu.cycles < job.cycles:
+      frame = cpu.cycles // frame_cycles
+      while inputs and inputs[0][0] <= frame:
+        event, key, is_down = inputs.popleft()
+        if is_down:
+          cpu.press_key(key)
+        else:
+          cpu.release_key(key)
+
+      cycles = min(frame_cycles - cpu.cycles % frame_cycles, job.cycles - cpu.cycles)
+      result = cpu.run_cycles(cycles)
+      if 'key_wait' == result.reason:
+        # Blocked on LD Vx, K: the time passes until the next input.
+        cpu.cycles += cycles - result.cycles
+      if deadline is not None and time.perf_counter() > deadline:
+        reason = 'timeout'
+        break
+  except errors as e:
+    reason = type(e).__name__
+  seconds = time.perf_counter() - start
+  return Result(job.name, roms.rom_hash(job.image), reason, cpu.cycles,
+      seconds, roms.rom_hash(cpu.framebuffer.pack()))
+
+def find_roms(paths):
+  ''' Return (name, image) of the applications in paths, each a file, a
+  directory or a zip file of applications. '''
+  found = []
+  for path in paths:
+    if os.path.isdir(path) or zipfile.is_zipfile(path):
+      catalog = roms.RomCatalog(path)
+      for name in catalog.names():
+        found.append((os.path.join(path, name), catalog.image(name)))
+    else:
+      with open(path, 'rb') as f:
+        found.append((path, f.read()))
+  return found
+
+def run_jobs(jobs, processes=None):
+  ''' Run jobs across a pool of processes and return their Results, in the
+  same order. A worker still running a job watchdog_grace seconds past the
+  time budget of the job, counted from when the job started, is abandoned
+  and the pool is terminated at the end. '''
+  processes = processes or os.cpu_count() or 1
+  started = multiprocessing.Queue()
+  results = [None] * len(jobs)
+  pool = multiprocessing.Pool(processes, _init_worker, (started,))
+  try:
+    pending = dict((index, pool.apply_async(_run_reported, (index, job)))
+        for index, job in enumerate(jobs))
+    starts = {}
+    abandoned = []
+    while pending:
+      try:
+        while True:
+          index, start = started.get_nowait()
+          starts[index] = start
+      except queue.Empty:
+        pass
+
+      now = time.time()
+      for index, pending_result in list(pending.items()):
+        job = jobs[index]
+        if pending_result.ready():
+          try:
+            results[index] = pending_result.get()
+          except Exception as e:
+            # A bug the job ran into must not take the other jobs down.
+            results[index] = Result(job.name, roms.rom_hash(job.image),
+                type(e).__name__, 0, now - starts.get(index, now), '')
+        elif (job.seconds is not None and index in starts
+            and now - starts[index] > job.seconds + watchdog_grace):
+          results[index] = Result(job.name, roms.rom_hash(job.image), 'watchdog',
+              0, now - starts[index], '')
+          abandoned.append(pending_result)
+        else:
+          continue
+        del pending[index]
+
+      if sum(not result.ready() for result in abandoned) >= processes:
+        # Every worker is stuck, the jobs left would never start.
+        for index in pending:
+          job = jobs[index]
+          results[index] = Result(job.name, roms.rom_hash(job.image), 'skipped', 0, 0.0, '')
+        break
+      if pending:
+        time.sleep(poll_interval)
+  finally:
+    pool.terminate()
+    pool.join()
+  return results
+
+def write_results(results, f):
+  writer = csv.writer(f)
+  writer.writerow(Result._fields)
+  for result in results:
+    writer.writerow(result._replace(seconds='{:.6f}'.format(result.seconds)))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Run chip8 applications headlessly.')
+  parser.add_argument('roms', nargs='+',
+      help='applications, or directories or zip files of applications')
+  parser.add_argument('--inputs',
+      help='input script fed to every application')
+  budget = parser.add_mutually_exclusive_group()
+  budget.add_argument('--frames', type=int, default=600,
+      help='frames to run every application for (default 600)')
+  budget.add_argument('--cycles', type=int,
+      help='instructions to run every application for')
+  parser.add_argument('--timeout', type=float,
+      help='seconds every application may run for')
+  parser.add_argument('--jobs', type=int,
+      help='number of worker processes, one per CPU by default')
+  parser.add_argument('--output',
+      help='results file, standard output by default')
+  args = parser.parse_args(argv)
+
+  inputs = []
+  if args.inputs:
+    with open(args.inputs) as f:
+      inputs = parse_inputs(f)
+
+  cycles = args.cycles
+  if cycles is None:
+    cycles = args.frames * chip8.Cpu.cycles_per_frame
+
+  jobs = [Job(name, image, inputs, cycles, args.timeout)
+      for name, image in find_roms(args.roms)]
+  results = run_jobs(jobs, args.jobs)
+
+  if args.output:
+    with open(args.output, 'w', newline='') as f:
+      write_results(results, f)
+  else:
+    write_results(results, sys.stdout)
+
+  # Fail if any application did not make it to the end of its budget.
+  return 0 if all('done' == result.reason for result in results) else 1
+
+if '__main__' == __name__:
+  sys.exit(main())
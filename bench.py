@@ -0,0 +1,247 @@
+''' Benchmarks of the chip8 execution engines.
+
+Synthetic applications each stress one kind of instruction, and two small
+game loops mix them the way real applications do. Every workload is run
+on a fresh Cpu, warmed up, then timed over a number of repeats; the median
+speed is reported in instructions and 60 Hz frames per second of wall time
+along with the spread of the repeats and the peak memory allocated by a
+separate traced run. Polling loops are not fast-forwarded, every
+instruction counted is executed. Results can be saved as JSON and compared
+against a previous run to catch slowdowns. '''
+
+import argparse
+import chip8
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import translator
+
+def assemble(*opcodes, data=None):
+  ''' Return the image of an application made of opcodes, with data, a dict
+  of address -> bytes, placed at the given addresses. '''
+  image = bytearray(b''.join(opcode.to_bytes(2, 'big') for opcode in opcodes))
+  for addr, values in (data or {}).items():
+    offset = addr - 0x200
+    if len(image) < offset + len(values):
+      image.extend(bytes(offset + len(values) - len(image)))
+    image[offset:offset + len(values)] = values
+  return bytes(image)
+
+# Workloads by name, each an application looping forever.
+workloads = {
+  # 8xy* register operations and 7xkk.
+  'alu' : assemble(
+    0x6001, 0x6103,                                  # 200: LD V0, 1; LD V1, 3
+    0x8014, 0x8125, 0x8231, 0x8302, 0x8413, 0x8506,  # 204: ADD, SUB, OR, AND, XOR, SHR
+    0x860E, 0x8707, 0x8800, 0x7905,                  # 210: SHL, SUBN, LD, ADD V9, 5
+    0x1204),                                         # 218: JP 0x204
+  # Skips and jumps.
+  'branch' : assemble(
+    0x6000,          # 200: LD V0, 0
+    0x7001,          # 202: ADD V0, 1
+    0x3080, 0x120C,  # 204: SE V0, 0x80; JP 0x20C
+    0x6000, 0x1202,  # 208: LD V0, 0; JP 0x202
+    0x4001, 0x1202,  # 20C: SNE V0, 1; JP 0x202
+    0x5010, 0x9010,  # 210: SE V0, V1; SNE V0, V1
+    0x1202, 0x1202), # 214: JP 0x202; JP 0x202
+  # Nested subroutine calls.
+  'call' : assemble(
+    0x2206, 0x1200, 0x0000,  # 200: CALL 0x206; JP 0x200
+    0x220C, 0x7001, 0x00EE,  # 206: CALL 0x20C; ADD V0, 1; RET
+    0x2212, 0x7101, 0x00EE,  # 20C: CALL 0x212; ADD V1, 1; RET
+    0x7201, 0x00EE),         # 212: ADD V2, 1; RET
+  # Fx55, Fx65, Fx1E and Fx33 over a 256 byte buffer.
+  'memory' : assemble(
+    0xA300, 0x6A10, 0x6400,  # 200: LD I, 0x300; LD VA, 0x10; LD V4, 0
+    0xFF55, 0xFF65, 0xFA1E,  # 206: LD [I], VF; LD VF, [I]; ADD I, VA
+    0xF333, 0x7401,          # 20C: LD B, V3; ADD V4, 1
+    0x3410, 0x1206, 0x1200), # 210: SE V4, 0x10; JP 0x206; JP 0x200
+  # Font and 15 row sprites moving across the display.
+  'draw' : assemble(
+    0x6000, 0x6100, 0x6200,          # 200: LD V0, 0; LD V1, 0; LD V2, 0
+    0xF229, 0xD015,                  # 206: LD F, V2; DRW V0, V1, 5
+    0x7005, 0x7103, 0x7201,          # 20A: ADD V0, 5; ADD V1, 3; ADD V2, 1
+    0xA200, 0xD01F, 0x1206),         # 210: LD I, 0x200; DRW V0, V1, 15; JP 0x206
+  # Clearing the display between draws.
+  'clear' : assemble(
+    0x00E0, 0xF029, 0xD005,  # 200: CLS; LD F, V0; DRW V0, V0, 5
+    0x7001, 0x1200),         # 206: ADD V0, 1; JP 0x200
+  # Paddle game: waits on the delay timer, bounces a ball off the edges and
+  # moves a paddle with keys 1 and 4.
+  'paddle' : assemble(
+    0x6020, 0x6110, 0x6201, 0x6301,  # 200: ball at (0x20, 0x10) moving (1, 1)
+    0x640C, 0xA2F0,                  # 208: paddle at 0x0C; LD I, ball
+    0xF507, 0x3500, 0x120C,          # 20C: wait for DT = 0
+    0x6502, 0xF515,                  # 212: LD DT, 2
+    0xA2F0, 0xD011,                  # 216: erase the ball
+    0x8024, 0x8134,                  # 21A: move it
+    0x403F, 0x62FF, 0x4000, 0x6201,  # 21E: bounce off the left and right
+    0x411F, 0x63FF, 0x4100, 0x6301,  # 226: and top and bottom edges
+    0xD011,                          # 22E: draw the ball
+    0xA2F1, 0x6601,                  # 230: LD I, paddle; LD V6, 1
+    0xE6A1, 0x74FF,                  # 234: up while key 1 is down
+    0x6604, 0xE6A1, 0x7401,          # 238: down while key 4 is down
+    0x6700, 0xD746, 0xD746,          # 23E: erase and draw the paddle
+    0x120C,                          # 244: JP 0x20C
+    data={0x2F0 : bytes([0x80] * 7)}),
+  # Score counter: BCD conversion and three digits drawn by a subroutine.
+  'score' : assemble(
+    0x6A00,                          # 200: LD VA, 0
+    0x2220, 0x2220, 0x7A01, 0x1202,  # 202: draw, erase, increment, loop
+    *([0x0000] * 11),
+    0xA300, 0xFA33, 0xF265,          # 220: LD I, 0x300; LD B, VA; LD V2, [I]
+    0x6B00, 0x6C00,                  # 226: LD VB, 0; LD VC, 0
+    0xF029, 0xDBC5, 0x7B05,          # 22A: hundreds
+    0xF129, 0xDBC5, 0x7B05,          # 230: tens
+    0xF229, 0xDBC5,                  # 236: ones
+    0x00EE),                         # 23A: RET
+}
+
+def _step(cpu):
+  def run(cycles):
+    for cycle in range(cycles):
+      cpu.emulate_cycle()
+  return run
+
+def _fusion(cpu):
+  cpu.enable_fusion()
+  return cpu.run_cycles
+
+# Engines by name, each a function taking a Cpu and returning a function
+# executing a number of instructions on it.
+engines = {
+  'interpreter' : lambda cpu: cpu.run_cycles,
+  'step' : _step,
+  'fusion' : _fusion,
+  'translator' : lambda cpu: translator.Translator(cpu).run,
+}
+
+def _cpu(image):
+  # Cpu running image with idle skipping off, skipped cycles would count as
+  # executed.
+  cpu = chip8.Cpu(seed=0)
+  cpu.disable_idle_skip()
+  cpu.load_image(image)
+  return cpu
+
+def run_benchmark(image, engine='interpreter', cycles=200000, warmup=20000, repeats=5):
+  ''' Benchmark image on engine and return a dict of results. '''
+  speeds = []
+  for repeat in range(repeats):
+    cpu = _cpu(image)
+    run = engines[engine](cpu)
+    run(warmup)
+    start_cycles = cpu.cycles
+    start = time.perf_counter()
+    run(cycles)
+    elapsed = time.perf_counter() - start
+    speeds.append((cpu.cycles - start_cycles) / elapsed)
+
+  # Memory is measured apart, tracing slows everything down.
+  tracemalloc.start()
+  try:
+    cpu = _cpu(image)
+    engines[engine](cpu)(warmup + cycles)
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+  median = statistics.median(speeds)
+  return {
+    'instructions_per_second' : median,
+    'frames_per_second' : median / chip8.Cpu.cycles_per_frame,
+    'min' : min(speeds),
+    'max' : max(speeds),
+    'stdev' : statistics.stdev(speeds) if len(speeds) > 1 else 0.0,
+    'samples' : speeds,
+    'peak_memory' : peak,
+  }
+
+def run_suite(names=None, engine='interpreter', cycles=200000, warmup=20000, repeats=5):
+  ''' Benchmark the workloads called names, all of them by default, and
+  return the results with a description of the run. '''
+  if names is None:
+    names = list(workloads)
+  return {
+    'python' : '{} {}'.format(platform.python_implementation(), platform.python_version()),
+    'machine' : platform.machine(),
+    'engine' : engine,
+    'cycles' : cycles,
+    'warmup' : warmup,
+    'repeats' : repeats,
+    'results' : dict((name, run_benchmark(workloads[name], engine, cycles, warmup, repeats))
+        for name in names),
+  }
+
+def compare(suite, baseline, threshold=0.9):
+  ''' Return the workloads of suite slower than threshold times their speed
+  in baseline, as {name: ratio}. '''
+  slower = {}
+  for name, result in suite['results'].items():
+    if name in baseline['results']:
+      ratio = result['instructions_per_second'] / baseline['results'][name]['instructions_per_second']
+      if ratio < threshold:
+        slower[name] = ratio
+  return slower
+
+def format_suite(suite, baseline=None):
+  lines = ['{} on {}, {}: {} cycles, {} warmup, {} repeats'.format(suite['engine'],
+      suite['python'], suite['machine'], suite['cycles'], suite['warmup'], suite['repeats'])]
+  lines.append('{:<10} {:>12} {:>10} {:>7} {:>10}{}'.format('workload', 'instr/s',
+      'frames/s', 'spread', 'peak KiB', '' if baseline is None else '  vs baseline'))
+  for name, result in suite['results'].items():
+    speed = result['instructions_per_second']
+    line = '{:<10} {:>12.0f} {:>10.0f} {:>6.1f}% {:>10.1f}'.format(name, speed,
+        result['frames_per_second'], 100 * (result['max'] - result['min']) / speed,
+        result['peak_memory'] / 1024)
+    if baseline is not None and name in baseline['results']:
+      line = '{}  {:>10.2f}x'.format(line, speed / baseline['results'][name]['instructions_per_second'])
+    lines.append(line)
+  return '\n'.join(lines)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark the chip8 execution engines.')
+  parser.add_argument('workloads', nargs='*',
+      help='workloads to run, all of them by default: {}'.format(', '.join(workloads)))
+  parser.add_argument('--engine', choices=list(engines), default='interpreter',
+      help='execution engine (default interpreter)')
+  parser.add_argument('--cycles', type=int, default=200000,
+      help='instructions timed per repeat (default 200000)')
+  parser.add_argument('--warmup', type=int, default=20000,
+      help='instructions run before timing (default 20000)')
+  parser.add_argument('--repeats', type=int, default=5,
+      help='timed runs per workload (default 5)')
+  parser.add_argument('--json', metavar='FILE',
+      help='also write the results to FILE as JSON')
+  parser.add_argument('--compare', metavar='FILE',
+      help='compare with results previously written with --json')
+  parser.add_argument('--threshold', type=float, default=0.9,
+      help='with --compare, fail if a workload runs slower than this ratio (default 0.9)')
+  args = parser.parse_args(argv)
+  for name in args.workloads:
+    if name not in workloads:
+      parser.error('unknown workload: {}'.format(name))
+
+  suite = run_suite(args.workloads or None, args.engine, args.cycles, args.warmup, args.repeats)
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print(format_suite(suite, baseline))
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(suite, f, indent=2)
+
+  if baseline is not None:
+    slower = compare(suite, baseline, args.threshold)
+    for name, ratio in slower.items():
+      print('{} is slower: {:.2f}x'.format(name, ratio))
+    return 1 if slower else 0
+  return 0
+
+if '__main__' == __name__:
+  sys.exit(main())
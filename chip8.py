@@ -1,7 +1,18 @@
-import pygame
-import random
+import argparse
+import collections
+import display
+import framebuffer
+import functools
+import hashlib
+import memtrack
+import movie
+import os
+import rewind
+import roms
 import struct
 import sys
+import time
+import tracer
 
 class AddressOutOfRange(Exception):
   pass
@@ -18,6 +29,48 @@ class UnsupportedOpcode(Exception):
 class AddressValueIsNotEven(Exception):
   pass
 
+class InvalidSnapshot(Exception):
+  pass
+
+class _KeyWait(Exception):
+  # Raised by LD Vx, K to end the batch run it blocks.
+  pass
+
+def random_pool(seed, k, size=4096):
+  ''' Return the k-th pool of size random bytes generated from seed, a 64
+  bit integer. Cxkk draws from the pools one byte at a time, in order. '''
+  return hashlib.shake_128(seed.to_bytes(8, 'little') + k.to_bytes(4, 'little')).digest(size)
+
+def random_seed():
+  ''' Return a 64 bit seed taken from the system entropy. '''
+  return int.from_bytes(os.urandom(8), 'little')
+
+# Summary returned by the batch execution methods of Cpu: number of
+# instructions executed, number of them that drew on the screen and why the
+# run stopped ('cycles', 'draw', 'pc', 'predicate' or 'key_wait').
+RunResult = collections.namedtuple('RunResult', 'cycles frames reason')
+
+class HandlerStats:
+  ''' Number of executions of a handler, their total time in nanoseconds
+  and a histogram of their times: bucket b counts the executions that took
+  less than 2**b but at least 2**(b - 1) nanoseconds. '''
+
+  def __init__(self):
+    self.count = 0
+    self.time = 0
+    self.histogram = [0] * 64
+
+  def percentile(self, fraction):
+    # Upper bound in nanoseconds of the time of the given fraction of the
+    # executions.
+    needed = fraction * self.count
+    seen = 0
+    for bucket, count in enumerate(self.histogram):
+      seen = seen + count
+      if count and seen >= needed:
+        return 2 ** bucket
+    return 0
+
 class Cpu:
 
   font_set = (
@@ -45,7 +98,40 @@ class Cpu:
   cols = 64
   rows = 32
 
-  def __init__(self):
+  # Layout of the fixed part of a snapshot: magic, version, pc, I, sp, V,
+  # stack, delay timer, sound timer, cycles and keyboard bits. Memory and the
+  # packed framebuffer follow it.
+  # Version 2 adds the RND generator state and the register of a blocked
+  # LD Vx, K (-1 if not blocked) to version 1, version 3 the key pressed
+  # since it blocked (-1 if none). Older versions are still restored.
+  _snapshot_header = struct.Struct('<4sBHHb16s16HBBQHQIHbb')
+  _snapshot_headers = {
+    1 : struct.Struct('<4sBHHb16s16HBBQH'),
+    2 : struct.Struct('<4sBHHb16s16HBBQHQIHb'),
+    3 : _snapshot_header,
+  }
+  _snapshot_magic = b'C8SS'
+  _snapshot_version = 3
+
+  # Memory contents after a reset: the font set followed by zeros.
+  _initial_memory = bytes(font_set) + bytes(4096 - len(font_set))
+
+  # Adjacent opcode families that can be executed as one fused handler, see
+  # enable_fusion().
+  fusible_pairs = frozenset([(0xA, 0xD), (0x3, 0x1), (0x4, 0x1), (0x6, 0x6)])
+
+  # Maximum number of instructions executed by a single fused handler.
+  max_fused = 4
+
+  # Maximum number of instructions before the jump of a loop that can be
+  # fast-forwarded, see enable_idle_skip().
+  max_idle_body = 8
+
+  # Number of instructions executed per 60 Hz frame. Timers count down once
+  # per frame, i.e. every cycles_per_frame instructions.
+  cycles_per_frame = 10
+
+  def __init__(self, framebuffer_class=framebuffer.PackedFramebuffer, seed=None):
     self._main_optbl = {
       0x0 : self._op0_nest,
       0x1 : self._op_jmp,
@@ -99,11 +185,415 @@ class Cpu:
       0x65 : self._op_ldxi,
     }
 
+    # Nested tables indexed by opcode family. Family 0x8 is keyed by the
+    # lowest nibble, the others by the lowest byte.
+    self._nested_optbls = {
+      0x0 : self._optbl0,
+      0x8 : self._optbl8,
+      0xE : self._optblE,
+      0xF : self._optblF,
+    }
+
+    # Callables invoked with the address of a decoded instruction whenever
+    # it gets overwritten, for engines that keep their own translations.
+    self._code_listeners = []
+
+    # Opcode family pairs currently fused, and the addresses of the bytes
+    # fused entries cover past their first instruction, whose writes must
+    # invalidate further back than plain instructions.
+    self._fused_pairs = frozenset()
+    self._fused_covered = set()
+
+    # Whether polling loops are fast-forwarded, see enable_idle_skip(), and
+    # the cycle count the current batch run must stop at, if it may skip.
+    self._idle_skip = True
+    self._cycle_limit = None
+
+    # HandlerStats by handler name while instrumentation is enabled, see
+    # enable_stats(), None otherwise.
+    self._stats = None
+
+    # memtrack.MemoryTracker recording memory accesses, see
+    # enable_mem_tracking().
+    self.mem_tracker = None
+
+    # Seed of the RND bytes, see random_pool(). The same seed gives the
+    # same bytes after every reset.
+    self.seed = random_seed() if seed is None else seed
+
+    # Guest memory, 4KB, reset in place.
+    self.memory = bytearray(len(self._initial_memory))
+
+    # The display. Cleared in place so that references to it stay valid.
+    # framebuffer.NumpyFramebuffer can be used to get it as a NumPy array.
+    self.framebuffer = framebuffer_class(self.rows, self.cols)
+
     self.reset()
 
   def _unsupported_opcode(self):
     raise UnsupportedOpcode
 
+  def _decode(self, opcode):
+    # Resolve opcode into its leaf handler and operands, walking the nested
+    # tables once so that the result can be cached per address.
+    nnn = opcode & 0x0FFF
+    nn  = opcode & 0x00FF
+    n   = opcode & 0x000F
+    x   = (opcode & 0x0F00) >> 8
+    y   = (opcode & 0x00F0) >> 4
+
+    family = (opcode & 0xF000) >> 12
+    if family in self._nested_optbls:
+      key = n if 0x8 == family else nn
+      handler = self._nested_optbls[family].get(key, self._unsupported_opcode)
+    else:
+      handler = self._main_optbl[family]
+
+    return (handler, nnn, nn, n, x, y)
+
+  def _decode_at(self, addr, fuse=True):
+    # Decode the instruction at addr, fusing it with the ones following it
+    # when fusion is enabled for their families and fuse is True, and
+    # wrapping it when statistics or memory tracking are enabled.
+    if fuse:
+      decoded = self._decode_fused(addr)
+    else:
+      decoded = self._decode((self.memory[addr] << 8) | self.memory[addr + 1])
+    if (self._idle_skip and self.mem_tracker is None and self._stats is None
+        and decoded[0] == self._op_jmp):
+      loop = self._idle_loop(addr, decoded[1])
+      if loop is not None:
+        decoded = (functools.partial(self._idle_jmp, decoded[1], *loop),) + decoded[1:]
+    handler = decoded[0]
+    if self.mem_tracker is not None:
+      handler = self._track(handler, addr, decoded[3])
+    if self._stats is not None:
+      handler = self._instrument(self._handler_name(decoded[0]), handler)
+    if handler is not decoded[0]:
+      decoded = (handler,) + decoded[1:]
+    return decoded
+
+  def _decode_fused(self, addr):
+    opcode = (self.memory[addr] << 8) | self.memory[addr + 1]
+    decoded = self._decode(opcode)
+    if not self._fused_pairs or addr + 3 >= len(self.memory):
+      return decoded
+
+    following = (self.memory[addr + 2] << 8) | self.memory[addr + 3]
+    pair = (opcode >> 12, following >> 12)
+    if pair not in self._fused_pairs:
+      return decoded
+    if (0x1 == pair[1] and self._idle_skip
+        and self._idle_loop(addr + 2, following & 0x0FFF) is not None):
+      # Leave the jump closing a polling loop to _idle_jmp.
+      return decoded
+
+    start = addr
+    end = addr + 4
+    if (0xA, 0xD) == pair:
+      handler = functools.partial(self._fused_ldi_drw, opcode & 0x0FFF,
+          (following & 0x0F00) >> 8, (following & 0x00F0) >> 4, following & 0x000F)
+    elif (0x6, 0x6) == pair:
+      loads = []
+      while 0x6 == opcode >> 12 and len(loads) < self.max_fused:
+        loads.append(((opcode & 0x0F00) >> 8, opcode & 0x00FF))
+        addr = addr + 2
+        if addr + 1 >= len(self.memory):
+          break
+        opcode = (self.memory[addr] << 8) | self.memory[addr + 1]
+      handler = functools.partial(self._fused_lds, tuple(loads))
+      end = start + 2 * len(loads)
+    else:
+      handler = functools.partial(self._fused_skip_jmp, 0x3 == pair[0],
+          (opcode & 0x0F00) >> 8, opcode & 0x00FF, following & 0x0FFF)
+
+    self._fused_covered.update(range(start + 2, end))
+    return (handler,) + decoded[1:]
+
+  def _next_cycle(self):
+    # Bookkeeping done by emulate_cycle before every instruction, for fused
+    # handlers moving on to their next instruction.
+    self.draw_flag = False
+    self.pc = self.pc + 2
+    self.cycles = self.cycles + 1
+
+  def _fused_stop(self):
+    # Whether a fused handler must stop before its next instruction, the
+    # batch run it is part of having reached its last cycle. pc is already
+    # on that instruction.
+    return self._cycle_limit is not None and self.cycles >= self._cycle_limit
+
+  def _fused_ldi_drw(self, nnn, x, y, n):
+    # 0xAnnn followed by 0xDxyn.
+    self.I = nnn
+    if self._fused_stop():
+      return
+    self._next_cycle()
+    self._x, self._y, self._n = x, y, n
+    self._op_drw()
+
+  def _fused_skip_jmp(self, skip_if_equal, x, nn, nnn):
+    # 0x3xkk or 0x4xkk followed by 0x1nnn.
+    if (self.V[x] == nn) == skip_if_equal:
+      self.pc = self.pc + 2
+    elif not self._fused_stop():
+      self._next_cycle()
+      self.pc = nnn
+
+  def _fused_lds(self, loads):
+    # Run of 0x6xkk, loads holds (x, kk) of every instruction.
+    self.V[loads[0][0]] = loads[0][1]
+    for x, nn in loads[1:]:
+      if self._fused_stop():
+        return
+      self._next_cycle()
+      self.V[x] = nn
+
+  def _idle_loop(self, addr, nnn):
+    # If the jump at addr to nnn closes a loop made of LD Vx, DT
+    # instructions followed by at most one skip, i.e. a loop polling the
+    # delay timer or a key, return the code of the loop before the jump,
+    # the (index, x) of its LD Vx, DT instructions and the skip opcode (None
+    # if there is none). Return None otherwise.
+    if nnn > addr or (addr - nnn) % 2 or addr - nnn > 2 * self.max_idle_body:
+      return None
+    reads = []
+    skip = None
+    for index, at in enumerate(range(nnn, addr, 2)):
+      opcode = (self.memory[at] << 8) | self.memory[at + 1]
+      if skip is not None:
+        return None
+      if 0xF007 == opcode & 0xF0FF:
+        reads.append((index, (opcode & 0x0F00) >> 8))
+      elif opcode >> 12 in (0x3, 0x4, 0x5, 0x9) or opcode & 0xF0FF in (0xE09E, 0xE0A1):
+        skip = opcode
+      else:
+        return None
+    return (bytes(self.memory[nnn:addr]), tuple(reads), skip)
+
+  def _skip_taken(self, opcode, V):
+    # Whether the skip instruction opcode skips, with registers V.
+    x = (opcode & 0x0F00) >> 8
+    family = opcode >> 12
+    if 0x3 == family:
+      return V[x] == opcode & 0x00FF
+    if 0x4 == family:
+      return V[x] != opcode & 0x00FF
+    if 0x5 == family:
+      return V[x] == V[(opcode & 0x00F0) >> 4]
+    if 0x9 == family:
+      return V[x] != V[(opcode & 0x00F0) >> 4]
+    pressed = self.keyboard[V[x] % len(self.keyboard)]
+    return pressed if 0x9E == opcode & 0x00FF else not pressed
+
+  def _idle_jmp(self, nnn, code, reads, skip):
+    # 0x1nnn closing a polling loop, see _idle_loop(). Jumps, then, when
+    # run from _run(), executes the following iterations of the loop at
+    # once for as long as they would stay in the loop, without going past
+    # _cycle_limit. Iterations whose LD Vx, DT all read the delay timer in
+    # the same frame behave the same, so they are skipped a frame at a time
+    # (or all at once once the timer is 0, or if it is not read).
+    self.pc = nnn
+    limit = self._cycle_limit
+    if limit is None or self.memory[nnn:nnn + len(code)] != code:
+      return
+
+    length = len(code) // 2 + 1 # Instructions per iteration.
+    frame_cycles = self.cycles_per_frame
+    value, set_frame = self._delay
+    cycles = self.cycles
+    while cycles + length <= limit:
+      # Registers after the iteration starting at cycles.
+      frames = [(cycles + 1 + index) // frame_cycles for index, x in reads]
+      values = [max(value - (frame - set_frame), 0) for frame in frames]
+      registers = list(self.V)
+      for (index, x), read in zip(reads, values):
+        registers[x] = read
+      if skip is not None and self._skip_taken(skip, registers):
+        break
+
+      # Number of iterations that will do exactly the same.
+      if not reads or 0 == values[0]:
+        if float('inf') == limit:
+          break # Waiting forever, nothing to gain.
+        count = (limit - cycles) // length
+      elif frames[0] == frames[-1]:
+        last = reads[-1][0]
+        count = min(((frames[0] + 1) * frame_cycles - 2 - last - cycles) // length + 1,
+            (limit - cycles) // length)
+      else:
+        count = 1
+
+      for index, x in reads:
+        self.V[x] = registers[x]
+      cycles = cycles + count * length
+    self.cycles = cycles
+
+  def enable_idle_skip(self):
+    ''' Fast-forward loops that only poll the delay timer or the keys, such
+    as LD V0, DT / SE V0, 0 / JP back, or a jump to itself, when running
+    with run_cycles(), run_frame() or run_until() without pc or predicate:
+    the iterations that can not leave the loop are executed at once, up to
+    the point where the delay timer or the end of the run could change the
+    outcome. The resulting state is the same as running them one by one.
+    Enabled by default. Not applied while statistics or memory tracking are
+    enabled. '''
+    self._idle_skip = True
+    self._decoded = [None] * len(self.memory)
+
+  def disable_idle_skip(self):
+    self._idle_skip = False
+    self._decoded = [None] * len(self.memory)
+
+  def profile_pairs(self, cycles):
+    ''' Execute cycles instructions and count how often each pair of opcode
+    families is executed back to back. Returns a collections.Counter keyed by
+    (family, following family), suitable for enable_fusion(). '''
+    pairs = collections.Counter()
+    previous = None
+    for i in range(cycles):
+      pc = self.pc
+      family = self.memory[pc] >> 4 if pc < len(self.memory) else None
+      if previous is not None and previous[0] + 2 == pc:
+        pairs[(previous[1], family)] += 1
+      previous = (pc, family)
+      self.emulate_cycle()
+    return pairs
+
+  def enable_fusion(self, profile=None, min_count=1):
+    ''' Execute adjacent instruction pairs from fusible_pairs as single
+    fused handlers. If profile, as returned by profile_pairs(), is given only
+    the pairs seen at least min_count times are fused. '''
+    pairs = self.fusible_pairs
+    if profile is not None:
+      pairs = frozenset(p for p in pairs if profile[p] >= min_count)
+    self._fused_pairs = pairs
+    self._fused_covered = set()
+    self._decoded = [None] * len(self.memory)
+
+  def disable_fusion(self):
+    self._fused_pairs = frozenset()
+    self._fused_covered = set()
+    self._decoded = [None] * len(self.memory)
+
+  @staticmethod
+  def _handler_name(handler):
+    # Name of a handler, fused handlers are named after their function.
+    return getattr(handler, '__name__', None) or handler.func.__name__
+
+  def _instrument(self, name, handler):
+    # Wrap handler to record its executions in the HandlerStats of name.
+    stats = self._stats.setdefault(name, HandlerStats())
+    histogram = stats.histogram
+    clock = time.perf_counter_ns
+    def instrumented():
+      start = clock()
+      handler()
+      elapsed = clock() - start
+      stats.count += 1
+      stats.time += elapsed
+      histogram[elapsed.bit_length()] += 1
+    return instrumented
+
+  def _track(self, handler, addr, n):
+    # Wrap handler, decoded at addr, to record the fetches of the
+    # instructions it executes, several for fused handlers, and the sprite
+    # it reads if it draws.
+    tracker = self.mem_tracker
+    name = self._handler_name(handler)
+    if '_fused_ldi_drw' == name:
+      n = handler.args[3]
+    elif '_op_drw' != name:
+      n = 0
+    def tracked():
+      first = self.cycles - 1
+      handler()
+      frame = first // self.cycles_per_frame
+      for fetch in range(addr, addr + 2*(self.cycles - first)):
+        tracker.record(tracker.fetches, fetch & 0xFFF, frame)
+      for yline in range(n):
+        tracker.record(tracker.reads, (self.I + yline) & 0xFFF, frame)
+    return tracked
+
+  # Accesses made by an instruction belong to the frame it started in, the
+  # cycle counter being incremented before it is executed.
+
+  def _tracked_read(self, addr):
+    self.mem_tracker.record(self.mem_tracker.reads, addr & 0xFFF,
+        (self.cycles - 1) // self.cycles_per_frame)
+    return Cpu.read(self, addr)
+
+  def _tracked_write(self, byte, addr):
+    self.mem_tracker.record(self.mem_tracker.writes, addr & 0xFFF,
+        (self.cycles - 1) // self.cycles_per_frame)
+    Cpu.write(self, byte, addr)
+
+  def enable_mem_tracking(self, tracker=None):
+    ''' Record the guest memory accesses of the instructions executed by
+    the Cpu in tracker, a new memtrack.MemoryTracker by default, and return
+    it. Like enable_stats() this drops the decode cache and costs nothing
+    once disabled. '''
+    if tracker is None:
+      tracker = memtrack.MemoryTracker(len(self.memory))
+    self.mem_tracker = tracker
+    self.read = self._tracked_read
+    self.write = self._tracked_write
+    self._decoded = [None] * len(self.memory)
+    return tracker
+
+  def disable_mem_tracking(self):
+    if self.mem_tracker is not None:
+      self.mem_tracker = None
+      del self.read
+      del self.write
+      self._decoded = [None] * len(self.memory)
+
+  def enable_stats(self):
+    ''' Count and time the executions of every handler, see stats(). Only
+    instructions executed by the Cpu itself are recorded, not the ones run
+    by a translator block. The decode cache is dropped so that every handler
+    gets wrapped; when disabled handlers run unwrapped and cost nothing. '''
+    if self._stats is None:
+      self._stats = {}
+      self._decoded = [None] * len(self.memory)
+
+  def disable_stats(self):
+    ''' Stop recording, dropping the statistics. '''
+    if self._stats is not None:
+      self._stats = None
+      self._decoded = [None] * len(self.memory)
+
+  def stats(self):
+    ''' Return {handler name: HandlerStats} recorded since enable_stats(). '''
+    return dict(self._stats or {})
+
+  def stats_report(self):
+    ''' Return the recorded statistics as a table, the handlers taking the
+    most time first. '''
+    stats = sorted(self.stats().items(), key=lambda item: item[1].time, reverse=True)
+    total = sum(item.time for name, item in stats) or 1
+    lines = ['{:<16} {:>10} {:>10} {:>6} {:>8} {:>8} {:>8}'.format(
+        'handler', 'count', 'total ms', 'time %', 'mean ns', 'p50 ns', 'p99 ns')]
+    for name, item in stats:
+      lines.append('{:<16} {:>10} {:>10.3f} {:>6.1f} {:>8.0f} {:>8} {:>8}'.format(
+          name, item.count, item.time / 1e6, 100 * item.time / total,
+          item.time / item.count if item.count else 0,
+          item.percentile(0.5), item.percentile(0.99)))
+    return '\n'.join(lines)
+
+  def _invalidate(self, addr):
+    # Drop cached decodes of every instruction overlapping addr, i.e. the
+    # ones starting at addr and at addr - 1, or further back when addr is
+    # covered by a fused entry. Addresses that were never decoded are plain
+    # data and need no further work.
+    span = 2 * self.max_fused if addr in self._fused_covered else 2
+    for start in range(addr - span + 1, addr + 1):
+      start = start & 0xFFF
+      if self._decoded[start] is not None:
+        self._decoded[start] = None
+        for listener in self._code_listeners:
+          listener(start)
+
   def _pop(self):
     if self.sp <= -1:
       raise StackPointerOutOfRange
@@ -112,7 +602,7 @@ class Cpu:
     return item
 
   def _push(self, item):
-    if self.sp >= len(self.stack):
+    if self.sp + 1 >= len(self.stack):
       raise StackPointerOutOfRange
     self.sp += 1
     self.stack[self.sp] = item
@@ -145,9 +635,9 @@ class Cpu:
     hundreds = self.V[self._x] // 100 # Integer division.
     tens = (self.V[self._x] - hundreds*100) // 10 # Integer division.
     ones = self.V[self._x] - hundreds*100 - tens*10
-    self.memory[self.I] = hundreds
-    self.memory[self.I + 1] = tens
-    self.memory[self.I + 2] = ones
+    self.write(hundreds, self.I)
+    self.write(tens, self.I + 1)
+    self.write(ones, self.I + 2)
 
   def _op_ldf(self):
     # 0xFx29 - LD F, Vx - Set I = location of sprite for digit Vx. In
@@ -183,18 +673,43 @@ class Cpu:
     for i in range(len(self.keyboard)):
       if self.keyboard[i]:
         self.V[self._x] = i
-        break;
-
-    # When we get out of the loop above there are two possibilities:
-    # 1. The key was pressed, meaning that i is the index into the keyboard
-    # list indicating a given key was pressed. In this case everthing
-    # that needs to be done was already done.
-    # 2. The key was not pressed, meaning that i will be equal to the
-    # len(self.keyboard)-1. In this case we need to change the program
-    # counter back to its original value and stop all execution.
-    if not self.keyboard[i]:
-      self.pc = self.pc - 2
-      return # Stop all execution.
+        return
+
+    # No key is down: block on this instruction, see _end_key_wait(), and
+    # stop the batch run if there is one.
+    self.pc = self.pc - 2
+    self.key_wait = self._x
+    raise _KeyWait
+
+  def _end_key_wait(self):
+    # Complete the blocked LD Vx, K with the key pressed since it blocked,
+    # even if released again, or else a key that is down, taking one cycle
+    # as executing it again would. Returns True if it was completed.
+    key = self.key_pressed
+    if key is None:
+      for i in range(len(self.keyboard)):
+        if self.keyboard[i]:
+          key = i
+          break
+      else:
+        return False
+    self.V[self.key_wait] = key
+    self.key_wait = None
+    self.key_pressed = None
+    self.pc = self.pc + 2
+    self.cycles = self.cycles + 1
+    return True
+
+  def press_key(self, key):
+    ''' Press keypad key, 0x0 to 0xF. A blocked LD Vx, K completes with the
+    first key pressed on the next cycle, even if the key is released
+    before. '''
+    self.keyboard[key] = True
+    if self.key_wait is not None and self.key_pressed is None:
+      self.key_pressed = key
+
+  def release_key(self, key):
+    self.keyboard[key] = False
 
   def _op_ldv(self):
       # 0xFx07 - LD Vx, DT, Set Vx = delay timer value.
@@ -227,21 +742,24 @@ class Cpu:
     # around to the oposite side of the screen. Each bit corresponds to a single pixel.
     self.draw_flag = True # Let the outside world know that display needs to be updated.
     self.V[0xF] = 0
-    for yline in range(self._n):
-      byte = self.read(self.I + yline)
-      for xline in range(8):
-        pixel = byte & (0x80 >> xline)
-        if 0 != pixel:
-          if(1 == self.gfx[(self.V[self._y] + yline) % self.rows][(self.V[self._x] + xline) % self.cols]):
-            self.V[0xF] = 1
-          self.gfx[(self.V[self._y] + yline) % self.rows][(self.V[self._x] + xline) % self.cols] ^= 1
+    if self.I + self._n <= len(self.memory):
+      sprite = self.memory[self.I:self.I + self._n]
+    else:
+      sprite = [self.memory[(self.I + yline) & 0xFFF] for yline in range(self._n)]
+    if self.framebuffer.draw(self.V[self._x], self.V[self._y], sprite):
+      self.V[0xF] = 1
 
   def _op_rnd(self):
     # 0xCxkk - RND Vx, byte - Set Vx = random byte AND kk.
     # The interpreter generates a random number from 0 to 255, which is 
     # then ANDed with the value kk. The results are stored in Vx.
-    random.seed()
-    self.V[self._x] = random.randrange(0x100)
+    pos = self._random_pos
+    if pos == len(self._random_pool):
+      self._random_k = self._random_k + 1
+      self._random_pool = random_pool(self.seed, self._random_k)
+      pos = 0
+    self._random_pos = pos + 1
+    self.V[self._x] = self._random_pool[pos]
 
     # Check if we are in the test mode and store a copy of V[x] in the 
     # V[x + 1].
@@ -372,7 +890,7 @@ class Cpu:
 
   def _op_cls(self):
     # Clear the display.
-    self.gfx = [[0 for col in range(self.cols)] for row in range(self.rows)]
+    self.framebuffer.clear()
 
 
   def __str__(self):
@@ -398,18 +916,56 @@ class Cpu:
 
     return mystr
 
+  def _timer(self, timer):
+    value, frame = timer
+    elapsed = self.cycles // self.cycles_per_frame - frame
+    return value - elapsed if value > elapsed else 0
+
+  @property
+  def gfx(self):
+    # Display indexed as gfx[row][col], backed by the framebuffer.
+    return self.framebuffer.gfx
+
+  @gfx.setter
+  def gfx(self, gfx):
+    self.framebuffer.load(gfx)
+
+  @property
+  def delay_timer(self):
+    return self._timer(self._delay)
+
+  @delay_timer.setter
+  def delay_timer(self, value):
+    self._delay = (value, self.cycles // self.cycles_per_frame)
+
+  @property
+  def sound_timer(self):
+    # NOTE: make a sound while this is not zero.
+    return self._timer(self._sound)
+
+  @sound_timer.setter
+  def sound_timer(self, value):
+    self._sound = (value, self.cycles // self.cycles_per_frame)
+
   def reset(self):
     self.pc = 0x200 # Program starts at 0x200
     self.I = 0x0000 # Reset index register.
     self.sp = -1 # Reset stack pointer.
     self.test = False # Is the chip in the test mode?
     self.draw_flag = False
+    self.cycles = 0 # Number of instructions executed since reset.
+
+    # Register LD Vx, K is waiting to store a key in, None if not blocked,
+    # and the first key pressed since, see press_key(). While blocked pc
+    # stays on the instruction.
+    self.key_wait = None
+    self.key_pressed = None
 
     # Reset the keypad. If keypad[x] is True then key x is pressed, otherwise key x is not pressed.
     self.keyboard = [False] * 16
 
     # Clear display
-    self.gfx = [[0 for col in range(type(self).cols)] for row in range(type(self).rows)]
+    self.framebuffer.clear()
 
     # Clear stack
     self.stack = [0] * 16
@@ -417,63 +973,225 @@ class Cpu:
     # Clear registers V0-VF
     self.V = [0] * 16
 
-    # Clear memory
-    self.memory = [0] * 4096 
-
-    # Reset timers.
-    self.delay_timer = 0x0
-    self.sound_timer = 0x0
+    # Clear memory and load font set, reusing the existing memory.
+    self.memory[:] = self._initial_memory
+
+    # Clear decode cache. Entry at addr holds the decoded instruction
+    # starting at addr, or None if it has not been decoded yet.
+    self._decoded = [None] * len(self.memory)
+
+    # Reset timers. Each timer is kept as the value it was last set to and
+    # the frame it was set in, and counts down lazily from there.
+    self._delay = (0x0, 0)
+    self._sound = (0x0, 0)
+
+    # RND bytes: the current pool, its number and the next byte in it.
+    self._random_k = 0
+    self._random_pool = random_pool(self.seed, 0)
+    self._random_pos = 0
+
+  def snapshot(self):
+    ''' Return the complete machine state as a compact binary blob, see
+    restore(). '''
+    keys = 0
+    for key in reversed(range(len(self.keyboard))):
+      keys = (keys << 1) | (1 if self.keyboard[key] else 0)
+    header = self._snapshot_header.pack(self._snapshot_magic,
+        self._snapshot_version, self.pc, self.I, self.sp, bytes(self.V),
+        *self.stack, self.delay_timer, self.sound_timer, self.cycles, keys,
+        self.seed, self._random_k, self._random_pos,
+        -1 if self.key_wait is None else self.key_wait,
+        -1 if self.key_pressed is None else self.key_pressed)
+    return b''.join((header, self.memory, self.framebuffer.pack()))
+
+  def restore(self, blob):
+    ''' Restore the machine state from a blob returned by snapshot(). '''
+    if len(blob) < 5 or blob[:4] != self._snapshot_magic:
+      raise InvalidSnapshot('not a snapshot')
+    if blob[4] not in self._snapshot_headers:
+      raise InvalidSnapshot('version = {}'.format(blob[4]))
+    header = self._snapshot_headers[blob[4]]
+    header_size = header.size
+    if len(blob) != header_size + len(self.memory) + self.rows*self.cols // 8:
+      raise InvalidSnapshot('not a snapshot')
+    fields = header.unpack_from(blob)
+
+    self.pc, self.I, self.sp, V = fields[2:6]
+    self.V = list(V)
+    self.stack = list(fields[6:22])
+    self.cycles = fields[24]
+    self.delay_timer = fields[22]
+    self.sound_timer = fields[23]
+    self.keyboard = [bool((fields[25] >> key) & 1) for key in range(len(self.keyboard))]
+    self.draw_flag = False
+    self.key_pressed = None
+    if fields[1] >= 2:
+      self.seed, self._random_k, self._random_pos, key_wait = fields[26:30]
+      self._random_pool = random_pool(self.seed, self._random_k)
+      self.key_wait = None if key_wait < 0 else key_wait
+      if fields[1] >= 3 and fields[30] >= 0:
+        self.key_pressed = fields[30]
+    else:
+      # pc is on the LD Vx, K, which blocks again. The RND generator
+      # carries on from where it is.
+      self.key_wait = None
 
-    # Load font set.
-    self.memory[0:80] = type(self).font_set[0:80]
+    end = header_size + len(self.memory)
+    self.memory[:] = blob[header_size:end]
+    self._decoded = [None] * len(self.memory)
+    self.framebuffer.unpack(blob[end:])
 
   def load_app(self, file_name):
     self.reset()
     with open(file_name, 'rb') as f:
-      # Read one byte at a time.
-      i = 0
-      byte = f.read(1)
-      while byte:
-        # Copy each byte into chip8 memory.
-        # self.write(int.from_bytes(byte, byteorder ='little'), 0x200 + i)
-        self.write(struct.unpack('B', byte)[0], 0x200 + i)
-        byte = f.read(1)
-        i = i + 1
+      # Read the whole application straight into memory at 0x200, anything
+      # past the end of memory is ignored.
+      f.readinto(memoryview(self.memory)[0x200:])
+
+  def load_image(self, image):
+    ''' Reset and load image, any bytes-like object (bytes, memoryview,
+    mmap, ...) holding an application, into memory at 0x200. '''
+    self.reset()
+    image = memoryview(image)[:len(self.memory) - 0x200]
+    self.memory[0x200:0x200 + len(image)] = image
 
   def emulate_cycle(self):
     # Check the program counter.
-    if self.pc >= len(self.memory):
+    if self.pc + 1 >= len(self.memory):
       raise ProgramCounterOutOfRange('pc = {}'.format(self.pc))
 
     # Check the stack pointer.
     if self.sp < -1 or self.sp >= len(self.stack):
-      raise StackPointerOutOfRange('sp = {}'.format(self.spdefaultdict))
+      raise StackPointerOutOfRange('sp = {}'.format(self.sp))
 
     self.draw_flag = False
 
-    # Update timers
-    if self.delay_timer > 0:
-      self.delay_timer = self.delay_timer - 1
-
-    if self.sound_timer > 0:
-      # NOTE: make a sound.
-      self.sound_timer = self.sound_timer - 1
+    # Waiting for a key, time passes until one is down.
+    if self.key_wait is not None:
+      if not self._end_key_wait():
+        self.cycles = self.cycles + 1
+      return
 
-    # Fetch opcode
-    opcode = (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
+    # Fetch and decode, unless this address was already decoded.
+    decoded = self._decoded[self.pc]
+    if decoded is None:
+      decoded = self._decode_at(self.pc)
+      self._decoded[self.pc] = decoded
 
     # Update program counter.
     self.pc = self.pc + 2
-
-    # Decode.
-    self._nnn = opcode & 0x0FFF
-    self._nn  = opcode & 0x00FF
-    self._n   = opcode & 0x000F
-    self._x   = (opcode & 0x0F00) >> 8
-    self._y   = (opcode & 0x00F0) >> 4
+    self.cycles = self.cycles + 1
 
     # Execute.
-    self._main_optbl.setdefault((opcode & 0xF000) >> 12, self._unsupported_opcode)()
+    handler, self._nnn, self._nn, self._n, self._x, self._y = decoded
+    try:
+      handler()
+    except _KeyWait:
+      pass
+
+  def _run(self, cycles, stop_on_draw=False, stop_pc=None, predicate=None):
+    # Same as calling emulate_cycle() until cycles instructions have been
+    # executed or a stop condition is met, with the lookups hoisted out of
+    # the loop.
+    if self.sp < -1 or self.sp >= len(self.stack):
+      raise StackPointerOutOfRange('sp = {}'.format(self.sp))
+
+    start = self.cycles
+    end = start + cycles
+
+    # Nothing runs while waiting for a key.
+    if self.key_wait is not None and not self._end_key_wait():
+      self.draw_flag = False
+      return RunResult(0, 0, 'key_wait')
+
+    # Polling loops may be fast-forwarded, and fused instructions run, up to
+    # end, unless every instruction has to be checked against stop_pc or
+    # predicate.
+    if stop_pc is None and predicate is None:
+      self._cycle_limit = end
+    try:
+      frames, reason = self._run_loop(end, stop_on_draw, stop_pc, predicate)
+    finally:
+      self._cycle_limit = None
+
+    self.draw_flag = frames > 0
+    return RunResult(self.cycles - start, frames, reason)
+
+  def _run_loop(self, end, stop_on_draw, stop_pc, predicate):
+    decoded_cache = self._decoded
+    decode_at = self._decode_at
+    size = len(decoded_cache)
+    frames = 0
+    reason = 'cycles'
+
+    # Fused handlers run several instructions before stop_pc and predicate
+    # can be checked: instructions are then decoded one by one, the cache
+    # holding fused ones.
+    fuse = not self._fused_pairs or (stop_pc is None and predicate is None)
+
+    try:
+      while self.cycles < end:
+        pc = self.pc
+        if pc + 1 >= size:
+          raise ProgramCounterOutOfRange('pc = {}'.format(pc))
+
+        self.draw_flag = False
+
+        if fuse:
+          decoded = decoded_cache[pc]
+          if decoded is None:
+            decoded = decode_at(pc)
+            decoded_cache[pc] = decoded
+        else:
+          decoded = decode_at(pc, False)
+
+        self.pc = pc + 2
+        self.cycles = self.cycles + 1
+
+        handler, self._nnn, self._nn, self._n, self._x, self._y = decoded
+        handler()
+
+        if self.draw_flag:
+          frames = frames + 1
+          if stop_on_draw:
+            reason = 'draw'
+            break
+        if self.pc == stop_pc:
+          reason = 'pc'
+          break
+        if predicate is not None and predicate(self):
+          reason = 'predicate'
+          break
+    except _KeyWait:
+      reason = 'key_wait'
+
+    return frames, reason
+
+  def run_cycles(self, cycles):
+    ''' Execute cycles instructions. Returns a RunResult; draw_flag is left
+    set if any of the instructions drew on the screen. Returns early, with
+    reason 'key_wait', if LD Vx, K blocks waiting for a key; see
+    press_key(). '''
+    return self._run(cycles)
+
+  def run_frame(self):
+    ''' Execute instructions up to the next frame boundary, i.e. until
+    cycles is a multiple of cycles_per_frame. If LD Vx, K blocks the rest
+    of the frame passes without executing anything. '''
+    end = self.cycles + self.cycles_per_frame - self.cycles % self.cycles_per_frame
+    result = self._run(end - self.cycles)
+    if 'key_wait' == result.reason:
+      self.cycles = end
+    return result
+
+  def run_until(self, predicate=None, pc=None, draw=False, max_cycles=None):
+    ''' Execute instructions until predicate(cpu) returns True, the program
+    counter reaches pc, or an instruction draws on the screen when draw is
+    True. If max_cycles is given at most that many instructions are
+    executed, otherwise there is no limit. '''
+    if max_cycles is None:
+      max_cycles = float('inf')
+    return self._run(max_cycles, draw, pc, predicate)
 
   def print_gfx(self):
     for row in range(self.rows):
@@ -501,11 +1219,14 @@ class Cpu:
 
     self.memory[addr] = (opcode & 0xFF00) >> 8
     self.memory[addr+1] = (opcode & 0xFF)
+    self._invalidate(addr)
+    self._invalidate(addr + 1)
 
   def write(self, byte, addr):
     # Make sure address is in the 4KB range.
     addr = addr & 0xFFF
-    self.memory[addr] = byte
+    self.memory[addr] = byte & 0xFF
+    self._invalidate(addr)
 
   def read_opcode(self, addr):
     # Make sure address is in the 4KB range.
@@ -522,120 +1243,184 @@ class Cpu:
     return self.memory[addr & 0xFFF]
 
   def clear_memory(self):
-    self.memory[0x200:len(self.memory)] = [0] * (len(self.memory) - 0x200)
-
-class Block(pygame.sprite.Sprite):
-  def __init__(self, row, col, gfx):
-    pygame.sprite.Sprite.__init__(self)
-    self.image = pygame.Surface((10, 10)).convert()
-    self.image.fill((255, 255, 255))
-    self.rect = self.image.get_rect()
-    self.rect.left = col*10
-    self.rect.top = row*10
-    self.row = row
-    self.col = col
-    self.gfx = gfx
-
-  def update(self):
-    if self.gfx[self.row][self.col]:
-      self.image.fill((255, 255, 255))
-    else:
-      self.image.fill((0, 0, 0))
+    self.memory[0x200:len(self.memory)] = bytes(len(self.memory) - 0x200)
+    self._decoded = [None] * len(self.memory)
 
 class Emulator:
-  def __init__(self):
-    self._cpu = Cpu()
-
-  def _press_key(self, key, keyboard, is_down):
-    if pygame.K_1 == key:
-      self._cpu.keyboard[0x1] = is_down
-    elif pygame.K_2 == key:
-      self._cpu.keyboard[0x2] = is_down
-    elif pygame.K_3 == key:
-      self._cpu.keyboard[0x3] = is_down
-    elif pygame.K_4 == key:
-      self._cpu.keyboard[0xC] = is_down
-    elif pygame.K_q == key:
-      self._cpu.keyboard[0x4] = is_down
-    elif pygame.K_w == key:
-      self._cpu.keyboard[0x5] = is_down
-    elif pygame.K_e == key:
-      self._cpu.keyboard[0x6] = is_down
-    elif pygame.K_r == key:
-      self._cpu.keyboard[0xD] = is_down
-    elif pygame.K_a == key:
-      self._cpu.keyboard[0x7] = is_down
-    elif pygame.K_s == key:
-      self._cpu.keyboard[0x8] = is_down
-    elif pygame.K_d == key:
-      self._cpu.keyboard[0x9] = is_down
-    elif pygame.K_f == key:
-      self._cpu.keyboard[0xE] = is_down
-    elif pygame.K_z == key:
-      self._cpu.keyboard[0xA] = is_down
-    elif pygame.K_x == key:
-      self._cpu.keyboard[0x0] = is_down
-    elif pygame.K_c == key:
-      self._cpu.keyboard[0xB] = is_down
-    elif pygame.K_v == key:
-      self._cpu.keyboard[0xF] = is_down
+  def __init__(self, display=None, history=None, stats=None, trace=None,
+      movie=None, seed=None):
+    self._cpu = Cpu(seed=seed)
+    # Display backend, see the display module. A pygame window by default.
+    self._display = display
+    # rewind.RewindBuffer recording every frame, if rewinding is wanted.
+    self.history = history
+    # File the per-handler statistics are written to when run() returns, if
+    # they are wanted.
+    self._stats = stats
+    if stats is not None:
+      self._cpu.enable_stats()
+    # Binary file run() records an execution trace to, see the tracer
+    # module, if one is wanted. Rewinding would break the trace.
+    self._trace = trace
+    # Binary file run() writes the movie.Movie of the keys pressed to, if
+    # one is wanted, and the movie being recorded since load_app().
+    self._movie_file = movie
+    self.movie = None
+
+  def _press_key(self, key, is_down):
+    # key is the chip8 keypad key, 0x0 to 0xF.
+    if is_down:
+      self._cpu.press_key(key)
+    else:
+      self._cpu.release_key(key)
+    if self.movie is not None:
+      # Keys change between frames, this one is the next to run.
+      self.movie.record(self._cpu.cycles // self._cpu.cycles_per_frame, self._cpu.keyboard)
 
   def load_app(self, file_name):
-    self._cpu.load_app(file_name)
-
-  def run(self):
-    # I - Initialize.
-    pygame.init()
-
-    # D - Display.
-    display = pygame.display.set_mode((640, 320))
-
-    # E - Entities.
-    background = pygame.Surface(display.get_size())
-    background.fill((0, 0, 0))
-    background = background.convert()
-    all_sprites = pygame.sprite.Group()
-    for row in range(self._cpu.rows):
-      for col in range(self._cpu.cols):
-        all_sprites.add(Block(row, col, self._cpu.gfx))
-
-    # A - Action.
-    clock = pygame.time.Clock()
+    with open(file_name, 'rb') as f:
+      image = f.read()
+    self._cpu.load_image(image)
+    if self._movie_file is not None:
+      self.movie = movie.Movie.for_cpu(self._cpu, image)
+    if self.history is not None:
+      self.history.clear()
+      self.history.push(self._cpu.snapshot())
+
+  def rewind(self, frames=1):
+    ''' Go back frames frames in the recorded history. '''
+    self._cpu.restore(self.history.rewind(frames))
+
+  def save_state(self, file_name):
+    with open(file_name, 'wb') as f:
+      f.write(self._cpu.snapshot())
+
+  def load_state(self, file_name):
+    with open(file_name, 'rb') as f:
+      self._cpu.restore(f.read())
+
+  def run(self, frames=None):
+    ''' Run the loaded application until the display backend asks to quit
+    or, if given, for the number of frames. '''
+    if self._display is None:
+      self._display = display.PygameDisplay()
+    self._display.open(self._cpu.framebuffer)
+    writer = None
+    if self._trace is not None:
+      writer = tracer.TraceWriter(self._trace, self._cpu)
+
+    frame = 0
     keep_going = True
-
-    # A - Assign values.
-    # L - Loop.
-    while keep_going:
-
-      # T - Timing.
-      clock.tick(60) # 60 Frames per second.
-
-      self._cpu.emulate_cycle()
-
-      # E - Events.
-      for event in pygame.event.get():
-        if pygame.QUIT == event.type:
-          keep_going = False
-        elif pygame.KEYDOWN == event.type:
-          self._press_key(event.key, self._cpu.keyboard, True)
-        elif pygame.KEYUP == event.type:
-          self._press_key(event.key, self._cpu.keyboard, False)
-
-      # R - Refresh display.
-      if self._cpu.draw_flag:
-        all_sprites.clear(display, background)
-        all_sprites.update()
-        all_sprites.draw(display)
-        pygame.display.flip()
+    rewinding = False
+    try:
+      while keep_going and (frames is None or frame < frames):
+        # T - Timing.
+        self._display.tick()
+
+        if rewinding:
+          self.rewind()
+        elif writer is not None:
+          writer.run_frame()
+        else:
+          self._cpu.run_frame()
+          if self.history is not None:
+            self.history.push(self._cpu.snapshot())
+        frame = frame + 1
+        if self.movie is not None:
+          self.movie.frames = self._cpu.cycles // self._cpu.cycles_per_frame
+
+        # E - Events.
+        rewinding = False
+        for event in self._display.poll():
+          if 'quit' == event[0]:
+            keep_going = False
+          elif 'key' == event[0]:
+            self._press_key(event[1], event[2])
+          elif 'rewind' == event[0] and self.history is not None:
+            rewinding = True
+
+        # R - Refresh display, only where DRW and CLS changed it.
+        self._display.render()
+    finally:
+      self._display.close()
+      if writer is not None:
+        writer.close()
+      if self.movie is not None:
+        self.movie.write(self._movie_file)
+      if self._stats is not None:
+        self._stats.write(self._cpu.stats_report() + '\n')
 
 def main():
-  usage = '{} <file name>'.format(__file__)
-  if 2 != len(sys.argv):
-    print(usage)
-    sys.exit()
-  emulator = Emulator()
-  emulator.load_app(sys.argv[1])
-  emulator.run()
+  parser = argparse.ArgumentParser(description='chip8 emulator.')
+  parser.add_argument('file_name', help='application to run')
+  parser.add_argument('--headless', action='store_true',
+      help='do not open a window, use the null display unless --display says otherwise')
+  parser.add_argument('--display', choices=('pygame', 'terminal', 'image', 'null'),
+      help='display backend, pygame by default')
+  parser.add_argument('--frames', type=int,
+      help='stop after this many frames')
+  parser.add_argument('--scale', type=int, default=10,
+      help='size of a chip8 pixel in the pygame window')
+  parser.add_argument('--image-dir', default='frames',
+      help='directory the image display writes frames to')
+  parser.add_argument('--rewind', type=int, metavar='SECONDS',
+      help='keep this many seconds of history to rewind through with backspace')
+  parser.add_argument('--stats', action='store_true',
+      help='print how often and how long every opcode handler ran on exit')
+  parser.add_argument('--trace', metavar='FILE',
+      help='record an execution trace to FILE, see tracer.py to read it')
+  parser.add_argument('--seed', type=int,
+      help='seed of the RND bytes, from the system entropy by default')
+  parser.add_argument('--record', metavar='MOVIE',
+      help='record the keys pressed to MOVIE')
+  parser.add_argument('--play', metavar='MOVIE',
+      help='play MOVIE back without a window, as fast as possible, and print the final state')
+  args = parser.parse_args()
+
+  if args.play:
+    with open(args.play, 'rb') as f:
+      recording = movie.Movie.read(f)
+    with open(args.file_name, 'rb') as f:
+      image = f.read()
+    start = time.perf_counter()
+    cpu = recording.play(Cpu(), image, args.frames)
+    print('{} frames, {} cycles in {:.2f}s, display {}'.format(
+        cpu.cycles // cpu.cycles_per_frame, cpu.cycles,
+        time.perf_counter() - start, roms.rom_hash(cpu.framebuffer.pack())))
+    return
+
+  name = args.display
+  if name is None:
+    name = 'null' if args.headless else 'pygame'
+  if args.headless and 'pygame' == name:
+    parser.error('--headless can not be used with the pygame display')
+  if args.trace and args.rewind:
+    parser.error('--trace can not be used with --rewind')
+  if args.record and args.rewind:
+    parser.error('--record can not be used with --rewind')
+
+  kwargs = {}
+  if 'pygame' == name:
+    kwargs['scale'] = args.scale
+  elif 'image' == name:
+    kwargs['directory'] = args.image_dir
+
+  history = None
+  if args.rewind:
+    history = rewind.RewindBuffer(max_frames=60*args.rewind)
+
+  trace = open(args.trace, 'wb') if args.trace else None
+  recording = open(args.record, 'wb') if args.record else None
+  try:
+    emulator = Emulator(display.create(name, **kwargs), history,
+        sys.stderr if args.stats else None, trace, recording, args.seed)
+    emulator.load_app(args.file_name)
+    emulator.run(args.frames)
+  finally:
+    if trace is not None:
+      trace.close()
+    if recording is not None:
+      recording.close()
 
 if '__main__' == __name__:
   main()
@@ -0,0 +1,274 @@
+''' chip8 disassembler and control flow analysis.
+
+analyze() follows the control flow of an application from 0x200 through
+jumps, calls and skips, and splits the code reached into basic blocks. The
+bytes of the application never reached are data. JP V0, addr jumps can not
+be followed and are reported, as are the stores, LD [I], Vx and LD B, Vx,
+that may write over code. Analyses are kept by application hash, analyzing
+the same application again is free. '''
+
+import argparse
+import collections
+import roms
+import sys
+
+def mnemonic(opcode):
+  ''' Return the assembly of opcode, e.g. 'DRW V0, V1, 5', or 'DW 0xnnnn'
+  when it is not an instruction. '''
+  nnn = opcode & 0x0FFF
+  nn  = opcode & 0x00FF
+  n   = opcode & 0x000F
+  x   = (opcode & 0x0F00) >> 8
+  y   = (opcode & 0x00F0) >> 4
+  family = (opcode & 0xF000) >> 12
+
+  if 0x0 == family:
+    if 0x00E0 == opcode:
+      return 'CLS'
+    if 0x00EE == opcode:
+      return 'RET'
+    return 'SYS 0x{:03X}'.format(nnn)
+  if 0x1 == family:
+    return 'JP 0x{:03X}'.format(nnn)
+  if 0x2 == family:
+    return 'CALL 0x{:03X}'.format(nnn)
+  if 0x3 == family:
+    return 'SE V{:X}, 0x{:02X}'.format(x, nn)
+  if 0x4 == family:
+    return 'SNE V{:X}, 0x{:02X}'.format(x, nn)
+  if 0x5 == family:
+    return 'SE V{:X}, V{:X}'.format(x, y)
+  if 0x6 == family:
+    return 'LD V{:X}, 0x{:02X}'.format(x, nn)
+  if 0x7 == family:
+    return 'ADD V{:X}, 0x{:02X}'.format(x, nn)
+  if 0x8 == family:
+    operations = {0x0 : 'LD', 0x1 : 'OR', 0x2 : 'AND', 0x3 : 'XOR',
+        0x4 : 'ADD', 0x5 : 'SUB', 0x7 : 'SUBN'}
+    if n in operations:
+      return '{} V{:X}, V{:X}'.format(operations[n], x, y)
+    if 0x6 == n:
+      return 'SHR V{:X}'.format(x)
+    if 0xE == n:
+      return 'SHL V{:X}'.format(x)
+  if 0x9 == family:
+    return 'SNE V{:X}, V{:X}'.format(x, y)
+  if 0xA == family:
+    return 'LD I, 0x{:03X}'.format(nnn)
+  if 0xB == family:
+    return 'JP V0, 0x{:03X}'.format(nnn)
+  if 0xC == family:
+    return 'RND V{:X}, 0x{:02X}'.format(x, nn)
+  if 0xD == family:
+    return 'DRW V{:X}, V{:X}, {}'.format(x, y, n)
+  if 0xE == family:
+    if 0x9E == nn:
+      return 'SKP V{:X}'.format(x)
+    if 0xA1 == nn:
+      return 'SKNP V{:X}'.format(x)
+  if 0xF == family:
+    formats = {
+      0x07 : 'LD V{:X}, DT',
+      0x0A : 'LD V{:X}, K',
+      0x15 : 'LD DT, V{:X}',
+      0x18 : 'LD ST, V{:X}',
+      0x1E : 'ADD I, V{:X}',
+      0x29 : 'LD F, V{:X}',
+      0x33 : 'LD B, V{:X}',
+      0x55 : 'LD [I], V{:X}',
+      0x65 : 'LD V{:X}, [I]',
+    }
+    if nn in formats:
+      return formats[nn].format(x)
+  return 'DW 0x{:04X}'.format(opcode)
+
+def disassemble_at(memory, addr):
+  ''' Return the instruction at addr in memory as '0x0200: 6005  LD V0, 0x05'. '''
+  opcode = (memory[addr] << 8) | memory[(addr + 1) % len(memory)]
+  return '0x{:04X}: {:04X}  {}'.format(addr, opcode, mnemonic(opcode))
+
+# Basic block from start to end, excluded, and the addresses control may go
+# to from it, the called subroutine included for CALL.
+Block = collections.namedtuple('Block', 'start end successors')
+
+def _successors(addr, opcode):
+  # Addresses control may go to after the instruction at addr, and whether
+  # the instruction ends a basic block.
+  family = opcode >> 12
+  if 0x00EE == opcode:
+    return (), True
+  if 0x1 == family:
+    return (opcode & 0x0FFF,), True
+  if 0x2 == family:
+    return (opcode & 0x0FFF, addr + 2), True
+  if family in (0x3, 0x4, 0x5, 0x9) or 0xE == family:
+    return (addr + 2, addr + 4), True
+  if 0xB == family:
+    return (), True
+  return (addr + 2,), False
+
+def _executable(opcode):
+  # Whether the Cpu has a handler for opcode.
+  text = mnemonic(opcode)
+  return not text.startswith('DW') and not text.startswith('SYS')
+
+class Analysis:
+
+  def __init__(self, image, origin=0x200):
+    self.image = bytes(image)
+    self.origin = origin
+    self.end = origin + len(self.image)
+    # Addresses of the instructions reached, the ones called and the
+    # instructions ending the flow, SYS and unknown opcodes.
+    self.code = set()
+    self.subroutines = set()
+    self.invalid = set()
+    # Addresses of the JP V0, addr jumps.
+    self.indirect = set()
+    self._explore()
+
+    # Bytes covered by instructions.
+    covered = set()
+    for addr in self.code:
+      covered.update((addr, addr + 1))
+    self.blocks = self._split()
+    self.data = self._data(covered)
+    self.self_modifying, self.unknown_stores = self._stores(covered)
+
+  def opcode(self, addr):
+    ''' Return the opcode at addr, None if it is not in the application. '''
+    if addr < self.origin or addr + 2 > self.end:
+      return None
+    offset = addr - self.origin
+    return (self.image[offset] << 8) | self.image[offset + 1]
+
+  def _explore(self):
+    # Recursive traversal from the entry point, with a work list.
+    pending = [self.origin]
+    while pending:
+      addr = pending.pop()
+      if addr in self.code or addr in self.invalid:
+        continue
+      opcode = self.opcode(addr)
+      if opcode is None or not _executable(opcode):
+        self.invalid.add(addr)
+        continue
+      self.code.add(addr)
+      if 0x2 == opcode >> 12:
+        self.subroutines.add(opcode & 0x0FFF)
+      elif 0xB == opcode >> 12:
+        self.indirect.add(addr)
+      pending.extend(_successors(addr, opcode)[0])
+
+  def _split(self):
+    # Leaders are the entry point and the targets of the instructions
+    # ending blocks. A block runs from one until an instruction ending it,
+    # the next leader or the end of the code reached.
+    leaders = {self.origin}
+    for addr in self.code:
+      targets, ends = _successors(addr, self.opcode(addr))
+      if ends:
+        leaders.update(targets)
+    blocks = {}
+    for start in sorted(leaders & self.code):
+      addr = start
+      while True:
+        targets, ends = _successors(addr, self.opcode(addr))
+        addr = addr + 2
+        if ends or addr in leaders or addr not in self.code:
+          break
+      blocks[start] = Block(start, addr, tuple(sorted(set(targets))))
+    return blocks
+
+  def _data(self, covered):
+    # Runs of the application bytes not covered by instructions.
+    regions = []
+    start = None
+    for addr in range(self.origin, self.end + 1):
+      if addr < self.end and addr not in covered:
+        if start is None:
+          start = addr
+      elif start is not None:
+        regions.append((start, addr))
+        start = None
+    return regions
+
+  def _stores(self, covered):
+    # Stores writing over code and stores whose I is not known, I being
+    # followed through LD I, addr in each block.
+    overwriting = set()
+    unknown = set()
+    for block in self.blocks.values():
+      I = None
+      for addr in range(block.start, block.end, 2):
+        opcode = self.opcode(addr)
+        if 0xA == opcode >> 12:
+          I = opcode & 0x0FFF
+        elif opcode & 0xF0FF in (0xF01E, 0xF029):
+          I = None
+        elif opcode & 0xF0FF in (0xF055, 0xF033):
+          if I is None:
+            unknown.add(addr)
+            continue
+          size = 3 if 0xF033 == opcode & 0xF0FF else ((opcode & 0x0F00) >> 8) + 1
+          if any(target in covered for target in range(I, I + size)):
+            overwriting.add(addr)
+    return overwriting, unknown
+
+  def listing(self):
+    ''' Return the disassembly of the application as lines of text, with a
+    label at every block and subroutine and the data as DB lines. '''
+    lines = []
+    data = dict(self.data)
+    for addr in sorted(self.code | set(data)):
+      if addr in data:
+        for start in range(addr, data[addr], 8):
+          chunk = self.image[start - self.origin:min(start + 8, data[addr]) - self.origin]
+          lines.append('0x{:04X}:       DB {}'.format(start,
+              ', '.join('0x{:02X}'.format(byte) for byte in chunk)))
+        continue
+      if addr in self.subroutines:
+        lines.append('sub_0x{:03X}:'.format(addr))
+      elif addr in self.blocks:
+        lines.append('loc_0x{:03X}:'.format(addr))
+      opcode = self.opcode(addr)
+      line = '0x{:04X}: {:04X}  {}'.format(addr, opcode, mnemonic(opcode))
+      if addr in self.indirect:
+        line = line + '  ; indirect jump'
+      if addr in self.self_modifying:
+        line = line + '  ; writes over code'
+      elif addr in self.unknown_stores:
+        line = line + '  ; writes to unknown address'
+      lines.append(line)
+    return lines
+
+# Analyses by application hash.
+_analyses = {}
+
+def analyze(image):
+  ''' Return the Analysis of image, an application loaded at 0x200,
+  computed once per distinct image. '''
+  key = roms.rom_hash(image)
+  if key not in _analyses:
+    _analyses[key] = Analysis(image)
+  return _analyses[key]
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Disassemble a chip8 application.')
+  parser.add_argument('file_name', help='application to disassemble')
+  parser.add_argument('--cfg', action='store_true',
+      help='print the basic blocks and their successors instead')
+  args = parser.parse_args(argv)
+
+  with open(args.file_name, 'rb') as f:
+    analysis = analyze(f.read())
+  if args.cfg:
+    for block in analysis.blocks.values():
+      print('0x{:03X}-0x{:03X} -> {}'.format(block.start, block.end,
+          ', '.join('0x{:03X}'.format(addr) for addr in block.successors)))
+  else:
+    for line in analysis.listing():
+      print(line)
+
+if '__main__' == __name__:
+  main()
@@ -0,0 +1,155 @@
+''' Display backends used by the chip8 Emulator.
+
+A backend is opened on a framebuffer, then once per frame the Emulator
+calls tick() to pace itself, poll() to collect input and render() to show
+what changed. poll() returns a list of events, each one of
+('key', key, is_down) with key being a chip8 keypad key, ('rewind',) to
+step back one frame, or ('quit',).
+Only PygameDisplay needs pygame, and it imports it when opened. '''
+
+import os
+import time
+
+class Display:
+  ''' Backend showing nothing and taking no input; the Emulator runs as
+  fast as it can. '''
+
+  def open(self, framebuffer):
+    self._framebuffer = framebuffer
+
+  def tick(self):
+    pass
+
+  def poll(self):
+    return []
+
+  def render(self):
+    # Nobody looks at the changes, drop them.
+    self._framebuffer.take_dirty()
+
+  def close(self):
+    pass
+
+NullDisplay = Display
+
+class PygameDisplay(Display):
+  ''' Window showing the display through renderer.SurfaceRenderer, at 60
+  frames per second, with the keypad mapped to the left side of a QWERTY
+  keyboard. Holding backspace rewinds. '''
+
+  def __init__(self, scale=10, palette=((0, 0, 0), (255, 255, 255))):
+    self.scale = scale # Size of a chip8 pixel on the screen.
+    self.palette = palette # Colors of unlit and lit pixels.
+
+  def open(self, framebuffer):
+    import pygame
+    import renderer
+    self._pygame = pygame
+    self._framebuffer = framebuffer
+
+    # I - Initialize.
+    pygame.init()
+
+    # D - Display.
+    screen = pygame.display.set_mode((framebuffer.cols*self.scale, framebuffer.rows*self.scale))
+
+    # E - Entities.
+    self._renderer = renderer.SurfaceRenderer(screen, framebuffer, self.scale, self.palette)
+    self._clock = pygame.time.Clock()
+    self._keymap = {
+      pygame.K_1 : 0x1, pygame.K_2 : 0x2, pygame.K_3 : 0x3, pygame.K_4 : 0xC,
+      pygame.K_q : 0x4, pygame.K_w : 0x5, pygame.K_e : 0x6, pygame.K_r : 0xD,
+      pygame.K_a : 0x7, pygame.K_s : 0x8, pygame.K_d : 0x9, pygame.K_f : 0xE,
+      pygame.K_z : 0xA, pygame.K_x : 0x0, pygame.K_c : 0xB, pygame.K_v : 0xF,
+    }
+
+  def tick(self):
+    self._clock.tick(60) # 60 Frames per second.
+
+  def poll(self):
+    pygame = self._pygame
+    events = []
+    for event in pygame.event.get():
+      if pygame.QUIT == event.type:
+        events.append(('quit',))
+      elif event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key in self._keymap:
+        events.append(('key', self._keymap[event.key], pygame.KEYDOWN == event.type))
+    if pygame.key.get_pressed()[pygame.K_BACKSPACE]:
+      events.append(('rewind',))
+    return events
+
+  def render(self):
+    self._renderer.render()
+
+  def close(self):
+    self._pygame.quit()
+
+class TerminalDisplay(Display):
+  ''' Display drawn on an ANSI terminal through renderer.TerminalRenderer,
+  paced to fps frames per second (not paced if fps is None). '''
+
+  def __init__(self, stream=None, fps=60):
+    self._stream = stream
+    self._period = None if fps is None else 1.0 / fps
+
+  def open(self, framebuffer):
+    import renderer
+    self._framebuffer = framebuffer
+    self._renderer = renderer.TerminalRenderer(framebuffer, self._stream)
+    self._deadline = time.monotonic()
+
+  def tick(self):
+    if self._period is None:
+      return
+    self._deadline = max(self._deadline + self._period, time.monotonic() - self._period)
+    delay = self._deadline - time.monotonic()
+    if delay > 0:
+      time.sleep(delay)
+
+  def render(self):
+    self._renderer.render()
+
+  def close(self):
+    self._renderer.close()
+
+class ImageDisplay(Display):
+  ''' Captures every frame in which the display changed as a binary PBM
+  image named frame_<frame number>.pbm in directory. '''
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.frame = 0
+
+  def open(self, framebuffer):
+    os.makedirs(self.directory, exist_ok=True)
+    self._framebuffer = framebuffer
+    self.frame = 0
+
+  def render(self):
+    self.frame = self.frame + 1
+    if not self._framebuffer.take_dirty():
+      return
+
+    fb = self._framebuffer
+    data = bytearray('P4\n{} {}\n'.format(fb.cols, fb.rows).encode('ascii'))
+    for row in range(fb.rows):
+      pixels = fb.row(row)
+      for col in range(0, fb.cols, 8):
+        byte = 0
+        for pixel in pixels[col:col + 8]:
+          byte = (byte << 1) | int(pixel)
+        data.append(byte << (8 - len(pixels[col:col + 8])))
+
+    name = os.path.join(self.directory, 'frame_{:06d}.pbm'.format(self.frame))
+    with open(name, 'wb') as f:
+      f.write(data)
+
+def create(name, **kwargs):
+  ''' Create the backend called name: pygame, terminal, image or null. '''
+  backends = {
+    'pygame' : PygameDisplay,
+    'terminal' : TerminalDisplay,
+    'image' : ImageDisplay,
+    'null' : NullDisplay,
+  }
+  return backends[name](**kwargs)
@@ -0,0 +1,254 @@
+''' Framebuffers for the chip8 Cpu. '''
+
+class GfxRow:
+  ''' Live view of one framebuffer row as a sequence of 0/1 pixels. '''
+
+  def __init__(self, framebuffer, row):
+    self._framebuffer = framebuffer
+    self._row = row
+
+  def __len__(self):
+    return self._framebuffer.cols
+
+  def _index(self, col):
+    if col < 0:
+      col = col + len(self)
+    if not 0 <= col < len(self):
+      raise IndexError(col)
+    return col
+
+  def __getitem__(self, col):
+    if isinstance(col, slice):
+      return [self[c] for c in range(*col.indices(len(self)))]
+    return self._framebuffer.pixel(self._row, self._index(col))
+
+  def __setitem__(self, col, value):
+    self._framebuffer.set_pixel(self._row, self._index(col), value)
+
+  def __iter__(self):
+    return iter(self._framebuffer.row(self._row))
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+class GfxView:
+  ''' Live view of a framebuffer indexed as gfx[row][col], as the display
+  used to be stored as a list of lists. '''
+
+  def __init__(self, framebuffer):
+    self._framebuffer = framebuffer
+
+  def __len__(self):
+    return self._framebuffer.rows
+
+  def __getitem__(self, row):
+    if row < 0:
+      row = row + len(self)
+    if not 0 <= row < len(self):
+      raise IndexError(row)
+    return GfxRow(self._framebuffer, row)
+
+  def __iter__(self):
+    for row in range(len(self)):
+      yield self[row]
+
+class Framebuffer:
+  ''' Dirty rectangle bookkeeping shared by the framebuffers. Every change
+  records the (x, y, width, height) rectangle it touched in dirty, until a
+  renderer collects them with take_dirty(). '''
+
+  # Past this many rectangles the whole display is considered dirty.
+  max_dirty = 64
+
+  def __init__(self, rows, cols):
+    self.rows = rows
+    self.cols = cols
+    self.dirty = [(0, 0, cols, rows)]
+
+  def _mark(self, x, y, width, height):
+    # Record the rectangle at (x, y), splitting it where it wraps around the
+    # right and bottom edges.
+    if len(self.dirty) >= self.max_dirty:
+      self._mark_all()
+      return
+    for rx, rwidth in ((x, min(width, self.cols - x)), (0, width - (self.cols - x))):
+      for ry, rheight in ((y, min(height, self.rows - y)), (0, height - (self.rows - y))):
+        if rwidth > 0 and rheight > 0:
+          self.dirty.append((rx, ry, rwidth, rheight))
+
+  def _mark_all(self):
+    self.dirty = [(0, 0, self.cols, self.rows)]
+
+  def take_dirty(self):
+    ''' Return the rectangles changed since the last call. '''
+    dirty = self.dirty
+    self.dirty = []
+    return dirty
+
+class PackedFramebuffer(Framebuffer):
+  ''' Display stored as one int per row, the leftmost pixel being the most
+  significant bit. Drawing a sprite row takes one AND to detect collisions
+  and one XOR with a mask shifted to the sprite's column. '''
+
+  # Sprite row masks, keyed by (cols, x), each a list indexed by the sprite
+  # byte. Filled in on first use and shared by all instances.
+  _masks = {}
+
+  def __init__(self, rows=32, cols=64):
+    Framebuffer.__init__(self, rows, cols)
+    self.bits = [0] * rows
+    self.gfx = GfxView(self)
+
+  def _masks_at(self, x):
+    masks = self._masks.get((self.cols, x))
+    if masks is None:
+      full = (1 << self.cols) - 1
+      masks = []
+      for byte in range(0x100):
+        # Byte placed at column 0, then rotated right by x so that pixels
+        # going off the right edge wrap around to the left.
+        bits = byte << (self.cols - 8)
+        masks.append(((bits >> x) | (bits << (self.cols - x))) & full)
+      self._masks[(self.cols, x)] = masks
+    return masks
+
+  def clear(self):
+    for row in range(self.rows):
+      self.bits[row] = 0
+    self._mark_all()
+
+  def draw(self, x, y, sprite):
+    ''' XOR sprite, a sequence of bytes, onto the display at (x, y),
+    wrapping around the edges. Returns 1 if any pixel was erased, 0
+    otherwise. '''
+    x = x % self.cols
+    y = y % self.rows
+    self._mark(x, y, 8, len(sprite))
+    masks = self._masks_at(x)
+    bits = self.bits
+    rows = self.rows
+    collision = 0
+    for yline, byte in enumerate(sprite):
+      row = (y + yline) % rows
+      mask = masks[byte]
+      if bits[row] & mask:
+        collision = 1
+      bits[row] ^= mask
+    return collision
+
+  def pixel(self, row, col):
+    return (self.bits[row] >> (self.cols - 1 - col)) & 1
+
+  def set_pixel(self, row, col, value):
+    self._mark(col, row, 1, 1)
+    bit = 1 << (self.cols - 1 - col)
+    if value:
+      self.bits[row] |= bit
+    else:
+      self.bits[row] &= ~bit
+
+  def row(self, row):
+    ''' Return row as a list of 0/1 pixels. '''
+    bits = self.bits[row]
+    return [(bits >> shift) & 1 for shift in range(self.cols - 1, -1, -1)]
+
+  def pack(self):
+    ''' Return the display as bytes, 8 pixels per byte, row by row, the
+    leftmost pixel in the most significant bit. '''
+    width = self.cols // 8
+    return b''.join(bits.to_bytes(width, 'big') for bits in self.bits)
+
+  def unpack(self, data):
+    ''' Replace the display contents with data as returned by pack(). '''
+    width = self.cols // 8
+    for row in range(self.rows):
+      self.bits[row] = int.from_bytes(data[row*width:(row + 1)*width], 'big')
+    self._mark_all()
+
+  def load(self, gfx):
+    ''' Replace the display contents with gfx, indexed as gfx[row][col]. '''
+    for row in range(self.rows):
+      bits = 0
+      for pixel in gfx[row]:
+        bits = (bits << 1) | (1 if pixel else 0)
+      self.bits[row] = bits
+    self._mark_all()
+
+class NumpyFramebuffer(Framebuffer):
+  ''' Display stored as a rows x cols uint8 NumPy array of 0/1 pixels.
+  Sprites are drawn with vectorized AND and XOR on the covered region, and
+  the array is only ever modified in place so views of it stay valid.
+  Requires numpy. '''
+
+  def __init__(self, rows=32, cols=64):
+    import numpy
+    Framebuffer.__init__(self, rows, cols)
+    self._numpy = numpy
+    self.pixels = numpy.zeros((rows, cols), dtype=numpy.uint8)
+    # Writes through gfx go through set_pixel() and are marked dirty, use
+    # view() for a read-only array.
+    self.gfx = GfxView(self)
+
+  def view(self):
+    ''' Return a read-only view of the pixels, sharing their memory. '''
+    view = self.pixels.view()
+    view.flags.writeable = False
+    return view
+
+  def clear(self):
+    self.pixels.fill(0)
+    self._mark_all()
+
+  def draw(self, x, y, sprite):
+    ''' XOR sprite, a sequence of bytes, onto the display at (x, y),
+    wrapping around the edges. Returns 1 if any pixel was erased, 0
+    otherwise. '''
+    numpy = self._numpy
+    n = len(sprite)
+    if not n:
+      return 0
+    x = x % self.cols
+    y = y % self.rows
+    self._mark(x, y, 8, n)
+    bits = numpy.unpackbits(numpy.frombuffer(bytes(sprite), dtype=numpy.uint8)).reshape(n, 8)
+
+    if x + 8 <= self.cols and y + n <= self.rows:
+      # No wrapping, work on a view of the region.
+      region = self.pixels[y:y + n, x:x + 8]
+      collision = 1 if (region & bits).any() else 0
+      region ^= bits
+      return collision
+
+    index = numpy.ix_((y + numpy.arange(n)) % self.rows, (x + numpy.arange(8)) % self.cols)
+    region = self.pixels[index]
+    collision = 1 if (region & bits).any() else 0
+    self.pixels[index] = region ^ bits
+    return collision
+
+  def pixel(self, row, col):
+    return int(self.pixels[row, col])
+
+  def set_pixel(self, row, col, value):
+    self._mark(col, row, 1, 1)
+    self.pixels[row, col] = 1 if value else 0
+
+  def row(self, row):
+    ''' Return row as a read-only array of 0/1 pixels. '''
+    return self.view()[row]
+
+  def pack(self):
+    ''' Return the display as bytes, 8 pixels per byte, row by row, the
+    leftmost pixel in the most significant bit. '''
+    return self._numpy.packbits(self.pixels).tobytes()
+
+  def unpack(self, data):
+    ''' Replace the display contents with data as returned by pack(). '''
+    numpy = self._numpy
+    packed = numpy.frombuffer(data, dtype=numpy.uint8, count=self.rows*self.cols // 8)
+    self.pixels[...] = numpy.unpackbits(packed).reshape(self.rows, self.cols)
+    self._mark_all()
+
+  def load(self, gfx):
+    ''' Replace the display contents with gfx, indexed as gfx[row][col]. '''
+    self.pixels[...] = self._numpy.asarray(gfx) != 0
+    self._mark_all()
@@ -0,0 +1,90 @@
+''' Guest memory access tracking for the chip8 Cpu.
+
+A MemoryTracker attached with Cpu.enable_mem_tracking() counts, per
+address, the instruction fetches, the reads (Fx65, sprites drawn by Dxyn)
+and the writes (Fx55, Fx33) of the instructions executed by the Cpu, and
+the number of distinct addresses accessed in each frame. The counts can be
+exported as CSV or as a heatmap image with one pixel per address. '''
+
+import math
+
+class MemoryTracker:
+
+  # Width in cells of the heatmap, 64 x 64 for 4KB.
+  heatmap_cols = 64
+
+  def __init__(self, size=4096):
+    self.size = size
+    self.fetches = [0] * size
+    self.reads = [0] * size
+    self.writes = [0] * size
+    # Number of distinct addresses accessed in every finished frame, the
+    # first being the frame tracking started in.
+    self.working_sets = []
+    self._frame = None
+    self._touched = set()
+
+  def record(self, counts, addr, frame):
+    # Count an access to addr during frame in counts, one of fetches, reads
+    # or writes.
+    if frame != self._frame:
+      if self._frame is not None:
+        self.working_sets.append(len(self._touched))
+        # Frames without any access, if the Cpu was run elsewhere.
+        self.working_sets.extend([0] * (frame - self._frame - 1))
+      self._frame = frame
+      self._touched = set()
+    counts[addr] += 1
+    self._touched.add(addr)
+
+  def working_set(self):
+    ''' Return the number of distinct addresses accessed in the current
+    frame so far. '''
+    return len(self._touched)
+
+  def kind(self, addr):
+    ''' Return 'code' for an address fetched and never written, 'modified'
+    for one fetched and written, 'data' for one only read or written and
+    None for one never accessed. '''
+    if self.fetches[addr]:
+      return 'modified' if self.writes[addr] else 'code'
+    if self.reads[addr] or self.writes[addr]:
+      return 'data'
+    return None
+
+  def regions(self):
+    ''' Return the runs of addresses of the same kind() as (start, end,
+    kind) with end exclusive, leaving out the ones never accessed. '''
+    regions = []
+    start = 0
+    for addr in range(1, self.size + 1):
+      if addr == self.size or self.kind(addr) != self.kind(start):
+        if self.kind(start) is not None:
+          regions.append((start, addr, self.kind(start)))
+        start = addr
+    return regions
+
+  def write_csv(self, f):
+    ''' Write one line per address: address, fetches, reads, writes. '''
+    f.write('addr,fetches,reads,writes\n')
+    for addr in range(self.size):
+      f.write('0x{:03X},{},{},{}\n'.format(addr, self.fetches[addr],
+          self.reads[addr], self.writes[addr]))
+
+  def write_heatmap(self, f, counts=None, scale=4):
+    ''' Write counts, all accesses by default, as a binary PGM image with
+    one scale x scale square per address, row by row from address 0. The
+    brightness grows with the logarithm of the count. '''
+    if counts is None:
+      counts = [sum(accesses) for accesses in zip(self.fetches, self.reads, self.writes)]
+    cols = self.heatmap_cols
+    rows = (self.size + cols - 1) // cols
+    top = math.log1p(max(counts)) or 1.0
+    data = bytearray('P5\n{} {}\n255\n'.format(cols*scale, rows*scale).encode('ascii'))
+    for row in range(rows):
+      line = bytearray()
+      for addr in range(row*cols, (row + 1)*cols):
+        count = counts[addr] if addr < self.size else 0
+        line.extend([int(round(255 * math.log1p(count) / top))] * scale)
+      data.extend(bytes(line) * scale)
+    f.write(data)
@@ -0,0 +1,99 @@
+''' Input movies of chip8 applications.
+
+A Movie holds what is needed to run an application again exactly as it was
+played: the RND seed, the SHA-1 of the application, the cycles per frame,
+the number of frames played and the keypad state at every frame it changed
+at. Played back on a Cpu with play() the run is bit-identical, and as fast
+as the Cpu goes. '''
+
+import roms
+import struct
+
+class InvalidMovie(Exception):
+  pass
+
+_magic = b'C8MV'
+_version = 1
+# Magic, version, seed, application SHA-1, cycles per frame, frames and
+# number of events.
+_header = struct.Struct('<4sBQ20sHII')
+# Frame and keys down as a bitmask, key k being bit k.
+_event = struct.Struct('<IH')
+
+def _keys(keyboard):
+  keys = 0
+  for key in reversed(range(len(keyboard))):
+    keys = (keys << 1) | (1 if keyboard[key] else 0)
+  return keys
+
+class Movie:
+
+  def __init__(self, seed=0, rom=None, cycles_per_frame=10):
+    self.seed = seed
+    self.rom = rom # Hex SHA-1 of the application, see roms.rom_hash().
+    self.cycles_per_frame = cycles_per_frame
+    self.frames = 0
+    # (frame, keys) for every change of the keypad, in frame order.
+    self.events = []
+
+  @classmethod
+  def for_cpu(cls, cpu, image):
+    ''' Return an empty movie of image as loaded into cpu. '''
+    return cls(cpu.seed, roms.rom_hash(image), cpu.cycles_per_frame)
+
+  def record(self, frame, keyboard):
+    ''' Record the keypad state keyboard, a list of 16 key states, from
+    frame on. Several changes in the same frame are all kept, in order, as a
+    key pressed and released before the frame still ends a blocked LD Vx,
+    K. '''
+    keys = _keys(keyboard)
+    if keys != (self.events[-1][1] if self.events else 0):
+      self.events.append((frame, keys))
+
+  def write(self, f):
+    f.write(_header.pack(_magic, _version, self.seed, bytes.fromhex(self.rom),
+        self.cycles_per_frame, self.frames, len(self.events)))
+    for frame, keys in self.events:
+      f.write(_event.pack(frame, keys))
+
+  @classmethod
+  def read(cls, f):
+    header = f.read(_header.size)
+    if len(header) != _header.size:
+      raise InvalidMovie('not a movie')
+    magic, version, seed, rom, cycles_per_frame, frames, count = _header.unpack(header)
+    if magic != _magic:
+      raise InvalidMovie('not a movie')
+    if version != _version:
+      raise InvalidMovie('version = {}'.format(version))
+    data = f.read(_event.size * count)
+    if len(data) != _event.size * count:
+      raise InvalidMovie('truncated events')
+    movie = cls(seed, rom.hex(), cycles_per_frame)
+    movie.frames = frames
+    movie.events = list(_event.iter_unpack(data))
+    return movie
+
+  def play(self, cpu, image, frames=None):
+    ''' Reset cpu, load image and run it for frames frames, all those of the
+    movie by default, with the keys pressed as recorded. Returns cpu. '''
+    if roms.rom_hash(image) != self.rom:
+      raise InvalidMovie('recorded with application {}'.format(self.rom))
+    if frames is None:
+      frames = self.frames
+    cpu.seed = self.seed
+    cpu.cycles_per_frame = self.cycles_per_frame
+    cpu.load_image(image)
+
+    events = iter(self.events)
+    event = next(events, None)
+    for frame in range(frames):
+      while event is not None and event[0] <= frame:
+        for key in range(len(cpu.keyboard)):
+          if (event[1] >> key) & 1:
+            cpu.press_key(key)
+          else:
+            cpu.release_key(key)
+        event = next(events, None)
+      cpu.run_frame()
+    return cpu
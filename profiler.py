@@ -0,0 +1,115 @@
+''' Sampling profiler of chip8 applications.
+
+GuestProfiler runs a Cpu a few instructions at a time and, between runs,
+samples the program counter and the call stack. The samples give the hot
+addresses of the application and its call stacks in the collapsed format
+read by flame graph tools (flamegraph.pl, speedscope, inferno, ...), one
+line per distinct stack: frames from the outermost, separated by ';',
+followed by the number of samples. Addresses are annotated with the
+disassembly of the instruction currently in memory there. '''
+
+import argparse
+import chip8
+import collections
+import disasm
+import random
+import sys
+
+class GuestProfiler:
+
+  def __init__(self, cpu, interval=100, seed=0):
+    self.cpu = cpu
+    # Average number of instructions between samples. Intervals are drawn
+    # between interval/2 and 3*interval/2 so that loops whose length
+    # divides the interval are not always sampled at the same place.
+    self.interval = interval
+    self._random = random.Random(seed)
+    # Sample counts by (return addresses, pc).
+    self.samples = collections.Counter()
+
+  def sample(self):
+    ''' Record the current pc and call stack. '''
+    cpu = self.cpu
+    self.samples[(tuple(cpu.stack[:cpu.sp + 1]), cpu.pc)] += 1
+
+  def run_cycles(self, cycles):
+    ''' Execute cycles instructions, sampling along the way. '''
+    end = self.cpu.cycles + cycles
+    while self.cpu.cycles < end:
+      step = self._random.randint(max(1, self.interval // 2), max(1, self.interval * 3 // 2))
+      cycles = min(step, end - self.cpu.cycles)
+      result = self.cpu.run_cycles(cycles)
+      if 'key_wait' == result.reason:
+        # Nothing presses keys here, the wait is sampled as it lasts.
+        self.cpu.cycles += cycles - result.cycles
+      self.sample()
+
+  def clear(self):
+    self.samples.clear()
+
+  def _instruction(self, addr):
+    memory = self.cpu.memory
+    if addr + 1 >= len(memory):
+      return '0x{:04X}'.format(addr)
+    return '0x{:04X} {}'.format(addr, disasm.mnemonic((memory[addr] << 8) | memory[addr + 1]))
+
+  def _function(self, ret):
+    # Name of the subroutine called by the instruction before return
+    # address ret.
+    memory = self.cpu.memory
+    site = ret - 2
+    if 0 <= site and site + 1 < len(memory) and 0x2 == memory[site] >> 4:
+      return 'sub_0x{:03X}'.format(((memory[site] << 8) | memory[site + 1]) & 0x0FFF)
+    return 'called_from_0x{:04X}'.format(site)
+
+  def hot(self, count=None):
+    ''' Return the count most sampled addresses, all of them by default, as
+    (address, samples) pairs, the hottest first. '''
+    pcs = collections.Counter()
+    for (stack, pc), samples in self.samples.items():
+      pcs[pc] += samples
+    return pcs.most_common(count)
+
+  def report(self, count=20):
+    ''' Return a table of the count hottest addresses. '''
+    total = sum(self.samples.values()) or 1
+    lines = ['{:>8} {:>6}  {}'.format('samples', '%', 'instruction')]
+    for pc, samples in self.hot(count):
+      lines.append('{:>8} {:>6.1f}  {}'.format(samples, 100 * samples / total,
+          self._instruction(pc)))
+    return '\n'.join(lines)
+
+  def collapsed(self):
+    ''' Return the samples as collapsed stacks, one line per stack. '''
+    stacks = collections.Counter()
+    for (stack, pc), samples in self.samples.items():
+      frames = ['main'] + [self._function(ret) for ret in stack] + [self._instruction(pc)]
+      stacks[';'.join(frames)] += samples
+    return ['{} {}'.format(frames, samples) for frames, samples in sorted(stacks.items())]
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Profile a chip8 application.')
+  parser.add_argument('file_name', help='application to profile')
+  parser.add_argument('--frames', type=int, default=3600,
+      help='frames to run the application for (default 3600)')
+  parser.add_argument('--interval', type=int, default=100,
+      help='average number of instructions between samples (default 100)')
+  parser.add_argument('--top', type=int, default=20,
+      help='number of hot addresses to show (default 20)')
+  parser.add_argument('--collapsed', metavar='FILE',
+      help='write the collapsed stacks to FILE for flame graph tools')
+  args = parser.parse_args(argv)
+
+  cpu = chip8.Cpu()
+  cpu.load_app(args.file_name)
+  profiler = GuestProfiler(cpu, args.interval)
+  profiler.run_cycles(args.frames * cpu.cycles_per_frame)
+  print(profiler.report(args.top))
+
+  if args.collapsed:
+    with open(args.collapsed, 'w') as f:
+      for line in profiler.collapsed():
+        f.write(line + '\n')
+
+if '__main__' == __name__:
+  main()
@@ -0,0 +1,109 @@
+''' Renderers drawing a chip8 framebuffer. pygame is only imported when a
+SurfaceRenderer is created. '''
+
+import sys
+
+class SurfaceRenderer:
+  ''' Draws a framebuffer onto a pygame display. Pixels are written into a
+  single cols x rows surface, and only the rectangles the framebuffer
+  reports as dirty are scaled up onto the display and updated. '''
+
+  def __init__(self, display, framebuffer, scale=10,
+      palette=((0, 0, 0), (255, 255, 255))):
+    import pygame
+    self._pygame = pygame
+    self._display = display
+    self._framebuffer = framebuffer
+    self._scale = scale
+    self._surface = pygame.Surface((framebuffer.cols, framebuffer.rows)).convert()
+    self._colors = [self._surface.map_rgb(color) for color in palette]
+
+  def render(self):
+    ''' Draw whatever changed since the last call. Returns the list of
+    display rectangles that were updated. '''
+    pygame = self._pygame
+    dirty = self._framebuffer.take_dirty()
+    if not dirty:
+      return []
+
+    # Write the changed pixels into the small surface.
+    colors = self._colors
+    pixels = pygame.PixelArray(self._surface)
+    for x, y, width, height in dirty:
+      for row in range(y, y + height):
+        values = self._framebuffer.row(row)
+        pixels[x:x + width, row] = [colors[value] for value in values[x:x + width]]
+    del pixels # Unlock the surface.
+
+    # Scale each changed rectangle up onto the display.
+    scale = self._scale
+    rects = []
+    for x, y, width, height in dirty:
+      rect = pygame.Rect(x*scale, y*scale, width*scale, height*scale)
+      area = self._surface.subsurface((x, y, width, height))
+      self._display.blit(pygame.transform.scale(area, rect.size), rect)
+      rects.append(rect)
+    pygame.display.update(rects)
+    return rects
+
+class TerminalRenderer:
+  ''' Draws a framebuffer on an ANSI terminal. Each character cell holds two
+  display rows using half-block glyphs. The last frame written is kept, and
+  every render() writes only the cells that changed, with cursor
+  positioning escapes, in a single write. '''
+
+  # Glyph for a cell, indexed by (top pixel << 1) | bottom pixel.
+  glyphs = (' ', '\u2584', '\u2580', '\u2588')
+
+  def __init__(self, framebuffer, stream=None, row=1, col=1):
+    self._framebuffer = framebuffer
+    self._stream = sys.stdout if stream is None else stream
+    self._row = row # Terminal position of the top left corner, 1-based.
+    self._col = col
+    self._lines = (framebuffer.rows + 1) // 2
+    self._cells = None # Glyph indices of the frame on the terminal.
+
+  def render(self):
+    ''' Draw whatever changed since the last call. Returns the number of
+    cells written. '''
+    dirty = self._framebuffer.take_dirty()
+    out = []
+    if self._cells is None:
+      # First frame: clear the terminal and hide the cursor.
+      out.append('\x1b[2J\x1b[?25l')
+      self._cells = [[0] * self._framebuffer.cols for line in range(self._lines)]
+      dirty = [(0, 0, self._framebuffer.cols, self._framebuffer.rows)]
+
+    lines = set()
+    for x, y, width, height in dirty:
+      lines.update(range(y // 2, (y + height + 1) // 2))
+
+    written = 0
+    glyphs = self.glyphs
+    for line in sorted(lines):
+      top = self._framebuffer.row(2*line)
+      if 2*line + 1 < self._framebuffer.rows:
+        bottom = self._framebuffer.row(2*line + 1)
+      else:
+        bottom = [0] * self._framebuffer.cols
+      cells = self._cells[line]
+      cursor = None # Column the cursor is at, if known.
+      for col in range(self._framebuffer.cols):
+        cell = (top[col] << 1) | bottom[col]
+        if cell != cells[col]:
+          if cursor != col:
+            out.append('\x1b[{};{}H'.format(self._row + line, self._col + col))
+          out.append(glyphs[cell])
+          cells[col] = cell
+          cursor = col + 1
+          written = written + 1
+
+    if out:
+      self._stream.write(''.join(out))
+      self._stream.flush()
+    return written
+
+  def close(self):
+    ''' Move the cursor below the display and show it again. '''
+    self._stream.write('\x1b[{};1H\x1b[?25h'.format(self._row + self._lines))
+    self._stream.flush()
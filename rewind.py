@@ -0,0 +1,123 @@
+''' Rewind history of chip8 machine states.
+
+States are snapshots as returned by Cpu.snapshot(). Every keyframe_interval
+frames a full snapshot is kept as a keyframe; the frames in between only
+keep the chunks that differ from the previous frame. A keyframe and its
+deltas form a group, and whole groups are evicted, oldest first, to stay
+within max_frames and max_bytes. Once only the group being recorded into is
+left, its keyframe is moved forward a frame at a time instead. The most
+recent state is always kept, as a lone keyframe if need be, so a
+max_bytes below the size of one snapshot is exceeded by that keyframe. '''
+
+import collections
+
+class RewindBuffer:
+
+  # Size of the chunks states are compared and stored in.
+  chunk_size = 32
+
+  # Bookkeeping overhead counted per stored chunk and per frame.
+  _overhead = 64
+
+  def __init__(self, max_frames=60*60, max_bytes=8*1024*1024, keyframe_interval=60):
+    self.max_frames = max_frames
+    self.max_bytes = max_bytes
+    self.keyframe_interval = keyframe_interval
+    self._groups = collections.deque() # [keyframe, [(delta, size), ...], size]
+    self._frames = 0
+    self._bytes = 0
+    self._last = None # Most recent state pushed.
+
+  def __len__(self):
+    return self._frames
+
+  @property
+  def size(self):
+    ''' Approximate number of bytes used by the stored states. '''
+    return self._bytes
+
+  def _diff(self, old, new):
+    # Chunks of new differing from old, as (offset, bytes) pairs.
+    size = self.chunk_size
+    return tuple((offset, new[offset:offset + size])
+        for offset in range(0, len(new), size)
+        if old[offset:offset + size] != new[offset:offset + size])
+
+  def push(self, state):
+    ''' Record state as the most recent frame. '''
+    state = bytes(state)
+    if (not self._groups or self._last is None or len(state) != len(self._last)
+        or len(self._groups[-1][1]) + 1 >= self.keyframe_interval):
+      size = len(state) + self._overhead
+      self._groups.append([state, [], size])
+    else:
+      delta = self._diff(self._last, state)
+      size = self._overhead * (1 + len(delta)) + sum(len(chunk) for offset, chunk in delta)
+      self._groups[-1][1].append((delta, size))
+      self._groups[-1][2] += size
+    self._last = state
+    self._frames += 1
+    self._bytes += size
+    self._evict()
+
+  def _evict(self):
+    # Drop the oldest groups, then the oldest frames of the last group by
+    # applying its first delta to its keyframe, down to the newest state.
+    while self._frames > 1 and (self._frames > self.max_frames or self._bytes > self.max_bytes):
+      if len(self._groups) > 1:
+        keyframe, deltas, size = self._groups.popleft()
+        self._frames -= 1 + len(deltas)
+        self._bytes -= size
+      else:
+        group = self._groups[0]
+        delta, size = group[1].pop(0)
+        keyframe = bytearray(group[0])
+        for offset, chunk in delta:
+          keyframe[offset:offset + len(chunk)] = chunk
+        group[0] = bytes(keyframe)
+        group[2] -= size
+        self._frames -= 1
+        self._bytes -= size
+
+  def state(self, back=0):
+    ''' Return the state recorded back frames before the most recent one,
+    rebuilt from the nearest keyframe. '''
+    if not 0 <= back < self._frames:
+      raise IndexError(back)
+    for keyframe, deltas, size in reversed(self._groups):
+      if back <= len(deltas):
+        state = bytearray(keyframe)
+        for delta, size in deltas[:len(deltas) - back]:
+          for offset, chunk in delta:
+            state[offset:offset + len(chunk)] = chunk
+        return bytes(state)
+      back -= 1 + len(deltas)
+
+  def rewind(self, frames=1):
+    ''' Step back frames frames, dropping the newer ones, and return the
+    state that is now the most recent. At least one frame is always kept. '''
+    frames = min(frames, self._frames - 1)
+    state = self.state(frames)
+    while frames > 0:
+      group = self._groups[-1]
+      deltas = group[1]
+      if frames <= len(deltas):
+        size = sum(size for delta, size in deltas[len(deltas) - frames:])
+        del deltas[len(deltas) - frames:]
+        group[2] -= size
+        self._bytes -= size
+        self._frames -= frames
+        frames = 0
+      else:
+        self._groups.pop()
+        self._bytes -= group[2]
+        self._frames -= 1 + len(deltas)
+        frames -= 1 + len(deltas)
+    self._last = state
+    return state
+
+  def clear(self):
+    self._groups.clear()
+    self._frames = 0
+    self._bytes = 0
+    self._last = None
@@ -0,0 +1,72 @@
+''' Catalog of chip8 applications indexed by content hash. '''
+
+import hashlib
+import os
+import zipfile
+
+def rom_hash(image):
+  ''' Return the hex SHA-1 digest identifying image. '''
+  return hashlib.sha1(image).hexdigest()
+
+class RomCatalog:
+  ''' Applications found in a directory (searched recursively) or a zip
+  file, each read once and kept in memory. Identical images stored under
+  several names are kept only once. '''
+
+  def __init__(self, path, extensions=('.c8', '.ch8')):
+    self.path = path
+    self.extensions = tuple(extensions)
+    self._images = {} # Hash -> image.
+    self._hashes = {} # Name -> hash.
+    if zipfile.is_zipfile(path):
+      self._index_zip()
+    else:
+      self._index_directory()
+
+  def _matches(self, name):
+    return not self.extensions or name.lower().endswith(self.extensions)
+
+  def _add(self, name, image):
+    key = rom_hash(image)
+    self._images.setdefault(key, image)
+    self._hashes[name] = key
+
+  def _index_directory(self):
+    for root, dirs, files in os.walk(self.path):
+      dirs.sort()
+      for file_name in sorted(files):
+        if self._matches(file_name):
+          full_name = os.path.join(root, file_name)
+          with open(full_name, 'rb') as f:
+            self._add(os.path.relpath(full_name, self.path), f.read())
+
+  def _index_zip(self):
+    with zipfile.ZipFile(self.path) as archive:
+      for info in archive.infolist():
+        if not info.is_dir() and self._matches(info.filename):
+          self._add(info.filename, archive.read(info))
+
+  def __len__(self):
+    return len(self._images)
+
+  def __contains__(self, key):
+    return key in self._images or key in self._hashes
+
+  def names(self):
+    ''' Return the names of all applications, sorted. '''
+    return sorted(self._hashes)
+
+  def hashes(self):
+    ''' Return the hashes of all distinct images, sorted. '''
+    return sorted(self._images)
+
+  def hash_of(self, name):
+    return self._hashes[name]
+
+  def image(self, key):
+    ''' Return the image with hash or name key. '''
+    return self._images[self._hashes.get(key, key)]
+
+  def load(self, cpu, key):
+    ''' Reset cpu and load the image with hash or name key into it. '''
+    cpu.load_image(self.image(key))
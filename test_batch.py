@@ -0,0 +1,125 @@
+import batch
+import chip8
+import csv
+import os
+import roms
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# Waits for a key, then draws its font sprite at (0, 0) and loops.
+key_app = bytes([0xF1, 0x0A, 0xF1, 0x29, 0xD0, 0x05, 0x12, 0x06])
+
+run_job = batch.run_job
+
+def hanging_run_job(job):
+  # Jobs whose file name starts with hang write the time they start at to
+  # that file and never answer, in the worker processes.
+  if os.path.basename(job.name).startswith('hang'):
+    with open(job.name, 'w') as f:
+      f.write(repr(time.time()))
+    time.sleep(60)
+  return run_job(job)
+
+def failing_run_job(job):
+  # Jobs named fail raise an exception no Cpu raises.
+  if job.name.startswith('fail'):
+    raise RuntimeError(job.name)
+  return run_job(job)
+
+class TestBatch(unittest.TestCase):
+  def test_parse_inputs(self):
+    ''' Test parsing an input script. '''
+    lines = ['# Start the game.', '10 a down', '', '2 5 down  # Early.', '12 A up']
+    self.assertEqual(batch.parse_inputs(lines),
+        [(2, 0x5, True), (10, 0xA, True), (12, 0xA, False)])
+    for line in ('1 5', '1 5 pressed', '1 10 down'):
+      with self.assertRaises(ValueError):
+        batch.parse_inputs([line])
+
+  def test_run_job(self):
+    ''' Test budgets, inputs and the errors ending a run. '''
+    result = batch.run_job(batch.Job('loop', bytes([0x12, 0x00]), [], 95, None))
+    self.assertEqual((result.reason, result.cycles), ('done', 95))
+    self.assertEqual(result.rom, roms.rom_hash(bytes([0x12, 0x00])))
+
+    cpu = chip8.Cpu()
+    cpu.framebuffer.draw(0, 0, chip8.Cpu.font_set[0xA*5:0xA*5 + 5])
+    result = batch.run_job(batch.Job('key', key_app, [(3, 0xA, True)], 100, None))
+    self.assertEqual(result.display, roms.rom_hash(cpu.framebuffer.pack()))
+    result = batch.run_job(batch.Job('key', key_app, [], 100, None))
+    self.assertEqual(result.display, roms.rom_hash(chip8.Cpu().framebuffer.pack()))
+
+    for image, reason, cycles in (
+        (bytes([0xFF, 0xFF]), 'UnsupportedOpcode', 1),
+        (bytes([0x22, 0x00]), 'StackPointerOutOfRange', 17),
+        (bytes([0x60, 0x01, 0xBF, 0xFF]), 'ProgramCounterOutOfRange', 2),
+        (bytes([0x1F, 0xFF]), 'ProgramCounterOutOfRange', 1)):
+      result = batch.run_job(batch.Job('bad', image, [], 1000, None))
+      self.assertEqual((result.reason, result.cycles), (reason, cycles))
+
+    result = batch.run_job(batch.Job('slow', bytes([0x12, 0x00]), [], 10**9, 0))
+    self.assertEqual(result.reason, 'timeout')
+    self.assertLess(result.cycles, 10**9)
+
+  def test_watchdog(self):
+    ''' Test that hung workers are timed from the start of their job. '''
+    with tempfile.TemporaryDirectory() as directory:
+      jobs = [batch.Job(os.path.join(directory, name), bytes([0x12, 0x00]), [], 1000, 0.1)
+          for name in ('hang1', 'hang2', 'loop', 'hang3', 'loop')]
+      with mock.patch.object(batch, 'run_job', hanging_run_job), \
+          mock.patch.object(batch, 'watchdog_grace', 0.4):
+        results = batch.run_jobs(jobs, 3)
+      starts = []
+      for name in ('hang1', 'hang2'):
+        with open(os.path.join(directory, name)) as f:
+          starts.append(float(f.read()))
+    self.assertEqual([result.reason for result in results],
+        ['watchdog', 'watchdog', 'done', 'watchdog', 'skipped'])
+    for result in results[:2] + results[3:4]:
+      self.assertGreaterEqual(result.seconds, 0.5)
+    # The hung jobs ran side by side, not one watchdog after the other.
+    self.assertLess(abs(starts[1] - starts[0]), results[0].seconds)
+
+  def test_worker_errors(self):
+    ''' Test that an exception in one job ends that job only. '''
+    jobs = [batch.Job(name, image, [], 100, None) for name, image in
+        (('jump', bytes([0x1F, 0xFF])), ('fail', bytes([0x12, 0x00])),
+        ('loop', bytes([0x12, 0x00])))]
+    with mock.patch.object(batch, 'run_job', failing_run_job):
+      results = batch.run_jobs(jobs, 2)
+    self.assertEqual([result.reason for result in results],
+        ['ProgramCounterOutOfRange', 'RuntimeError', 'done'])
+    self.assertEqual([result.name for result in results], ['jump', 'fail', 'loop'])
+
+  def test_main(self):
+    ''' Test running a directory of applications across processes. '''
+    with tempfile.TemporaryDirectory() as directory:
+      apps = os.path.join(directory, 'apps')
+      os.mkdir(apps)
+      for name, image in (('key.ch8', key_app), ('bad.ch8', bytes([0xFF, 0xFF]))):
+        with open(os.path.join(apps, name), 'wb') as f:
+          f.write(image)
+      inputs = os.path.join(directory, 'inputs.txt')
+      with open(inputs, 'w') as f:
+        f.write('1 3 down\n')
+      output = os.path.join(directory, 'results.csv')
+
+      status = batch.main([apps, '--inputs', inputs, '--frames', '5',
+          '--jobs', '2', '--timeout', '10', '--output', output])
+      self.assertEqual(status, 1)
+      with open(output, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    self.assertEqual([row['name'] for row in rows],
+        [os.path.join(apps, 'bad.ch8'), os.path.join(apps, 'key.ch8')])
+    self.assertEqual([row['reason'] for row in rows], ['UnsupportedOpcode', 'done'])
+    self.assertEqual(rows[1]['cycles'], '50')
+    cpu = chip8.Cpu()
+    cpu.framebuffer.draw(0, 0, chip8.Cpu.font_set[3*5:3*5 + 5])
+    self.assertEqual(rows[1]['display'], roms.rom_hash(cpu.framebuffer.pack()))
+
+
+if '__main__' == __name__:
+  unittest.main()
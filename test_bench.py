@@ -0,0 +1,57 @@
+import bench
+import chip8
+import json
+import os
+import tempfile
+import unittest
+
+class TestBench(unittest.TestCase):
+  def test_workloads(self):
+    ''' Test that every workload runs forever, the same on every engine. '''
+    for name, image in bench.workloads.items():
+      snapshots = set()
+      for engine in bench.engines:
+        cpu = chip8.Cpu(seed=0)
+        cpu.load_image(image)
+        bench.engines[engine](cpu)(5000)
+        if cpu.cycles > 5000:
+          # The translator finished the block it was in, not comparable.
+          continue
+        snapshots.add(cpu.snapshot())
+      self.assertEqual(len(snapshots), 1, name)
+
+  def test_no_idle_skip(self):
+    ''' Test that the polling loop of paddle is executed, not skipped. '''
+    cpu = bench._cpu(bench.workloads['paddle'])
+    bench.engines['interpreter'](cpu)(1000)
+    self.assertEqual(cpu._decoded[0x210][0], cpu._op_jmp)
+
+  def test_run_suite(self):
+    ''' Test the results of a run. '''
+    suite = bench.run_suite(['alu', 'paddle'], cycles=1000, warmup=100, repeats=3)
+    self.assertEqual(list(suite['results']), ['alu', 'paddle'])
+    result = suite['results']['alu']
+    self.assertEqual(len(result['samples']), 3)
+    self.assertLessEqual(result['min'], result['instructions_per_second'])
+    self.assertLessEqual(result['instructions_per_second'], result['max'])
+    self.assertAlmostEqual(result['frames_per_second'],
+        result['instructions_per_second'] / chip8.Cpu.cycles_per_frame)
+    self.assertGreater(result['peak_memory'], 0)
+
+    baseline = json.loads(json.dumps(suite))
+    baseline['results']['alu']['instructions_per_second'] *= 2
+    self.assertEqual(list(bench.compare(suite, baseline)), ['alu'])
+
+  def test_main(self):
+    ''' Test writing and comparing JSON results from the command line. '''
+    with tempfile.TemporaryDirectory() as directory:
+      name = os.path.join(directory, 'results.json')
+      args = ['clear', '--cycles', '500', '--warmup', '0', '--repeats', '1']
+      self.assertEqual(bench.main(args + ['--engine', 'fusion', '--json', name]), 0)
+      with open(name) as f:
+        self.assertEqual(json.load(f)['engine'], 'fusion')
+      self.assertEqual(bench.main(args + ['--compare', name, '--threshold', '0']), 0)
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -5,7 +5,7 @@ import unittest
 
 class TestChip8(unittest.TestCase):
   def setUp(self):
-    self.dut = chip8.Chip8()
+    self.dut = chip8.Cpu()
     self.dut.test = True
 
   def test_write(self):
@@ -121,6 +121,17 @@ class TestChip8(unittest.TestCase):
     self.dut.emulate_cycle()
     self.assertEqual(self.dut.pc, addr)
 
+  def test_jp_last_byte(self):
+    ''' Test that running from 0xFFF, whose opcode would run past the end of
+    memory, raises ProgramCounterOutOfRange. '''
+    self.dut.write_opcode(0x1FFF, 0x200)
+    self.dut.emulate_cycle()
+    with self.assertRaises(chip8.ProgramCounterOutOfRange):
+      self.dut.emulate_cycle()
+    self.dut.pc = 0x200
+    with self.assertRaises(chip8.ProgramCounterOutOfRange):
+      self.dut.run_cycles(2)
+
   def test_call(self):
     ''' Test 0x2nnn - call subroutine at nnn. '''
     # The interpreter increments the stack pointer, then puts the current PC on 
@@ -142,6 +153,16 @@ class TestChip8(unittest.TestCase):
     self.assertEqual(self.dut.stack[self.dut.sp], pc + 2)
     self.assertEqual(self.dut.pc, addr)
 
+  def test_call_full_stack(self):
+    ''' Test that 0x2nnn with all 16 stack entries in use raises
+    StackPointerOutOfRange. '''
+    self.dut.write_opcode(0x2200, 0x200) # CALL 0x200
+    for i in range(len(self.dut.stack)):
+      self.dut.emulate_cycle()
+    self.assertEqual(self.dut.sp, len(self.dut.stack) - 1)
+    with self.assertRaises(chip8.StackPointerOutOfRange):
+      self.dut.emulate_cycle()
+
   def test_sevxbyte_equal(self):
     ''' Test 0x3xkk - skip next instruction if Vx = kk. Tests for equality. '''
     # The interpreter compares register Vx to kk, and if they are equal,
@@ -489,6 +510,28 @@ class TestChip8(unittest.TestCase):
       v = self.dut.V[(x + 1) % len(self.dut.V)]
       self.assertEqual(self.dut.V[x], v & byte)
 
+  def test_drwvxvyn(self):
+    ''' Test 0xDxyn - DRW Vx, Vy, nibble - Display n-byte sprite at (Vx, Vy),
+    set VF = collision. '''
+    # Draw the font sprite of 0 at the bottom right corner so that it wraps
+    # around, then draw it again to erase it.
+    self.dut.I = 0
+    self.dut.V[0] = 62
+    self.dut.V[1] = 30
+    for collision in (0, 1):
+      self.dut.pc = 0x200
+      self.dut.write_opcode(0xD015, self.dut.pc)
+      self.dut.emulate_cycle()
+      self.assertTrue(self.dut.draw_flag)
+      self.assertEqual(self.dut.V[0xF], collision)
+      if not collision:
+        self.assertSequenceEqual(self.dut.gfx[30][62:], [1, 1])
+        self.assertSequenceEqual(self.dut.gfx[30][:2], [1, 1])
+        self.assertSequenceEqual(self.dut.gfx[2][:2], [1, 1])
+
+    for row in range(self.dut.rows):
+      self.assertSequenceEqual(self.dut.gfx[row], [0]*self.dut.cols)
+
   def test_skpvx(self):
     ''' Test 0xEx9E - Skip next instruction if key with the value of Vx is pressed. '''
     # Checks the keyboard, and if the key corresponding to the value of Vx is 
@@ -623,7 +666,7 @@ class TestChip8(unittest.TestCase):
       opcode = 0xF01E | (x << 8)
       self.dut.write_opcode(opcode, self.dut.pc)
       self.dut.emulate_cycle()
-      self.assertEqual(self.dut.I, I + Vx)
+      self.assertEqual(self.dut.I, (I + Vx) & 0xFFFF)
 
   def test_ldfvx(self):
     ''' Test 0xFx29 - LD F, Vx - Set I = location of sprite for digit Vx. In
@@ -713,6 +756,560 @@ class TestChip8(unittest.TestCase):
       for j in range(x+1):
         self.assertEqual(self.dut.read(self.dut.I + j), self.dut.V[j])
 
+  def test_decode_cache_invalidated_by_write_opcode(self):
+    ''' Test that rewriting an executed instruction takes effect. '''
+    self.dut.write_opcode(0x6011, 0x200)
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 0x11)
+
+    self.dut.pc = 0x200
+    self.dut.write_opcode(0x6022, 0x200)
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 0x22)
+
+  def test_decode_cache_invalidated_by_ldix(self):
+    ''' Test that 0xFx55 overwriting code invalidates its decoded form. '''
+    # 0x200: LD V0, 0x33 then 0x202: LD [I], V1 with I pointing at 0x200,
+    # which rewrites the first instruction into LD V0, 0x44.
+    self.dut.write_opcode(0x6033, 0x200)
+    self.dut.write_opcode(0xF155, 0x202)
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 0x33)
+
+    self.dut.V[0] = 0x60
+    self.dut.V[1] = 0x44
+    self.dut.I = 0x200
+    self.dut.emulate_cycle()
+
+    self.dut.pc = 0x200
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 0x44)
+
+  def test_decode_cache_invalidated_by_ldb(self):
+    ''' Test that 0xFx33 overwriting the low byte of code takes effect. '''
+    self.dut.write_opcode(0x7000, 0x204)
+    self.dut.pc = 0x204
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 0)
+
+    # BCD of 200 is 2, 0, 0; write it so the hundreds digit lands on 0x205.
+    self.dut.V[1] = 200
+    self.dut.I = 0x205
+    self.dut.write_opcode(0xF133, 0x200)
+    self.dut.pc = 0x200
+    self.dut.emulate_cycle()
+
+    self.dut.pc = 0x204
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[0], 2)
+
+  def test_fusion_matches_unfused(self):
+    ''' Test that fused instruction pairs leave the same state behind. '''
+    program = [
+      0x6000, # LD V0, 0
+      0x6108, # LD V1, 8
+      0x6200, # LD V2, 0
+      0xA000, # LD I, 0x000
+      0xD015, # DRW V0, V1, 5
+      0x7006, # ADD V0, 6
+      0x7201, # ADD V2, 1
+      0x3230, # SE V2, 0x30
+      0x1206, # JP 0x206
+      0x4200, # SNE V2, 0
+      0x1200, # JP 0x200
+      0x1216, # JP 0x216
+    ]
+    ref = chip8.Cpu()
+    profiled = chip8.Cpu()
+    for i, opcode in enumerate(program):
+      for cpu in (ref, profiled, self.dut):
+        cpu.write_opcode(opcode, 0x200 + 2*i)
+
+    profile = profiled.profile_pairs(50)
+    for pair in ((0xA, 0xD), (0x3, 0x1), (0x6, 0x6)):
+      self.assertGreater(profile[pair], 0)
+    self.assertEqual(profile[(0x4, 0x1)], 0)
+
+    # Both end up spinning on the jump at 0x216 once the loops are done.
+    self.dut.enable_fusion()
+    for i in range(1000):
+      ref.emulate_cycle()
+      self.dut.emulate_cycle()
+    self.assertEqual(ref.pc, self.dut.pc)
+    self.assertEqual(ref.I, self.dut.I)
+    self.assertSequenceEqual(ref.V, self.dut.V)
+    for row in range(ref.rows):
+      self.assertSequenceEqual(ref.gfx[row], self.dut.gfx[row])
+
+  def test_fusion_invalidated_by_write(self):
+    ''' Test that writing the second instruction of a fused pair is seen. '''
+    self.dut.enable_fusion()
+    self.dut.write_opcode(0x6011, 0x200)
+    self.dut.write_opcode(0x6122, 0x202)
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[1], 0x22)
+
+    self.dut.write_opcode(0x6133, 0x202)
+    self.dut.pc = 0x200
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[1], 0x33)
+    self.assertEqual(self.dut.pc, 0x204)
+
+  def test_fusion_invalidated_by_write_far(self):
+    ''' Test that writing the last load of a fused run of 0x6xkk is seen,
+    and that only the addresses fused entries cover invalidate that far. '''
+    self.dut.enable_fusion()
+    for i in range(self.dut.max_fused):
+      self.dut.write_opcode(0x6000 | (i << 8) | i, 0x200 + 2*i)
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[3], 3)
+    self.assertEqual(self.dut._fused_covered, set(range(0x202, 0x208)))
+
+    self.dut.write(0x33, 0x207)
+    self.dut.pc = 0x200
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.V[3], 0x33)
+
+  def test_fusion_run_cycles(self):
+    ''' Test that batch runs stop inside fused instructions. '''
+    program = [
+      0x6001, 0x6102, 0x6203, 0x6304, # 200: LD V0-V3
+      0xA000, 0xD015,                 # 208: LD I, 0x000; DRW V0, V1, 5
+      0x3000, 0x1200,                 # 20C: SE V0, 0; JP 0x200
+    ]
+    ref = chip8.Cpu(seed=0)
+    dut = chip8.Cpu(seed=0)
+    for i, opcode in enumerate(program):
+      ref.write_opcode(opcode, 0x200 + 2*i)
+      dut.write_opcode(opcode, 0x200 + 2*i)
+    dut.enable_fusion()
+
+    self.assertEqual(dut.run_cycles(1), chip8.RunResult(1, 0, 'cycles'))
+    self.assertEqual(dut.pc, 0x202)
+    self.assertEqual(dut.V[:2], [1, 0])
+    ref.run_cycles(1)
+    for cycles in (1, 2, 3, 1, 5, 1, 7, 4, 2, 9, 1, 1, 3):
+      self.assertEqual(dut.run_cycles(cycles).cycles, cycles)
+      ref.run_cycles(cycles)
+      self.assertEqual(dut.snapshot(), ref.snapshot(), 'after {}'.format(cycles))
+
+  def test_fusion_run_until(self):
+    ''' Test that pc and predicate are checked inside fused instructions. '''
+    for opcode, addr in zip((0x6001, 0x6102, 0x6203, 0x1200), range(0x200, 0x208, 2)):
+      self.dut.write_opcode(opcode, addr)
+    self.dut.enable_fusion()
+    self.dut.run_cycles(4)
+    self.assertEqual(self.dut.run_until(pc=0x202, max_cycles=1000),
+        chip8.RunResult(1, 0, 'pc'))
+    self.assertEqual(self.dut.run_until(lambda cpu: 0x206 == cpu.pc, max_cycles=1000),
+        chip8.RunResult(2, 0, 'predicate'))
+    self.assertEqual(self.dut.pc, 0x206)
+    self.assertEqual(self.dut.run_cycles(4), chip8.RunResult(4, 0, 'cycles'))
+    self.assertEqual(self.dut.pc, 0x206)
+
+  def test_run_cycles(self):
+    ''' Test that run_cycles matches the same number of emulate_cycle. '''
+    program = [0x6000, 0x7001, 0x8104, 0x3005, 0x1202, 0x1200]
+    ref = chip8.Cpu()
+    for i, opcode in enumerate(program):
+      ref.write_opcode(opcode, 0x200 + 2*i)
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+
+    for i in range(100):
+      ref.emulate_cycle()
+    result = self.dut.run_cycles(100)
+    self.assertEqual(result, chip8.RunResult(100, 0, 'cycles'))
+    self.assertEqual(self.dut.cycles, 100)
+    self.assertEqual(self.dut.pc, ref.pc)
+    self.assertSequenceEqual(self.dut.V, ref.V)
+
+  def test_run_frame(self):
+    ''' Test that run_frame stops at the next frame boundary. '''
+    self.dut.write_opcode(0x1200, 0x200)
+    self.dut.emulate_cycle()
+    result = self.dut.run_frame()
+    self.assertEqual(result.cycles, self.dut.cycles_per_frame - 1)
+    self.assertEqual(self.dut.cycles % self.dut.cycles_per_frame, 0)
+
+  def test_run_until(self):
+    ''' Test the stop conditions of run_until. '''
+    program = [0x6000, 0x7001, 0xD001, 0x1202]
+    for i, opcode in enumerate(program):
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+
+    result = self.dut.run_until(draw=True)
+    self.assertEqual(result, chip8.RunResult(3, 1, 'draw'))
+    self.assertTrue(self.dut.draw_flag)
+
+    result = self.dut.run_until(pc=0x206)
+    self.assertEqual(result, chip8.RunResult(3, 1, 'pc'))
+
+    result = self.dut.run_until(lambda cpu: 10 == cpu.V[0])
+    self.assertEqual(result, chip8.RunResult(23, 7, 'predicate'))
+
+    result = self.dut.run_until(pc=0x300, max_cycles=5)
+    self.assertEqual(result.reason, 'cycles')
+
+  def test_timers_count_down_per_frame(self):
+    ''' Test that timers count down once every cycles_per_frame
+    instructions, independently of how they are read. '''
+    self.dut.write_opcode(0x1200, 0x200)
+    self.dut.delay_timer = 3
+    self.dut.sound_timer = 1
+    self.dut.run_cycles(self.dut.cycles_per_frame - 1)
+    self.assertEqual(self.dut.delay_timer, 3)
+    self.assertEqual(self.dut.sound_timer, 1)
+
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.delay_timer, 2)
+    self.assertEqual(self.dut.sound_timer, 0)
+
+    self.dut.run_cycles(10 * self.dut.cycles_per_frame)
+    self.assertEqual(self.dut.delay_timer, 0)
+    self.assertEqual(self.dut.sound_timer, 0)
+
+  def test_timers_follow_cycles_per_frame(self):
+    ''' Test that the instruction rate does not change the timer rate. '''
+    self.dut.cycles_per_frame = 100
+    self.dut.write_opcode(0xF015, 0x200) # LD DT, V0
+    self.dut.write_opcode(0x1202, 0x202) # JP 0x202
+    self.dut.V[0] = 2
+    self.dut.run_cycles(100)
+    self.assertEqual(self.dut.delay_timer, 1)
+    self.dut.run_frame()
+    self.assertEqual(self.dut.delay_timer, 0)
+
+  def test_snapshot_restore(self):
+    ''' Test that restoring a snapshot resumes exactly where it was taken. '''
+    program = [
+      0x6004, # LD V0, 4
+      0xF015, # LD DT, V0
+      0x2208, # CALL 0x208
+      0x1204, # JP 0x204
+      0xF029, # LD F, V0
+      0xD125, # DRW V1, V2, 5
+      0x7101, # ADD V1, 1
+      0x00EE, # RET
+    ]
+    for i, opcode in enumerate(program):
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+    self.dut.keyboard[0x3] = True
+    self.dut.run_cycles(25)
+
+    blob = self.dut.snapshot()
+    self.dut.run_cycles(50)
+    expected = self.dut.snapshot()
+    gfx = [list(row) for row in self.dut.gfx]
+
+    self.dut.reset()
+    self.dut.restore(blob)
+    self.assertEqual(self.dut.snapshot(), blob)
+    self.assertTrue(self.dut.keyboard[0x3])
+    self.dut.run_cycles(50)
+    self.assertEqual(self.dut.snapshot(), expected)
+    self.assertEqual([list(row) for row in self.dut.gfx], gfx)
+
+  def test_rnd_seed(self):
+    ''' Test that RND bytes only depend on the seed, reset included. '''
+    def draws(cpu, count):
+      cpu.write_opcode(0xC0FF, 0x200) # RND V0, 0xFF
+      values = []
+      for i in range(count):
+        cpu.pc = 0x200
+        cpu.emulate_cycle()
+        values.append(cpu.V[0])
+      return values
+
+    cpu = chip8.Cpu(seed=42)
+    values = draws(cpu, 5000)
+    self.assertEqual(values, list(chip8.random_pool(42, 0) + chip8.random_pool(42, 1)[:904]))
+    cpu.reset()
+    self.assertEqual(draws(cpu, 5000), values)
+    self.assertNotEqual(draws(chip8.Cpu(seed=43), 5000), values)
+    self.assertNotEqual(chip8.Cpu().seed, chip8.Cpu().seed)
+
+  def test_snapshot_rnd(self):
+    ''' Test that a snapshot carries on the RND bytes and the key wait. '''
+    self.dut.write_opcode(0xC0FF, 0x200) # RND V0, 0xFF
+    self.dut.write_opcode(0x1200, 0x202) # JP 0x200
+    self.dut.run_cycles(10001)
+    blob = self.dut.snapshot()
+    self.dut.run_cycles(100)
+    expected = self.dut.snapshot()
+
+    cpu = chip8.Cpu()
+    cpu.test = True
+    cpu.restore(blob)
+    self.assertEqual(cpu.seed, self.dut.seed)
+    cpu.run_cycles(100)
+    self.assertEqual(cpu.snapshot(), expected)
+
+    self.dut.write_opcode(0xF50A, 0x204) # LD V5, K
+    self.dut.pc = 0x204
+    self.dut.run_cycles(1)
+    cpu.restore(self.dut.snapshot())
+    self.assertEqual(cpu.key_wait, 5)
+    self.assertEqual(cpu.run_cycles(10), chip8.RunResult(0, 0, 'key_wait'))
+
+  def test_restore_version_1(self):
+    ''' Test that snapshots without the RND state are still restored. '''
+    self.dut.write_opcode(0x6007, 0x200) # LD V0, 7
+    self.dut.run_cycles(1)
+    blob = self.dut.snapshot()
+    header = chip8.Cpu._snapshot_headers[1]
+    fields = list(chip8.Cpu._snapshot_header.unpack_from(blob))
+    fields[1] = 1
+    old = header.pack(*fields[:26]) + blob[chip8.Cpu._snapshot_header.size:]
+
+    cpu = chip8.Cpu(seed=3)
+    cpu.restore(old)
+    self.assertEqual(cpu.V[0], 7)
+    self.assertEqual(cpu.pc, 0x202)
+    self.assertEqual(cpu.seed, 3)
+    self.assertIsNone(cpu.key_wait)
+
+  def test_restore_version_2(self):
+    ''' Test that snapshots without the key pressed while blocked are still
+    restored. '''
+    self.dut.write_opcode(0xF50A, 0x200) # LD V5, K
+    self.dut.run_cycles(1)
+    blob = self.dut.snapshot()
+    header = chip8.Cpu._snapshot_headers[2]
+    fields = list(chip8.Cpu._snapshot_header.unpack_from(blob))
+    fields[1] = 2
+    old = header.pack(*fields[:30]) + blob[chip8.Cpu._snapshot_header.size:]
+
+    cpu = chip8.Cpu()
+    cpu.restore(old)
+    self.assertEqual(cpu.key_wait, 5)
+    self.assertIsNone(cpu.key_pressed)
+    self.assertEqual(cpu.snapshot(), blob)
+
+  def test_restore_invalid_snapshot(self):
+    ''' Test that restoring something else raises InvalidSnapshot. '''
+    blob = self.dut.snapshot()
+    with self.assertRaises(chip8.InvalidSnapshot):
+      self.dut.restore(blob[:-1])
+    with self.assertRaises(chip8.InvalidSnapshot):
+      self.dut.restore(b'XXXX' + blob[4:])
+    with self.assertRaises(chip8.InvalidSnapshot):
+      self.dut.restore(blob[:4] + b'\xff' + blob[5:])
+
+  def test_stats(self):
+    ''' Test counting and timing handler executions. '''
+    program = [
+      0x6003, # LD V0, 3
+      0x2208, # CALL 0x208
+      0x1202, # JP 0x202
+      0x0000,
+      0x7001, # ADD V0, 1
+      0x00EE, # RET
+    ]
+    for i, opcode in enumerate(program):
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+
+    self.dut.run_cycles(5)
+    self.assertIs(self.dut._decoded[0x200][0].__func__, chip8.Cpu._op_ld)
+    self.assertEqual(self.dut.stats(), {})
+
+    self.dut.enable_stats()
+    self.dut.run_cycles(12)
+    self.dut.emulate_cycle()
+    stats = self.dut.stats()
+    self.assertEqual(sorted((name, item.count) for name, item in stats.items()),
+        [('_op_add', 3), ('_op_call', 4), ('_op_jmp', 3), ('_op_ret', 3)])
+    for item in stats.values():
+      self.assertEqual(sum(item.histogram), item.count)
+      self.assertGreater(item.time, 0)
+      self.assertLessEqual(item.percentile(0.5), item.percentile(0.99))
+    report = self.dut.stats_report().splitlines()
+    self.assertEqual(len(report), 5)
+    self.assertTrue(report[0].startswith('handler'))
+
+    self.dut.disable_stats()
+    self.dut.run_cycles(4)
+    self.assertEqual(self.dut.stats(), {})
+    self.assertIs(self.dut._decoded[0x208][0].__func__, chip8.Cpu._op_add)
+
+  def test_stats_fused(self):
+    ''' Test that fused handlers are recorded under their own name. '''
+    self.dut.write_opcode(0x6001, 0x200) # LD V0, 1
+    self.dut.write_opcode(0x6102, 0x202) # LD V1, 2
+    self.dut.write_opcode(0x1200, 0x204) # JP 0x200
+    self.dut.enable_fusion()
+    self.dut.enable_stats()
+    self.dut.run_cycles(6)
+    stats = self.dut.stats()
+    self.assertEqual(stats['_fused_lds'].count, 2)
+    self.assertEqual(stats['_op_jmp'].count, 2)
+
+  def test_stats_survive_fusion(self):
+    ''' Test that enabling and disabling fusion keeps the stats. '''
+    self.dut.write_opcode(0x6001, 0x200) # LD V0, 1
+    self.dut.write_opcode(0x6102, 0x202) # LD V1, 2
+    self.dut.write_opcode(0x1200, 0x204) # JP 0x200
+    self.dut.enable_stats()
+    self.dut.run_cycles(3)
+    self.dut.enable_fusion()
+    self.dut.run_cycles(3)
+    self.dut.disable_fusion()
+    self.dut.run_cycles(3)
+    stats = self.dut.stats()
+    self.assertEqual(stats['_op_ld'].count, 4)
+    self.assertEqual(stats['_fused_lds'].count, 1)
+    self.assertEqual(stats['_op_jmp'].count, 3)
+
+  def check_idle_skip(self, program, keys=(), runs=200):
+    # Run program with and without idle skipping, in random slices, and
+    # check that both always end up in the same state.
+    random.seed(len(program))
+    cpus = [chip8.Cpu(seed=0), chip8.Cpu(seed=0)]
+    cpus[1].disable_idle_skip()
+    for cpu in cpus:
+      for i, opcode in enumerate(program):
+        cpu.write_opcode(opcode, 0x200 + 2*i)
+    for run in range(runs):
+      cycles = random.choice((1, 2, 3, 7, 10, 25, 100))
+      if run in keys:
+        for cpu in cpus:
+          cpu.keyboard[keys[run]] = not cpu.keyboard[keys[run]]
+      results = [cpu.run_cycles(cycles) for cpu in cpus]
+      self.assertEqual(results[0], results[1])
+      self.assertEqual(cpus[0].snapshot(), cpus[1].snapshot(), 'run {}'.format(run))
+    return cpus[0]
+
+  def test_idle_skip_delay(self):
+    ''' Test fast-forwarding a loop waiting on the delay timer. '''
+    cpu = self.check_idle_skip([
+      0x6009, # 200: LD V0, 9
+      0xF015, # 202: LD DT, V0
+      0xF107, # 204: LD V1, DT
+      0xF207, # 206: LD V2, DT
+      0x3100, # 208: SE V1, 0
+      0x1204, # 20A: JP 0x204
+      0x7301, # 20C: ADD V3, 1
+      0x1202, # 20E: JP 0x202
+    ])
+    self.assertEqual(cpu._decoded[0x20A][0].func, cpu._idle_jmp)
+    self.assertGreater(cpu.V[3], 0)
+
+  def test_idle_skip_keys(self):
+    ''' Test fast-forwarding loops waiting on a key or on nothing. '''
+    self.check_idle_skip([
+      0x6105, # 200: LD V1, 5
+      0xE19E, # 202: SKP V1
+      0x1202, # 204: JP 0x202
+      0x7301, # 206: ADD V3, 1
+      0xE1A1, # 208: SKNP V1
+      0x1208, # 20A: JP 0x208
+      0x1200, # 20C: JP 0x200
+    ], keys={20 : 5, 40 : 5, 60 : 5, 61 : 5, 100 : 5})
+
+    cpu = chip8.Cpu()
+    cpu.write_opcode(0x1200, 0x200) # JP 0x200
+    self.assertEqual(cpu.run_cycles(10**9), chip8.RunResult(10**9, 0, 'cycles'))
+    self.assertEqual(cpu.run_until(pc=0x202, max_cycles=100), chip8.RunResult(100, 0, 'cycles'))
+
+  def test_idle_skip_fused(self):
+    ''' Test that fusion leaves polling loops to idle skipping. '''
+    program = [0x6005, 0xF015, 0xF107, 0x3100, 0x1204, 0x1200]
+    for i, opcode in enumerate(program):
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+    self.dut.enable_fusion()
+    self.dut.run_cycles(100)
+    self.assertEqual(self.dut._decoded[0x206][0], self.dut._op_ske)
+    self.assertEqual(self.dut._decoded[0x208][0].func, self.dut._idle_jmp)
+
+  def test_idle_skip_modified(self):
+    ''' Test that a loop whose code changed is not skipped. '''
+    program = [0x6005, 0xF015, 0xF107, 0x3100, 0x1204, 0x1200]
+    for i, opcode in enumerate(program):
+      self.dut.write_opcode(opcode, 0x200 + 2*i)
+    self.dut.run_cycles(10)
+    self.dut.write(0x72, 0x204) # ADD V2, 1
+    self.dut.write(0x01, 0x205)
+    self.dut.run_cycles(30)
+    self.assertEqual(self.dut.V[2], 10)
+
+  def test_key_wait_blocks(self):
+    ''' Test that LD Vx, K stops running until a key is pressed. '''
+    self.dut.write_opcode(0xF30A, 0x200) # LD V3, K
+    self.dut.write_opcode(0x7301, 0x202) # ADD V3, 1
+    self.dut.write_opcode(0x1202, 0x204) # JP 0x202
+    self.assertEqual(self.dut.run_cycles(100), chip8.RunResult(1, 0, 'key_wait'))
+    self.assertEqual(self.dut.pc, 0x200)
+    self.assertEqual(self.dut.key_wait, 3)
+    self.assertEqual(self.dut.run_cycles(100), chip8.RunResult(0, 0, 'key_wait'))
+
+    # Time passes while blocked.
+    self.dut.emulate_cycle()
+    self.assertEqual(self.dut.cycles, 2)
+    self.assertEqual(self.dut.pc, 0x200)
+
+    self.dut.press_key(0xB)
+    self.assertEqual(self.dut.run_cycles(3), chip8.RunResult(3, 0, 'cycles'))
+    self.assertIsNone(self.dut.key_wait)
+    self.assertEqual(self.dut.V[3], 0xC)
+    self.assertEqual(self.dut.pc, 0x202)
+
+  def test_key_wait_run_frame(self):
+    ''' Test that the frame goes by, timers included, while blocked. '''
+    self.dut.write_opcode(0x6005, 0x200) # LD V0, 5
+    self.dut.write_opcode(0xF015, 0x202) # LD DT, V0
+    self.dut.write_opcode(0xF10A, 0x204) # LD V1, K
+    self.dut.write_opcode(0x1206, 0x206) # JP 0x206
+    result = self.dut.run_frame()
+    self.assertEqual(result.reason, 'key_wait')
+    self.assertEqual(self.dut.cycles, self.dut.cycles_per_frame)
+    self.assertEqual(self.dut.delay_timer, 4)
+    self.dut.run_frame()
+    self.assertEqual(self.dut.cycles, 2 * self.dut.cycles_per_frame)
+    self.assertEqual(self.dut.delay_timer, 3)
+
+    # A key pressed and released between two frames ends the wait.
+    self.dut.press_key(0x2)
+    self.dut.release_key(0x2)
+    self.dut.run_frame()
+    self.assertEqual(self.dut.V[1], 0x2)
+    self.assertEqual(self.dut.pc, 0x206)
+    self.assertEqual(self.dut.cycles, 3 * self.dut.cycles_per_frame)
+
+  def test_key_wait_snapshot(self):
+    ''' Test that a Cpu restored while blocked blocks again. '''
+    self.dut.write_opcode(0xF00A, 0x200) # LD V0, K
+    self.dut.run_cycles(10)
+    blob = self.dut.snapshot()
+
+    self.dut.reset()
+    self.dut.restore(blob)
+    self.assertEqual(self.dut.run_cycles(10).reason, 'key_wait')
+    self.assertEqual(self.dut.pc, 0x200)
+    self.dut.press_key(0x7)
+    self.dut.run_cycles(1)
+    self.assertEqual(self.dut.V[0], 0x7)
+
+  def test_key_wait_first_key(self):
+    ''' Test that a blocked LD Vx, K gets the first key pressed since it
+    blocked, also across a snapshot, and only once. '''
+    self.dut.write_opcode(0xF00A, 0x200) # LD V0, K
+    self.dut.write_opcode(0xF10A, 0x202) # LD V1, K
+    self.dut.press_key(0x3)
+    self.dut.release_key(0x3)
+    self.dut.run_cycles(10)
+    self.assertEqual(self.dut.pc, 0x200)
+    self.dut.press_key(0x9)
+    self.dut.press_key(0x4)
+    self.dut.release_key(0x9)
+    self.dut.release_key(0x4)
+
+    cpu = chip8.Cpu()
+    cpu.restore(self.dut.snapshot())
+    self.assertEqual(cpu.key_pressed, 0x9)
+    self.assertEqual(cpu.run_cycles(10), chip8.RunResult(2, 0, 'key_wait'))
+    self.assertEqual(cpu.V[0], 0x9)
+    self.assertEqual(cpu.pc, 0x202)
+    self.assertIsNone(cpu.key_pressed)
+
 
 if '__main__' == __name__:
   unittest.main()
@@ -0,0 +1,95 @@
+import disasm
+import unittest
+
+class TestDisasm(unittest.TestCase):
+  def test_mnemonic(self):
+    ''' Test the assembly of every kind of instruction. '''
+    expected = {
+      0x00E0 : 'CLS', 0x00EE : 'RET', 0x0123 : 'SYS 0x123',
+      0x1ABC : 'JP 0xABC', 0x2ABC : 'CALL 0xABC',
+      0x3A12 : 'SE VA, 0x12', 0x4A12 : 'SNE VA, 0x12', 0x5AB0 : 'SE VA, VB',
+      0x6A12 : 'LD VA, 0x12', 0x7A12 : 'ADD VA, 0x12',
+      0x8AB0 : 'LD VA, VB', 0x8AB1 : 'OR VA, VB', 0x8AB2 : 'AND VA, VB',
+      0x8AB3 : 'XOR VA, VB', 0x8AB4 : 'ADD VA, VB', 0x8AB5 : 'SUB VA, VB',
+      0x8AB6 : 'SHR VA', 0x8AB7 : 'SUBN VA, VB', 0x8ABE : 'SHL VA',
+      0x8AB8 : 'DW 0x8AB8',
+      0x9AB0 : 'SNE VA, VB', 0xAABC : 'LD I, 0xABC', 0xBABC : 'JP V0, 0xABC',
+      0xCA12 : 'RND VA, 0x12', 0xDAB5 : 'DRW VA, VB, 5',
+      0xEA9E : 'SKP VA', 0xEAA1 : 'SKNP VA', 0xEA00 : 'DW 0xEA00',
+      0xFA07 : 'LD VA, DT', 0xFA0A : 'LD VA, K', 0xFA15 : 'LD DT, VA',
+      0xFA18 : 'LD ST, VA', 0xFA1E : 'ADD I, VA', 0xFA29 : 'LD F, VA',
+      0xFA33 : 'LD B, VA', 0xFA55 : 'LD [I], VA', 0xFA65 : 'LD VA, [I]',
+      0xFAFF : 'DW 0xFAFF',
+    }
+    for opcode, text in expected.items():
+      self.assertEqual(disasm.mnemonic(opcode), text)
+
+  def test_disassemble_at(self):
+    memory = bytearray(4096)
+    memory[0x200:0x202] = bytes([0x60, 0x05])
+    self.assertEqual(disasm.disassemble_at(memory, 0x200), '0x0200: 6005  LD V0, 0x05')
+
+  def analysis(self):
+    image = b''.join(opcode.to_bytes(2, 'big') for opcode in [
+      0x2210, # 200: CALL 0x210
+      0x3000, # 202: SE V0, 0
+      0x120C, # 204: JP 0x20C
+      0xA21C, # 206: LD I, 0x21C
+      0xF155, # 208: LD [I], V1
+      0xB300, # 20A: JP V0, 0x300
+      0xF033, # 20C: LD B, V0
+      0x1200, # 20E: JP 0x200
+      0xA220, # 210: LD I, 0x220
+      0xF233, # 212: LD B, V2
+      0x00EE, # 214: RET
+      0x0000, # 216: never reached
+      0x8080, # 218: data
+      0x1234, # 21A: data
+      0x6000, # 21C: never reached, but written over
+    ])
+    return disasm.analyze(image)
+
+  def test_analyze(self):
+    ''' Test following the control flow and splitting it into blocks. '''
+    analysis = self.analysis()
+    self.assertEqual(sorted(analysis.code), list(range(0x200, 0x216, 2)))
+    self.assertEqual(analysis.subroutines, {0x210})
+    self.assertEqual(analysis.blocks, {
+      0x200 : disasm.Block(0x200, 0x202, (0x202, 0x210)),
+      0x202 : disasm.Block(0x202, 0x204, (0x204, 0x206)),
+      0x204 : disasm.Block(0x204, 0x206, (0x20C,)),
+      0x206 : disasm.Block(0x206, 0x20C, ()),
+      0x20C : disasm.Block(0x20C, 0x210, (0x200,)),
+      0x210 : disasm.Block(0x210, 0x216, ()),
+    })
+    self.assertEqual(analysis.data, [(0x216, 0x21E)])
+    self.assertEqual(analysis.indirect, {0x20A})
+    self.assertEqual(analysis.self_modifying, set())
+    self.assertEqual(analysis.unknown_stores, {0x20C})
+    self.assertEqual(analysis.invalid, set())
+
+  def test_self_modifying(self):
+    ''' Test finding stores writing over code. '''
+    image = bytes([0xA2, 0x06, 0xF0, 0x55, 0x12, 0x00, 0x00, 0xE0])
+    analysis = disasm.analyze(image)
+    self.assertEqual(analysis.self_modifying, set())
+    self.assertEqual(analysis.data, [(0x206, 0x208)])
+    image = bytes([0xA2, 0x04, 0xF0, 0x55, 0x12, 0x00])
+    self.assertEqual(disasm.analyze(image).self_modifying, {0x202})
+
+  def test_memoized(self):
+    ''' Test that the same image is analyzed once. '''
+    self.assertIs(self.analysis(), self.analysis())
+
+  def test_listing(self):
+    ''' Test the labels, notes and data of the listing. '''
+    lines = self.analysis().listing()
+    self.assertEqual(lines[:3], ['loc_0x200:', '0x0200: 2210  CALL 0x210', 'loc_0x202:'])
+    self.assertIn('0x020A: B300  JP V0, 0x300  ; indirect jump', lines)
+    self.assertIn('0x020C: F033  LD B, V0  ; writes to unknown address', lines)
+    self.assertIn('sub_0x210:', lines)
+    self.assertEqual(lines[-1], '0x0216:       DB 0x00, 0x00, 0x80, 0x80, 0x12, 0x34, 0x60, 0x00')
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,123 @@
+import chip8
+import display
+import io
+import movie
+import os
+import subprocess
+import sys
+import tempfile
+import tracer
+import unittest
+
+class ScriptedDisplay(display.Display):
+  ''' Null display feeding a fixed list of events, one list per frame. '''
+  def __init__(self, events):
+    self._events = list(events)
+
+  def poll(self):
+    return self._events.pop(0) if self._events else []
+
+class TestDisplay(unittest.TestCase):
+  def setUp(self):
+    self.rom = tempfile.NamedTemporaryFile(suffix='.c8', delete=False)
+    # Draw the font sprite of 0 at (V0, V1) and spin.
+    self.rom.write(bytes([0xD0, 0x15, 0x12, 0x02]))
+    self.rom.close()
+
+  def tearDown(self):
+    os.unlink(self.rom.name)
+
+  def test_core_does_not_import_pygame(self):
+    ''' Test that the Cpu can be used without pygame being imported. '''
+    code = ('import chip8, sys; cpu = chip8.Cpu(); cpu.write_opcode(0x1200, 0x200); '
+        'cpu.run_cycles(10); sys.exit("pygame" in sys.modules)')
+    subprocess.check_call([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+  def test_null_display_frames(self):
+    ''' Test running a fixed number of frames headless. '''
+    emulator = chip8.Emulator(display.NullDisplay())
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=5)
+    self.assertEqual(emulator._cpu.cycles, 5 * emulator._cpu.cycles_per_frame)
+
+  def test_stats_dump(self):
+    ''' Test that the handler statistics are written when the run ends. '''
+    stream = io.StringIO()
+    emulator = chip8.Emulator(display.NullDisplay(), stats=stream)
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=2)
+    lines = stream.getvalue().splitlines()
+    self.assertEqual(sorted(line.split()[:2] for line in lines[1:]),
+        [['_op_drw', '1'], ['_op_jmp', '19']])
+
+  def test_trace(self):
+    ''' Test recording a trace of the run. '''
+    trace = io.BytesIO()
+    emulator = chip8.Emulator(display.NullDisplay(), trace=trace)
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=3)
+    trace.seek(0)
+    self.assertEqual(tracer.replay(trace, chip8.Cpu()), 3 * emulator._cpu.cycles_per_frame)
+
+  def test_movie(self):
+    ''' Test that a recorded movie plays back to the same state. '''
+    image = bytes([0xF0, 0x0A, 0xC1, 0xFF, 0xF0, 0x29, 0xD0, 0x15, 0x12, 0x00])
+    with open(self.rom.name, 'wb') as f:
+      f.write(image)
+    script = [[], [('key', 0x5, True)], [], [('key', 0x5, False), ('key', 0x9, True)],
+        [('key', 0x9, False)], [], [('key', 0x3, True)]]
+    recording = io.BytesIO()
+    emulator = chip8.Emulator(ScriptedDisplay(script), movie=recording, seed=11)
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=10)
+
+    recording.seek(0)
+    cpu = movie.Movie.read(recording).play(chip8.Cpu(), image)
+    self.assertEqual(cpu.snapshot(), emulator._cpu.snapshot())
+    self.assertEqual(cpu.V[0], 0x3)
+
+  def test_events(self):
+    ''' Test that key events reach the keypad and quit stops the run. '''
+    emulator = chip8.Emulator(ScriptedDisplay([[('key', 0xA, True)], [('quit',)]]))
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=10)
+    self.assertTrue(emulator._cpu.keyboard[0xA])
+    self.assertEqual(emulator._cpu.cycles, 2 * emulator._cpu.cycles_per_frame)
+
+  def test_save_and_load_state(self):
+    ''' Test saving the machine state to a file and loading it back. '''
+    emulator = chip8.Emulator(display.NullDisplay())
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=1)
+    with tempfile.TemporaryDirectory() as directory:
+      name = os.path.join(directory, 'state')
+      emulator.save_state(name)
+      blob = emulator._cpu.snapshot()
+      emulator.run(frames=3)
+      emulator.load_state(name)
+    self.assertEqual(emulator._cpu.snapshot(), blob)
+
+  def test_image_display(self):
+    ''' Test that frames with changes are captured as PBM images. '''
+    with tempfile.TemporaryDirectory() as directory:
+      emulator = chip8.Emulator(display.ImageDisplay(directory))
+      emulator.load_app(self.rom.name)
+      emulator.run(frames=3)
+      self.assertEqual(sorted(os.listdir(directory)), ['frame_000001.pbm'])
+      with open(os.path.join(directory, 'frame_000001.pbm'), 'rb') as f:
+        data = f.read()
+      self.assertEqual(data[:10], b'P4\n64 32\n\xf0')
+      self.assertEqual(len(data), 9 + 32*8)
+
+  def test_terminal_display(self):
+    ''' Test that the terminal display writes the drawn sprite. '''
+    stream = io.StringIO()
+    emulator = chip8.Emulator(display.TerminalDisplay(stream, fps=None))
+    emulator.load_app(self.rom.name)
+    emulator.run(frames=2)
+    self.assertIn('█', stream.getvalue())
+    self.assertTrue(stream.getvalue().endswith('\x1b[?25h'))
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,155 @@
+import chip8
+import framebuffer
+import random
+import unittest
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def reference_draw(gfx, x, y, sprite):
+  # Pixel by pixel drawing, as the Cpu used to do it.
+  collision = 0
+  for yline, byte in enumerate(sprite):
+    for xline in range(8):
+      if byte & (0x80 >> xline):
+        row = (y + yline) % len(gfx)
+        col = (x + xline) % len(gfx[0])
+        if gfx[row][col]:
+          collision = 1
+        gfx[row][col] ^= 1
+  return collision
+
+class TestPackedFramebuffer(unittest.TestCase):
+  def setUp(self):
+    self.dut = framebuffer.PackedFramebuffer()
+
+  def test_draw(self):
+    ''' Test drawing random sprites, wrapping around the edges. '''
+    random.seed()
+    ref = [[0] * self.dut.cols for row in range(self.dut.rows)]
+    for i in range(200):
+      x = random.randrange(256)
+      y = random.randrange(256)
+      sprite = [random.randrange(256) for n in range(random.randrange(16))]
+      self.assertEqual(self.dut.draw(x, y, sprite), reference_draw(ref, x, y, sprite))
+      for row in range(self.dut.rows):
+        self.assertSequenceEqual(self.dut.row(row), ref[row])
+
+  def test_collision(self):
+    ''' Test that erasing a pixel reports a collision. '''
+    self.assertEqual(self.dut.draw(62, 31, [0x81]), 0)
+    self.assertEqual(self.dut.pixel(31, 62), 1)
+    self.assertEqual(self.dut.pixel(31, 5), 1)
+    self.assertEqual(self.dut.draw(5, 31, [0x80]), 1)
+    self.assertEqual(self.dut.pixel(31, 5), 0)
+
+  def test_gfx_view(self):
+    ''' Test that gfx reads and writes through to the framebuffer. '''
+    gfx = self.dut.gfx
+    gfx[3][10] = 1
+    self.assertEqual(self.dut.pixel(3, 10), 1)
+    self.dut.draw(10, 3, [0x80])
+    self.assertEqual(gfx[3][10], 0)
+    self.assertEqual(len(gfx), self.dut.rows)
+    self.assertEqual(len(gfx[0]), self.dut.cols)
+
+  def test_gfx_view_index(self):
+    ''' Test that gfx wraps negative indices and rejects out of range ones,
+    as the list of lists it replaces did. '''
+    gfx = self.dut.gfx
+    gfx[0][-1] = 1
+    gfx[-1][0] = 1
+    self.assertEqual(gfx[0][self.dut.cols - 1], 1)
+    self.assertEqual(self.dut.pixel(self.dut.rows - 1, 0), 1)
+    for row, col in ((0, self.dut.cols), (0, -self.dut.cols - 1), (self.dut.rows, 0)):
+      with self.assertRaises(IndexError):
+        gfx[row][col] = 1
+      with self.assertRaises(IndexError):
+        gfx[row][col]
+    cpu = chip8.Cpu()
+    cpu.gfx[0][-1] = 1
+    restored = chip8.Cpu()
+    restored.restore(cpu.snapshot())
+    self.assertEqual(restored.gfx[0][63], 1)
+
+  def test_pack_unpack(self):
+    ''' Test that unpacking packed pixels restores them. '''
+    random.seed()
+    rows = [[random.randint(0, 1) for col in range(self.dut.cols)] for row in range(self.dut.rows)]
+    self.dut.load(rows)
+    data = self.dut.pack()
+    self.assertEqual(len(data), self.dut.rows * self.dut.cols // 8)
+    self.assertEqual(data[0] >> 7, rows[0][0])
+    self.dut.clear()
+    self.dut.unpack(data)
+    for row in range(self.dut.rows):
+      self.assertSequenceEqual(list(self.dut.row(row)), rows[row])
+
+  def test_load_and_clear(self):
+    ''' Test loading a list of lists and clearing in place. '''
+    random.seed()
+    rows = [[random.randint(0, 1) for col in range(self.dut.cols)] for row in range(self.dut.rows)]
+    bits = self.dut.bits
+    self.dut.load(rows)
+    for row in range(self.dut.rows):
+      self.assertSequenceEqual(self.dut.gfx[row], rows[row])
+    self.dut.clear()
+    self.assertIs(self.dut.bits, bits)
+    self.assertSequenceEqual(bits, [0] * self.dut.rows)
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestNumpyFramebuffer(TestPackedFramebuffer):
+  def setUp(self):
+    self.dut = framebuffer.NumpyFramebuffer()
+
+  def test_load_and_clear(self):
+    ''' Test loading a list of lists and clearing in place. '''
+    random.seed()
+    rows = [[random.randint(0, 1) for col in range(self.dut.cols)] for row in range(self.dut.rows)]
+    pixels = self.dut.pixels
+    self.dut.load(rows)
+    self.assertEqual(self.dut.pixels.tolist(), rows)
+    self.dut.clear()
+    self.assertIs(self.dut.pixels, pixels)
+    self.assertFalse(pixels.any())
+
+  def test_draw(self):
+    ''' Test drawing random sprites, wrapping around the edges. '''
+    random.seed()
+    ref = [[0] * self.dut.cols for row in range(self.dut.rows)]
+    for i in range(200):
+      x = random.randrange(256)
+      y = random.randrange(256)
+      sprite = [random.randrange(256) for n in range(random.randrange(16))]
+      self.assertEqual(self.dut.draw(x, y, sprite), reference_draw(ref, x, y, sprite))
+      self.assertEqual(self.dut.pixels.tolist(), ref)
+
+  def test_view(self):
+    ''' Test that views and rows are read-only and follow CLS and DRW. '''
+    cpu = chip8.Cpu(framebuffer.NumpyFramebuffer)
+    view = cpu.framebuffer.view()
+    with self.assertRaises(ValueError):
+      view[0, 0] = 1
+
+    cpu.write_opcode(0xD005, 0x200) # DRW V0, V0, 5
+    cpu.write_opcode(0x00E0, 0x202) # CLS
+    cpu.emulate_cycle()
+    self.assertEqual(view[:5, :4].tolist(), [[1, 1, 1, 1], [1, 0, 0, 1], [1, 0, 0, 1], [1, 0, 0, 1], [1, 1, 1, 1]])
+    cpu.emulate_cycle()
+    self.assertFalse(view.any())
+
+    row = cpu.framebuffer.row(0)
+    with self.assertRaises(ValueError):
+      row[0] = 1
+
+  def test_gfx_marks_dirty(self):
+    ''' Test that writes through gfx are seen by renderers. '''
+    self.dut.take_dirty()
+    self.dut.gfx[3][10] = 1
+    self.assertEqual(self.dut.take_dirty(), [(10, 3, 1, 1)])
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,98 @@
+import chip8
+import io
+import memtrack
+import unittest
+
+class TestMemoryTracker(unittest.TestCase):
+  def setUp(self):
+    self.cpu = chip8.Cpu()
+    program = [
+      0xA300, # 200: LD I, 0x300
+      0xF155, # 202: LD [I], V1
+      0xF065, # 204: LD V0, [I]
+      0xF033, # 206: LD B, V0
+      0xF029, # 208: LD F, V0
+      0xD005, # 20A: DRW V0, V0, 5
+      0xA212, # 20C: LD I, 0x212
+      0xF055, # 20E: LD [I], V0
+      0x1200, # 210: JP 0x200
+      0x0000, # 212: overwritten by the LD above, never executed
+    ]
+    for i, opcode in enumerate(program):
+      self.cpu.write_opcode(opcode, 0x200 + 2*i)
+    self.cpu.cycles_per_frame = 9
+
+  def test_counts(self):
+    ''' Test counting fetches, reads and writes. '''
+    tracker = self.cpu.enable_mem_tracking()
+    self.cpu.run_cycles(18)
+    for addr in range(0x200, 0x212):
+      self.assertEqual(tracker.fetches[addr], 2)
+    self.assertEqual(tracker.fetches[0x212], 0)
+    self.assertEqual(tracker.writes[0x300:0x303], [4, 4, 2])
+    self.assertEqual(tracker.reads[0x300], 2)
+    self.assertEqual(tracker.reads[0x000:0x006], [2, 2, 2, 2, 2, 0])
+    self.assertEqual(tracker.writes[0x212], 2)
+
+    self.assertEqual(tracker.kind(0x200), 'code')
+    self.assertEqual(tracker.kind(0x300), 'data')
+    self.assertEqual(tracker.kind(0x212), 'data')
+    self.assertIsNone(tracker.kind(0x400))
+    self.assertEqual(tracker.regions(),
+        [(0x000, 0x005, 'data'), (0x200, 0x212, 'code'), (0x212, 0x213, 'data'),
+         (0x300, 0x303, 'data')])
+
+    # One frame per pass through the loop, touching 18 bytes of code, 3 of
+    # data at 0x300, 5 of the font and 1 at 0x212.
+    self.assertEqual(tracker.working_sets, [27])
+    self.assertEqual(tracker.working_set(), 27)
+
+  def test_self_modified(self):
+    ''' Test that code written by the application is found. '''
+    self.cpu.write_opcode(0xA20E, 0x20C) # LD I, 0x20E
+    tracker = self.cpu.enable_mem_tracking()
+    self.cpu.run_cycles(9)
+    self.assertEqual(tracker.kind(0x20E), 'modified')
+    self.assertIn((0x20E, 0x20F, 'modified'), tracker.regions())
+
+  def test_fused(self):
+    ''' Test that fused handlers record every instruction they cover. '''
+    self.cpu.enable_fusion()
+    tracker = self.cpu.enable_mem_tracking()
+    self.cpu.run_cycles(18)
+    self.assertEqual(tracker.fetches[0x208:0x20C], [2, 2, 2, 2])
+    self.assertEqual(tracker.reads[0x000:0x006], [2, 2, 2, 2, 2, 0])
+
+  def test_disable(self):
+    ''' Test that disabling restores the untracked Cpu. '''
+    tracker = self.cpu.enable_mem_tracking()
+    self.cpu.disable_mem_tracking()
+    self.cpu.run_cycles(18)
+    self.assertEqual(sum(tracker.fetches) + sum(tracker.writes), 0)
+    self.assertEqual(self.cpu.read.__func__, chip8.Cpu.read)
+    self.assertIs(self.cpu._decoded[0x200][0].__func__, chip8.Cpu._op_ldi)
+
+  def test_export(self):
+    ''' Test writing the CSV and the heatmap. '''
+    tracker = self.cpu.enable_mem_tracking()
+    self.cpu.run_cycles(18)
+    f = io.StringIO()
+    tracker.write_csv(f)
+    lines = f.getvalue().splitlines()
+    self.assertEqual(len(lines), 4097)
+    self.assertEqual(lines[0x301], '0x300,0,2,4')
+
+    f = io.BytesIO()
+    tracker.write_heatmap(f, scale=2)
+    data = f.getvalue()
+    header = b'P5\n128 128\n255\n'
+    self.assertTrue(data.startswith(header))
+    pixels = data[len(header):]
+    self.assertEqual(len(pixels), 128 * 128)
+    self.assertEqual(pixels[12*128*2], 255) # Address 0x300, the most accessed.
+    self.assertGreater(pixels[8*128*2], 0) # Address 0x200.
+    self.assertEqual(pixels[8*128*2 + 2*0x3F], 0)
+
+
+if '__main__' == __name__:
+  unittest.main()
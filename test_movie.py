@@ -0,0 +1,87 @@
+import chip8
+import io
+import movie
+import roms
+import unittest
+
+image = bytes([
+  0xF0, 0x0A, # 200: LD V0, K
+  0xC1, 0xFF, # 202: RND V1, 0xFF
+  0xF0, 0x29, # 204: LD F, V0
+  0xD0, 0x15, # 206: DRW V0, V1, 5
+  0xE0, 0xA1, # 208: SKNP V0
+  0x72, 0x01, # 20A: ADD V2, 1
+  0x12, 0x00, # 20C: JP 0x200
+])
+
+def keyboard(*keys):
+  return [key in keys for key in range(16)]
+
+class TestMovie(unittest.TestCase):
+  def test_record(self):
+    ''' Test that every change of the keypad is kept, and only those. '''
+    recording = movie.Movie(7, roms.rom_hash(image))
+    recording.record(0, keyboard())
+    recording.record(3, keyboard(0x5))
+    recording.record(3, keyboard(0x5, 0x6))
+    recording.record(4, keyboard(0x5, 0x6))
+    recording.record(8, keyboard(0x6))
+    recording.record(9, keyboard(0x6, 0x1))
+    recording.record(9, keyboard(0x6))
+    self.assertEqual(recording.events,
+        [(3, 0x0020), (3, 0x0060), (8, 0x0040), (9, 0x0042), (9, 0x0040)])
+
+  def test_write_read(self):
+    ''' Test writing a movie and reading it back. '''
+    recording = movie.Movie(2**64 - 1, roms.rom_hash(image), 15)
+    recording.record(1, keyboard(0xF))
+    recording.record(2, keyboard())
+    recording.frames = 10
+    f = io.BytesIO()
+    recording.write(f)
+    self.assertEqual(len(f.getvalue()), movie._header.size + 2 * movie._event.size)
+
+    f.seek(0)
+    copy = movie.Movie.read(f)
+    self.assertEqual(vars(copy), vars(recording))
+
+  def test_invalid(self):
+    ''' Test reading something else than a movie. '''
+    with self.assertRaises(movie.InvalidMovie):
+      movie.Movie.read(io.BytesIO(b'C8TR' + bytes(100)))
+    f = io.BytesIO()
+    recording = movie.Movie(0, roms.rom_hash(image))
+    recording.record(1, keyboard(0x1))
+    recording.write(f)
+    with self.assertRaises(movie.InvalidMovie):
+      movie.Movie.read(io.BytesIO(f.getvalue()[:-1]))
+    with self.assertRaises(movie.InvalidMovie):
+      recording.play(chip8.Cpu(), image + b'\x00')
+
+  def test_play(self):
+    ''' Test that playing a movie twice gives the same run. '''
+    recording = movie.Movie(3, roms.rom_hash(image))
+    for frame, key in enumerate((0x1, 0x2, 0x3, 0x4), 1):
+      recording.record(2 * frame, keyboard(key))
+      recording.record(2 * frame + 1, keyboard())
+    recording.frames = 12
+    cpus = [recording.play(chip8.Cpu(), image) for run in range(2)]
+    self.assertEqual(cpus[0].snapshot(), cpus[1].snapshot())
+    self.assertEqual(cpus[0].cycles, 12 * cpus[0].cycles_per_frame)
+    self.assertEqual(cpus[0].seed, 3)
+    self.assertEqual(cpus[0].V[0], 0x4)
+    self.assertEqual(cpus[0].V[2], 4)
+
+  def test_play_tap(self):
+    ''' Test that a key pressed and released in one frame is played back. '''
+    recording = movie.Movie(3, roms.rom_hash(image))
+    recording.record(2, keyboard(0x5))
+    recording.record(2, keyboard())
+    recording.frames = 3
+    cpu = recording.play(chip8.Cpu(), image)
+    self.assertEqual(cpu.V[0], 0x5)
+    self.assertFalse(any(cpu.keyboard))
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,62 @@
+import chip8
+import os
+import profiler
+import tempfile
+import unittest
+
+class TestGuestProfiler(unittest.TestCase):
+  def setUp(self):
+    # Main loop calling a subroutine that spends most of its time in an
+    # inner loop counting V1 up to 0x40.
+    program = [
+      0x2206, # 200: CALL 0x206
+      0x7001, # 202: ADD V0, 1
+      0x1200, # 204: JP 0x200
+      0x6100, # 206: LD V1, 0
+      0x7101, # 208: ADD V1, 1
+      0x3140, # 20A: SE V1, 0x40
+      0x1208, # 20C: JP 0x208
+      0x00EE, # 20E: RET
+    ]
+    self.cpu = chip8.Cpu()
+    for i, opcode in enumerate(program):
+      self.cpu.write_opcode(opcode, 0x200 + 2*i)
+    self.dut = profiler.GuestProfiler(self.cpu, interval=7)
+
+  def test_hot(self):
+    ''' Test that the inner loop is found to be hot. '''
+    self.dut.run_cycles(20000)
+    self.assertEqual(self.cpu.cycles, 20000)
+    self.assertGreater(sum(self.dut.samples.values()), 20000 // 11)
+    hot = self.dut.hot(3)
+    self.assertEqual(sorted(pc for pc, samples in hot), [0x208, 0x20A, 0x20C])
+
+    report = self.dut.report(3).splitlines()
+    self.assertEqual(len(report), 4)
+    self.assertTrue(any(line.endswith('0x0208 ADD V1, 0x01') for line in report))
+
+  def test_collapsed(self):
+    ''' Test the collapsed stacks. '''
+    self.dut.run_cycles(20000)
+    lines = self.dut.collapsed()
+    stacks = dict(line.rsplit(' ', 1) for line in lines)
+    self.assertEqual(sum(int(samples) for samples in stacks.values()),
+        sum(self.dut.samples.values()))
+    self.assertIn('main;sub_0x206;0x0208 ADD V1, 0x01', stacks)
+    self.assertIn('main;0x0202 ADD V0, 0x01', stacks)
+    self.assertTrue(all(stack.startswith('main') for stack in stacks))
+
+  def test_main(self):
+    ''' Test profiling an application from the command line. '''
+    with tempfile.TemporaryDirectory() as directory:
+      rom = os.path.join(directory, 'app.ch8')
+      with open(rom, 'wb') as f:
+        f.write(bytes(self.cpu.memory[0x200:0x210]))
+      collapsed = os.path.join(directory, 'stacks.txt')
+      profiler.main([rom, '--frames', '100', '--collapsed', collapsed])
+      with open(collapsed) as f:
+        self.assertTrue(f.read().startswith('main'))
+
+
+if '__main__' == __name__:
+  unittest.main()
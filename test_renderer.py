@@ -0,0 +1,92 @@
+import chip8
+import io
+import os
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import renderer
+
+class TestSurfaceRenderer(unittest.TestCase):
+  def setUp(self):
+    pygame.display.init()
+    self.display = pygame.display.set_mode((64*4, 32*4))
+    self.cpu = chip8.Cpu()
+    self.dut = renderer.SurfaceRenderer(self.display, self.cpu.framebuffer, 4,
+        ((0, 0, 0), (0, 255, 0)))
+
+  def tearDown(self):
+    pygame.display.quit()
+
+  def assertDisplayMatches(self):
+    for row in range(self.cpu.rows):
+      for col in range(self.cpu.cols):
+        expected = (0, 255, 0) if self.cpu.gfx[row][col] else (0, 0, 0)
+        self.assertEqual(tuple(self.display.get_at((col*4 + 1, row*4 + 2)))[:3], expected)
+
+  def test_render_dirty_rects(self):
+    ''' Test that only the rectangles touched by DRW are updated. '''
+    self.dut.render()
+    self.assertEqual(self.dut.render(), [])
+
+    self.cpu.write_opcode(0xD015, 0x200) # DRW V0, V1, 5
+    self.cpu.V[0] = 60
+    self.cpu.V[1] = 2
+    self.cpu.emulate_cycle()
+    rects = self.dut.render()
+    self.assertEqual(rects, [pygame.Rect(240, 8, 16, 20), pygame.Rect(0, 8, 16, 20)])
+    self.assertDisplayMatches()
+
+  def test_render_cls(self):
+    ''' Test that CLS redraws the whole display. '''
+    self.cpu.write_opcode(0xD015, 0x200) # DRW V0, V1, 5
+    self.cpu.write_opcode(0x00E0, 0x202) # CLS
+    self.cpu.emulate_cycle()
+    self.dut.render()
+    self.cpu.emulate_cycle()
+    self.assertEqual(self.dut.render(), [pygame.Rect(0, 0, 64*4, 32*4)])
+    self.assertDisplayMatches()
+
+class TestTerminalRenderer(unittest.TestCase):
+  def setUp(self):
+    self.cpu = chip8.Cpu()
+    self.stream = io.StringIO()
+    self.dut = renderer.TerminalRenderer(self.cpu.framebuffer, self.stream)
+
+  def take(self):
+    out = self.stream.getvalue()
+    self.stream.seek(0)
+    self.stream.truncate()
+    return out
+
+  def test_first_frame(self):
+    ''' Test that the first frame clears the terminal. '''
+    self.assertEqual(self.dut.render(), 0)
+    self.assertEqual(self.take(), '\x1b[2J\x1b[?25l')
+
+  def test_changed_cells_only(self):
+    ''' Test that only changed cells are written, with half blocks. '''
+    self.dut.render()
+    self.take()
+    self.assertEqual(self.dut.render(), 0)
+    self.assertEqual(self.take(), '')
+
+    # Rows 1 and 2 of the font sprite of 1 at (10, 1): 0x20 then 0x60.
+    self.cpu.I = 5
+    self.cpu.V[0] = 10
+    self.cpu.V[1] = 1
+    self.cpu.write_opcode(0xD012, 0x200) # DRW V0, V1, 2
+    self.cpu.emulate_cycle()
+    self.assertEqual(self.dut.render(), 3)
+    self.assertEqual(self.take(), '\x1b[1;13H\u2584\x1b[2;12H\u2580\u2580')
+
+    # Drawing it again erases it.
+    self.cpu.pc = 0x200
+    self.cpu.emulate_cycle()
+    self.assertEqual(self.dut.render(), 3)
+    self.assertEqual(self.take(), '\x1b[1;13H \x1b[2;12H  ')
+
+
+if '__main__' == __name__:
+  unittest.main()
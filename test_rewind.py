@@ -0,0 +1,111 @@
+import chip8
+import rewind
+import unittest
+
+class TestRewindBuffer(unittest.TestCase):
+  def setUp(self):
+    # Program drawing a moving sprite and storing V0 in memory, so that
+    # registers, memory and display all change every frame.
+    self.cpu = chip8.Cpu()
+    program = [
+      0x7001, # ADD V0, 1
+      0xA300, # LD I, 0x300
+      0xF055, # LD [I], V0
+      0xF029, # LD F, V0
+      0xD015, # DRW V0, V1, 5
+      0x1200, # JP 0x200
+    ]
+    for i, opcode in enumerate(program):
+      self.cpu.write_opcode(opcode, 0x200 + 2*i)
+
+  def record(self, history, frames):
+    states = []
+    for i in range(frames):
+      self.cpu.run_frame()
+      states.append(self.cpu.snapshot())
+      history.push(states[-1])
+    return states
+
+  def test_state(self):
+    ''' Test rebuilding states from keyframes and deltas. '''
+    history = rewind.RewindBuffer(keyframe_interval=10)
+    states = self.record(history, 35)
+    self.assertEqual(len(history), 35)
+    for back in range(35):
+      self.assertEqual(history.state(back), states[-1 - back])
+    with self.assertRaises(IndexError):
+      history.state(35)
+
+  def test_rewind(self):
+    ''' Test stepping back and recording again from there. '''
+    history = rewind.RewindBuffer(keyframe_interval=10)
+    states = self.record(history, 25)
+    self.assertEqual(history.rewind(12), states[12])
+    self.assertEqual(len(history), 13)
+
+    self.cpu.restore(states[12])
+    more = self.record(history, 5)
+    self.assertEqual(len(history), 18)
+    self.assertEqual(history.state(0), more[-1])
+    self.assertEqual(history.state(5), states[12])
+    self.assertEqual(history.rewind(100), states[0])
+    self.assertEqual(len(history), 1)
+
+  def test_eviction(self):
+    ''' Test that the oldest frames are dropped to stay within limits. '''
+    history = rewind.RewindBuffer(max_frames=30, keyframe_interval=10)
+    states = self.record(history, 100)
+    self.assertLessEqual(len(history), 30)
+    self.assertGreaterEqual(len(history), 20)
+    self.assertEqual(history.state(len(history) - 1), states[-len(history)])
+
+    history = rewind.RewindBuffer(max_bytes=20000, keyframe_interval=10)
+    self.record(history, 100)
+    self.assertLessEqual(history.size, 20000)
+    self.assertLess(len(history), 100)
+
+  def test_eviction_within_group(self):
+    ''' Test that max_bytes holds when the last group alone exceeds it. '''
+    history = rewind.RewindBuffer(max_bytes=8000, keyframe_interval=60)
+    states = self.record(history, 50)
+    self.assertLessEqual(history.size, 8000)
+    self.assertGreater(len(history), 1)
+    for back in range(len(history)):
+      self.assertEqual(history.state(back), states[-1 - back])
+
+    # Below the size of one snapshot only the newest state is kept.
+    history = rewind.RewindBuffer(max_bytes=100, keyframe_interval=10)
+    states = self.record(history, 15)
+    self.assertEqual(len(history), 1)
+    self.assertEqual(history.state(0), states[-1])
+    self.assertGreater(history.size, 100)
+
+  def test_deltas_are_small(self):
+    ''' Test that frames between keyframes cost much less than a snapshot. '''
+    history = rewind.RewindBuffer(keyframe_interval=60)
+    states = self.record(history, 60)
+    self.assertLess(history.size, len(states) * len(states[0]) // 4)
+
+
+class TestEmulatorRewind(unittest.TestCase):
+  def test_rewind(self):
+    ''' Test that the Emulator records every frame and can go back. '''
+    emulator = chip8.Emulator(chip8.display.Display(), rewind.RewindBuffer())
+    cpu = emulator._cpu
+    cpu.write_opcode(0x7001, 0x200) # ADD V0, 1
+    cpu.write_opcode(0x1200, 0x202) # JP 0x200
+    emulator.history.push(cpu.snapshot())
+    emulator.run(frames=10)
+    self.assertEqual(len(emulator.history), 11)
+    self.assertEqual(cpu.V[0], 50)
+
+    emulator.rewind(4)
+    self.assertEqual(cpu.V[0], 30)
+    self.assertEqual(cpu.cycles, 60)
+    emulator.rewind(100)
+    self.assertEqual(cpu.V[0], 0)
+    self.assertEqual(cpu.cycles, 0)
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,82 @@
+import chip8
+import os
+import roms
+import tempfile
+import unittest
+import zipfile
+
+class TestRomCatalog(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.files = {
+      'a.c8' : bytes([0x60, 0x01, 0x12, 0x02]),
+      'b.ch8' : bytes([0x60, 0x02, 0x12, 0x02]),
+      os.path.join('sub', 'c.c8') : bytes([0x60, 0x01, 0x12, 0x02]),
+      'notes.txt' : b'not a rom',
+    }
+    for name, image in self.files.items():
+      full_name = os.path.join(self.directory.name, name)
+      os.makedirs(os.path.dirname(full_name), exist_ok=True)
+      with open(full_name, 'wb') as f:
+        f.write(image)
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def check(self, catalog, names):
+    self.assertEqual(catalog.names(), names)
+    self.assertEqual(len(catalog), 2)
+    self.assertEqual(catalog.hash_of(names[0]), catalog.hash_of(names[2]))
+    self.assertEqual(catalog.image(names[1]), self.files['b.ch8'])
+    self.assertIn(roms.rom_hash(self.files['b.ch8']), catalog)
+
+    cpu = chip8.Cpu()
+    catalog.load(cpu, catalog.hash_of(names[1]))
+    cpu.run_cycles(2)
+    self.assertEqual(cpu.V[0], 2)
+
+  def test_directory(self):
+    ''' Test indexing a directory tree. '''
+    catalog = roms.RomCatalog(self.directory.name)
+    self.check(catalog, ['a.c8', 'b.ch8', os.path.join('sub', 'c.c8')])
+
+  def test_zip(self):
+    ''' Test indexing a zip file. '''
+    name = os.path.join(self.directory.name, 'roms.zip')
+    with zipfile.ZipFile(name, 'w') as archive:
+      for file_name, image in sorted(self.files.items()):
+        archive.writestr(file_name.replace(os.sep, '/'), image)
+    catalog = roms.RomCatalog(name)
+    self.check(catalog, ['a.c8', 'b.ch8', 'sub/c.c8'])
+
+class TestLoad(unittest.TestCase):
+  def test_load_app(self):
+    ''' Test loading an application file into memory. '''
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+      f.write(bytes(range(256)) * 16)
+    try:
+      cpu = chip8.Cpu()
+      cpu.write(0xAA, 0x300)
+      cpu.load_app(f.name)
+    finally:
+      os.unlink(f.name)
+    self.assertEqual(cpu.memory[:80], bytes(chip8.Cpu.font_set))
+    self.assertEqual(cpu.memory[0x200:], (bytes(range(256)) * 16)[:0xE00])
+
+  def test_load_image(self):
+    ''' Test loading an in-memory image. '''
+    cpu = chip8.Cpu()
+    cpu.write(0xAA, 0x300)
+    cpu.load_image(memoryview(b'\x60\x07'))
+    self.assertEqual(cpu.memory[0x200:0x203], b'\x60\x07\x00')
+    self.assertEqual(cpu.read(0x300), 0)
+
+  def test_write_wraps_byte(self):
+    ''' Test that writing a value wider than a byte keeps its low byte. '''
+    cpu = chip8.Cpu()
+    cpu.write(0x1234, 0x300)
+    self.assertEqual(cpu.read(0x300), 0x34)
+
+
+if '__main__' == __name__:
+  unittest.main()
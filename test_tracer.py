@@ -0,0 +1,112 @@
+import chip8
+import io
+import tracer
+import unittest
+
+class TestTracer(unittest.TestCase):
+  def setUp(self):
+    self.cpu = chip8.Cpu(seed=1)
+    program = [
+      0x6005, # 200: LD V0, 5
+      0xC1FF, # 202: RND V1, 0xFF
+      0xA300, # 204: LD I, 0x300
+      0xF155, # 206: LD [I], V1
+      0xF033, # 208: LD B, V0
+      0xF029, # 20A: LD F, V0
+      0xD015, # 20C: DRW V0, V1, 5
+      0xE3A1, # 20E: SKNP V3
+      0xF20A, # 210: LD V2, K
+      0x7001, # 212: ADD V0, 1
+      0x1202, # 214: JP 0x202
+    ]
+    for i, opcode in enumerate(program):
+      self.cpu.write_opcode(opcode, 0x200 + 2*i)
+    self.cpu.V[3] = 0x7
+
+  def record(self, cycles=100, buffer_size=1 << 16):
+    f = io.BytesIO()
+    with tracer.TraceWriter(f, self.cpu, buffer_size) as writer:
+      writer.run_cycles(cycles)
+    f.seek(0)
+    return f
+
+  def test_records(self):
+    ''' Test the content of the records. '''
+    f = self.record(10)
+    records = list(tracer.read_trace(f))
+    self.assertEqual(len(records), 10)
+    self.assertEqual([record.pc for record in records],
+        [0x200, 0x202, 0x204, 0x206, 0x208, 0x20A, 0x20C, 0x20E, 0x212, 0x214])
+    self.assertEqual(records[0].opcode, 0x6005)
+    self.assertEqual(records[0].changed, 0x0001)
+    self.assertEqual(records[0].V[0], 5)
+    self.assertEqual(records[1].V[1], chip8.random_pool(1, 0)[0])
+    self.assertEqual(records[2].I, 0x300)
+    self.assertEqual(records[3].write_addr, 0x300)
+    self.assertEqual(records[3].write_data, bytes(records[1].V[:2]))
+    self.assertEqual(records[4].write_data, bytes([0, 0, 5]))
+    self.assertEqual(records[5].write_data, b'')
+    self.assertTrue(records[6].flags & tracer.DRAW)
+    self.assertFalse(records[5].flags & tracer.DRAW)
+    self.assertEqual(records[9].cycle, 9)
+
+  def test_filters(self):
+    ''' Test reading only some addresses or opcodes. '''
+    f = self.record(100)
+    records = list(tracer.read_trace(f, pcs=range(0x20C, 0x210)))
+    self.assertTrue(records)
+    self.assertEqual(set(record.pc for record in records), {0x20C, 0x20E})
+    f.seek(0)
+    records = list(tracer.read_trace(f, opcode=0xF000, mask=0xF000))
+    self.assertEqual(set(record.opcode for record in records), {0xF155, 0xF033, 0xF029})
+
+  def test_key_wait(self):
+    ''' Test that the steps blocked on LD Vx, K are recorded with the keys. '''
+    self.cpu.write_opcode(0x6300, 0x20E) # LD V3, 0
+    f = io.BytesIO()
+    with tracer.TraceWriter(f, self.cpu) as writer:
+      writer.run_cycles(20)
+      self.cpu.press_key(0x9)
+      writer.run_cycles(2)
+    f.seek(0)
+    records = list(tracer.read_trace(f))
+    waits = [record for record in records if record.flags & tracer.KEY_WAIT]
+    self.assertEqual(len(waits), 20 - 8)
+    self.assertTrue(all(0x210 == record.pc for record in waits))
+    self.assertEqual(records[20].keys, 1 << 0x9)
+    self.assertEqual(records[20].V[2], 0x9)
+
+    f.seek(0)
+    self.assertEqual(tracer.replay(f, chip8.Cpu()), 22)
+
+  def test_replay(self):
+    ''' Test replaying a trace, small buffer and all, on a fresh Cpu. '''
+    self.cpu.run_cycles(37)
+    f = self.record(500, buffer_size=100)
+    self.assertEqual(tracer.replay(f, chip8.Cpu()), 500)
+
+  def test_replay_mismatch(self):
+    ''' Test that a trace not matching the execution is caught. '''
+    data = bytearray(self.record(50).getvalue())
+    # Change the first byte of V in the last record.
+    data[-tracer._record.size + 19] ^= 0xFF
+    with self.assertRaises(tracer.TraceMismatch):
+      tracer.replay(io.BytesIO(bytes(data)), chip8.Cpu())
+
+  def test_invalid(self):
+    ''' Test reading something else than a trace. '''
+    with self.assertRaises(tracer.InvalidTrace):
+      tracer.read_trace(io.BytesIO(b'C8SS' + bytes(100)))
+    data = self.record(5).getvalue()
+    with self.assertRaises(tracer.InvalidTrace):
+      list(tracer.read_trace(io.BytesIO(data[:-1])))
+
+  def test_format_record(self):
+    ''' Test the text form of a record. '''
+    record = next(tracer.read_trace(self.record(1)))
+    self.assertEqual(tracer.format_record(record),
+        '         0 0x200: 6005  LD V0, 0x05        V0=05')
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,97 @@
+import chip8
+import random
+import translator
+import unittest
+
+def load(cpu, opcodes, addr=0x200):
+  for i, opcode in enumerate(opcodes):
+    cpu.write_opcode(opcode, addr + 2*i)
+
+class TestTranslator(unittest.TestCase):
+  def setUp(self):
+    self.ref = chip8.Cpu()
+    self.dut = chip8.Cpu()
+    self.translator = translator.Translator(self.dut)
+
+  def assertSameState(self):
+    self.assertEqual(self.dut.pc, self.ref.pc)
+    self.assertEqual(self.dut.I, self.ref.I)
+    self.assertSequenceEqual(self.dut.V, self.ref.V)
+    self.assertEqual(self.dut.delay_timer, self.ref.delay_timer)
+    for row in range(self.ref.rows):
+      self.assertSequenceEqual(self.dut.gfx[row], self.ref.gfx[row])
+
+  def test_alu_matches_interpreter(self):
+    ''' Test that every translated 8xy* op matches the Cpu handlers. '''
+    random.seed()
+    for n in (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE):
+      for x in range(len(self.ref.V)):
+        for y in range(len(self.ref.V)):
+          values = [random.randrange(256) for i in range(len(self.ref.V))]
+          for cpu in (self.ref, self.dut):
+            cpu.pc = 0x200
+            cpu.V = list(values)
+            load(cpu, [0x8000 | (x << 8) | (y << 4) | n, 0x1200])
+
+          self.ref.emulate_cycle()
+          self.ref.emulate_cycle()
+          self.assertEqual(self.translator.run(2), 2)
+          self.assertSameState()
+
+  def test_loop_matches_interpreter(self):
+    ''' Test a drawing loop mixing translated and untranslated opcodes. '''
+    program = [
+      0x6000, # LD V0, 0
+      0x6108, # LD V1, 8
+      0x6205, # LD V2, 5
+      0xF229, # LD F, V2 (not translated)
+      0xD015, # DRW V0, V1, 5
+      0x7005, # ADD V0, 5
+      0x3040, # SE V0, 0x40
+      0x1208, # JP 0x208
+      0x6300, # LD V3, 0
+      0x1210, # JP 0x210
+    ]
+    for cpu in (self.ref, self.dut):
+      load(cpu, program)
+      cpu.delay_timer = 200
+
+    executed = self.translator.run(300)
+    for i in range(executed):
+      self.ref.emulate_cycle()
+    self.assertSameState()
+
+  def test_code_write_discards_block(self):
+    ''' Test that overwriting translated code is picked up. '''
+    load(self.dut, [0x6011, 0x1200])
+    self.translator.run(2)
+    self.assertEqual(self.dut.V[0], 0x11)
+
+    self.dut.write_opcode(0x6022, 0x200)
+    self.translator.run(2)
+    self.assertEqual(self.dut.V[0], 0x22)
+
+  def test_code_write_over_untranslated_instruction(self):
+    ''' Test that an untranslated instruction overwritten with a
+    translatable one gets translated. '''
+    load(self.dut, [0xF01E, 0x1200])
+    self.translator.run(2)
+    self.assertIsNone(self.translator.source(0x200))
+
+    self.dut.write_opcode(0x6044, 0x200)
+    self.translator.run(2)
+    self.assertEqual(self.dut.V[0], 0x44)
+    self.assertIsNotNone(self.translator.source(0x200))
+
+  def test_reset_discards_blocks(self):
+    ''' Test that blocks do not survive a reset of the Cpu. '''
+    load(self.dut, [0x6011, 0x1200])
+    self.translator.run(2)
+    self.dut.reset()
+    load(self.dut, [0x6033, 0x1200])
+    self.translator.run(2)
+    self.assertEqual(self.dut.V[0], 0x33)
+
+
+if '__main__' == __name__:
+  unittest.main()
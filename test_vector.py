@@ -0,0 +1,130 @@
+import chip8
+import random
+import unittest
+
+try:
+  import numpy
+  import vector
+except ImportError:
+  numpy = None
+
+# Program exercising most instructions, looping forever.
+program = [
+  0x8014, 0x8125, 0x8236, 0x834E, 0x8457, 0x8F64, 0x3005, 0x7103,
+  0x4106, 0x5230, 0x9340, 0xE59E, 0xE6A1, 0xA300, 0xF733, 0xF229,
+  0xD015, 0xF815, 0xF907, 0x2240, 0xA310, 0xF555, 0xFA1E, 0xF365,
+  0x8B01, 0x8C12, 0x8D23, 0x8E30, 0x3B00, 0x00E0, 0x1200, 0x0000,
+  0x7701, 0x8F15, 0x81F5, 0x8F17, 0x81F7, 0x00EE,
+]
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestVectorCpu(unittest.TestCase):
+  def machines(self, n):
+    # n Cpus running program from different registers and keys.
+    random.seed(n)
+    cpus = []
+    for i in range(n):
+      cpu = chip8.Cpu()
+      for addr, opcode in enumerate(program):
+        cpu.write_opcode(opcode, 0x200 + 2*addr)
+      cpu.V = [random.randrange(0x100) for reg in range(16)]
+      cpu.keyboard = [random.random() < 0.5 for key in range(16)]
+      cpus.append(cpu)
+    return cpus
+
+  def test_lockstep(self):
+    ''' Test that every machine runs exactly as a Cpu would. '''
+    cpus = self.machines(16)
+    dut = vector.VectorCpu(len(cpus))
+    for i, cpu in enumerate(cpus):
+      dut.restore(i, cpu.snapshot())
+
+    for frame in range(20):
+      dut.run_frame()
+      for cpu in cpus:
+        cpu.run_frame()
+      for i, cpu in enumerate(cpus):
+        self.assertEqual(dut.snapshot(i), cpu.snapshot(), 'machine {} frame {}'.format(i, frame))
+    self.assertTrue(dut.running.all())
+
+  def test_load_image(self):
+    ''' Test loading the same application into every machine. '''
+    image = b''.join(opcode.to_bytes(2, 'big') for opcode in program)
+    dut = vector.VectorCpu(3, seed=0)
+    dut.load_image(image)
+    dut.run_cycles(100)
+    for i in range(3):
+      cpu = chip8.Cpu(seed=i)
+      cpu.load_image(image)
+      cpu.run_cycles(100)
+      self.assertEqual(dut.snapshot(i), cpu.snapshot())
+
+  def test_errors(self):
+    ''' Test that a failing machine stops without affecting the others. '''
+    dut = vector.VectorCpu(3)
+    dut.load_image(bytes([0x30, 0x00, 0xFF, 0xFF, 0x12, 0x00])) # SE V0, 0
+    dut.V[1, 0] = 1
+    dut.sp[2] = 16
+    self.assertEqual(dut.run_cycles(10), 10)
+    self.assertEqual(dut.running.tolist(), [True, False, False])
+    self.assertIsInstance(dut.errors[1], chip8.UnsupportedOpcode)
+    self.assertIsInstance(dut.errors[2], chip8.StackPointerOutOfRange)
+    self.assertEqual(dut.pc[1], 0x204)
+    self.assertEqual(dut.cycles, 10)
+
+    dut.running[0] = False
+    self.assertEqual(dut.run_cycles(10), 0)
+
+  def test_rnd(self):
+    ''' Test that random bytes are masked and reproducible from a seed. '''
+    image = bytes([0xC0, 0x0F, 0xC1, 0xFF, 0x12, 0x00])
+    runs = []
+    for run in range(2):
+      dut = vector.VectorCpu(100, seed=1)
+      dut.load_image(image)
+      dut.run_cycles(2)
+      self.assertTrue((dut.V[:, 0] <= 0x0F).all())
+      runs.append(dut.V.copy())
+    self.assertTrue((runs[0] == runs[1]).all())
+    self.assertGreater(len(numpy.unique(runs[0][:, 1])), 1)
+
+  def test_rnd_matches_cpu(self):
+    ''' Test that machines draw the same bytes as a Cpu with their seed,
+    past the end of the first pool. '''
+    image = bytes([0xC0, 0xFF, 0x12, 0x00])
+    dut = vector.VectorCpu(2, seed=7)
+    dut.load_image(image)
+    dut.run_cycles(10000)
+    for i in range(2):
+      cpu = chip8.Cpu(seed=7 + i)
+      cpu.load_image(image)
+      cpu.run_cycles(10000)
+      self.assertEqual(dut.snapshot(i), cpu.snapshot())
+
+  def test_ldvk(self):
+    ''' Test that machines wait for a key independently. '''
+    dut = vector.VectorCpu(2)
+    dut.load_image(bytes([0xF3, 0x0A, 0x12, 0x00]))
+    dut.keyboard[1, 0xB] = True
+    dut.run_cycles(3)
+    self.assertEqual(dut.pc.tolist(), [0x200, 0x202])
+    self.assertEqual(dut.V[:, 3].tolist(), [0, 0xB])
+
+    # Blocked and running machines snapshot as a Cpu would.
+    for i in range(2):
+      cpu = chip8.Cpu(seed=int(dut.seed[i]))
+      cpu.load_image(bytes([0xF3, 0x0A, 0x12, 0x00]))
+      cpu.keyboard = dut.keyboard[i].tolist()
+      for cycle in range(3):
+        cpu.emulate_cycle()
+      self.assertEqual(dut.snapshot(i), cpu.snapshot())
+
+    dut.restore(0, dut.snapshot(0))
+    dut.keyboard[0, 0x4] = True
+    dut.run_cycles(1)
+    self.assertEqual(dut.V[:, 3].tolist(), [0x4, 0xB])
+    self.assertEqual(dut.key_wait.tolist(), [-1, -1])
+
+
+if '__main__' == __name__:
+  unittest.main()
@@ -0,0 +1,269 @@
+''' Execution traces of the chip8 Cpu.
+
+A TraceWriter runs a Cpu one instruction at a time and streams a fixed
+width binary record per instruction: the cycle it started at, pc, opcode,
+the keys down, the registers it changed with their new values, I, sp, the
+bytes it wrote to memory and whether it drew. The file starts with a
+snapshot of the Cpu so that read_trace() can hand the records back, as a
+generator with optional pc and opcode filters, and replay() can run the
+trace again on a Cpu and check every record. '''
+
+import argparse
+import collections
+import disasm
+import struct
+import sys
+
+class InvalidTrace(Exception):
+  pass
+
+class TraceMismatch(Exception):
+  pass
+
+# A record as returned by read_trace(). changed is the mask of the V
+# registers the instruction changed and V their values afterwards, I and sp
+# are the values afterwards, write_addr and write_data the bytes written to
+# memory, if any.
+TraceRecord = collections.namedtuple('TraceRecord',
+    'cycle pc opcode keys flags changed V I sp write_addr write_data')
+
+# Record flags.
+DRAW = 0x01     # The instruction drew on the screen.
+KEY_WAIT = 0x02 # The Cpu is blocked on LD Vx, K after the instruction.
+
+_magic = b'C8TR'
+_version = 1
+# Magic, version and size of the snapshot following the header.
+_header = struct.Struct('<4sBI')
+_record = struct.Struct('<QHHHBH16sHbHB16s')
+
+def _written(opcode, I):
+  # Address and number of the bytes opcode writes to memory with I as it is
+  # before executing it.
+  if 0xF055 == opcode & 0xF0FF:
+    return I, ((opcode & 0x0F00) >> 8) + 1
+  if 0xF033 == opcode & 0xF0FF:
+    return I, 3
+  return 0, 0
+
+def _opcode(cpu):
+  # Opcode at pc, 0 if pc is out of range and emulate_cycle() will say so.
+  pc = cpu.pc
+  if pc + 1 >= len(cpu.memory):
+    return 0
+  return (cpu.memory[pc] << 8) | cpu.memory[pc + 1]
+
+def _flags(cpu):
+  return (DRAW if cpu.draw_flag else 0) | (0 if cpu.key_wait is None else KEY_WAIT)
+
+def _keys(cpu):
+  # Keys down, with the key a blocked LD Vx, K got even if it is up again,
+  # so that replay() presses it too.
+  keys = 0
+  for key in reversed(range(len(cpu.keyboard))):
+    keys = (keys << 1) | (1 if cpu.keyboard[key] else 0)
+  if cpu.key_pressed is not None:
+    keys = keys | (1 << cpu.key_pressed)
+  return keys
+
+class TraceWriter:
+
+  def __init__(self, f, cpu, buffer_size=1 << 16):
+    self._f = f
+    self._cpu = cpu
+    # Records are packed into the buffer and written to f once it holds
+    # buffer_size bytes.
+    self._buffer = bytearray()
+    self._buffer_size = buffer_size
+    self.records = 0
+    snapshot = cpu.snapshot()
+    f.write(_header.pack(_magic, _version, len(snapshot)))
+    f.write(snapshot)
+
+  def step(self):
+    ''' Execute and record one instruction. '''
+    cpu = self._cpu
+    cycle = cpu.cycles
+    pc = cpu.pc
+    opcode = _opcode(cpu)
+    keys = _keys(cpu)
+    write_addr, write_len = _written(opcode, cpu.I)
+    before = list(cpu.V)
+
+    cpu.emulate_cycle()
+
+    changed = 0
+    for x in range(len(before)):
+      if cpu.V[x] != before[x]:
+        changed = changed | (1 << x)
+    data = bytes(cpu.memory[write_addr:write_addr + write_len])
+    self._buffer += _record.pack(cycle, pc, opcode, keys, _flags(cpu), changed,
+        bytes(cpu.V), cpu.I, cpu.sp, write_addr, len(data), data)
+    self.records = self.records + 1
+    if len(self._buffer) >= self._buffer_size:
+      self.flush()
+
+  def run_cycles(self, cycles):
+    ''' Execute and record cycles instructions, or steps of a blocked LD Vx,
+    K. '''
+    end = self._cpu.cycles + cycles
+    while self._cpu.cycles < end:
+      self.step()
+
+  def run_frame(self):
+    ''' Execute and record instructions up to the next frame boundary. '''
+    cpf = self._cpu.cycles_per_frame
+    self.run_cycles(cpf - self._cpu.cycles % cpf)
+
+  def flush(self):
+    self._f.write(self._buffer)
+    self._buffer = bytearray()
+
+  def close(self):
+    ''' Write the buffered records out. The file is left open. '''
+    self.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+def read_snapshot(f):
+  ''' Read the header of the trace in f and return the snapshot of the Cpu
+  the trace starts from. '''
+  header = f.read(_header.size)
+  if len(header) != _header.size:
+    raise InvalidTrace('not a trace')
+  magic, version, size = _header.unpack(header)
+  if magic != _magic:
+    raise InvalidTrace('not a trace')
+  if version != _version:
+    raise InvalidTrace('version = {}'.format(version))
+  snapshot = f.read(size)
+  if len(snapshot) != size:
+    raise InvalidTrace('truncated snapshot')
+  return snapshot
+
+def read_trace(f, pcs=None, opcode=None, mask=0xFFFF, chunk=4096):
+  ''' Generate the TraceRecords of the trace in f, only those whose pc is in
+  pcs, e.g. range(0x200, 0x300), and whose opcode & mask equals opcode, if
+  given, e.g. opcode=0xD000, mask=0xF000 for the sprites drawn. The file is
+  read chunk records at a time. '''
+  read_snapshot(f)
+  return _records(f, pcs, opcode, mask, chunk)
+
+def _records(f, pcs=None, opcode=None, mask=0xFFFF, chunk=4096):
+  # Generate the records following the header, see read_trace().
+  while True:
+    data = f.read(_record.size * chunk)
+    if len(data) % _record.size:
+      raise InvalidTrace('truncated record')
+    if not data:
+      return
+    for fields in _record.iter_unpack(data):
+      if pcs is not None and fields[1] not in pcs:
+        continue
+      if opcode is not None and fields[2] & mask != opcode:
+        continue
+      yield TraceRecord(*fields[:6], list(fields[6]), *fields[7:10],
+          fields[11][:fields[10]])
+
+def replay(f, cpu):
+  ''' Restore cpu to the start of the trace in f, execute the trace again
+  with the same keys and raise TraceMismatch at the first instruction that
+  does not match its record. Returns the number of records checked. '''
+  cpu.restore(read_snapshot(f))
+  count = 0
+  for record in _records(f):
+    if cpu.cycles != record.cycle or cpu.pc != record.pc:
+      raise TraceMismatch('cycle {} pc 0x{:03X}, recorded cycle {} pc 0x{:03X}'.format(
+          cpu.cycles, cpu.pc, record.cycle, record.pc))
+    for key in range(len(cpu.keyboard)):
+      if (record.keys >> key) & 1:
+        cpu.press_key(key)
+      else:
+        cpu.release_key(key)
+
+    opcode = _opcode(cpu)
+    write_addr, write_len = _written(opcode, cpu.I)
+    cpu.emulate_cycle()
+
+    state = (opcode, list(cpu.V), cpu.I, cpu.sp, _flags(cpu), write_addr,
+        bytes(cpu.memory[write_addr:write_addr + write_len]))
+    recorded = (record.opcode, record.V, record.I, record.sp, record.flags,
+        record.write_addr, record.write_data)
+    if state != recorded:
+      raise TraceMismatch('cycle {} pc 0x{:03X}: {} recorded as {}'.format(
+          record.cycle, record.pc, state, recorded))
+    count = count + 1
+  return count
+
+def format_record(record):
+  ''' Return record as one line of text. '''
+  changed = ' '.join('V{:X}={:02X}'.format(x, record.V[x])
+      for x in range(len(record.V)) if (record.changed >> x) & 1)
+  line = '{:>10} 0x{:03X}: {:04X}  {:<18} {}'.format(record.cycle, record.pc,
+      record.opcode, disasm.mnemonic(record.opcode), changed)
+  if record.write_data:
+    line = '{} [0x{:03X}]={}'.format(line, record.write_addr, record.write_data.hex())
+  if record.flags & DRAW:
+    line = line + ' draw'
+  if record.flags & KEY_WAIT:
+    line = line + ' key_wait'
+  return line.rstrip()
+
+def _address_range(text):
+  # 'start:end' in hex, end exclusive.
+  start, end = text.split(':')
+  return range(int(start, 16), int(end, 16))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Record, show and verify chip8 execution traces.')
+  commands = parser.add_subparsers(dest='command', required=True)
+  record = commands.add_parser('record', help='run an application and record its trace')
+  record.add_argument('file_name', help='application to run')
+  record.add_argument('trace', help='trace file to write')
+  record.add_argument('--frames', type=int, default=600,
+      help='frames to run the application for (default 600)')
+  record.add_argument('--seed', type=int, help='seed of the RND bytes')
+  show = commands.add_parser('show', help='print the records of a trace')
+  show.add_argument('trace', help='trace file to read')
+  show.add_argument('--pc', type=_address_range, metavar='START:END',
+      help='only the instructions at these addresses, in hex, END excluded')
+  show.add_argument('--opcode', metavar='OPCODE[/MASK]',
+      help='only the opcodes matching OPCODE under MASK, in hex, e.g. D000/F000')
+  verify = commands.add_parser('verify', help='replay a trace and check every record')
+  verify.add_argument('trace', help='trace file to read')
+  args = parser.parse_args(argv)
+
+  # chip8 imports this module for Emulator traces.
+  import chip8
+  if 'record' == args.command:
+    cpu = chip8.Cpu(seed=args.seed)
+    cpu.load_app(args.file_name)
+    with open(args.trace, 'wb') as f, TraceWriter(f, cpu) as writer:
+      writer.run_cycles(args.frames * cpu.cycles_per_frame)
+    print('{} records'.format(writer.records))
+  elif 'show' == args.command:
+    opcode, mask = None, 0xFFFF
+    if args.opcode:
+      fields = args.opcode.split('/')
+      opcode = int(fields[0], 16)
+      if len(fields) > 1:
+        mask = int(fields[1], 16)
+      opcode = opcode & mask
+    with open(args.trace, 'rb') as f:
+      for record in read_trace(f, args.pc, opcode, mask):
+        print(format_record(record))
+  else:
+    with open(args.trace, 'rb') as f:
+      try:
+        print('{} records verified'.format(replay(f, chip8.Cpu())))
+      except TraceMismatch as e:
+        print('mismatch: {}'.format(e))
+        return 1
+  return 0
+
+if '__main__' == __name__:
+  sys.exit(main())
@@ -0,0 +1,233 @@
+''' Basic-block translator for the chip8 Cpu.
+
+Straight-line runs of instructions starting at a given pc are translated into
+Python source, compiled once and then executed as a whole, with the V
+registers held in locals. Anything that can not be translated is executed by
+the regular Cpu handlers. '''
+
+_MISSING = object()
+
+class Translator:
+
+  # Maximum number of instructions translated into a single block.
+  max_block_len = 64
+
+  def __init__(self, cpu):
+    self._cpu = cpu
+    self._blocks = {} # Block start -> compiled function, or None.
+    self._owners = {} # Instruction address -> set of block starts.
+    self._sources = {} # Block start -> generated source.
+    self._decoded = cpu._decoded
+    cpu._code_listeners.append(self._on_code_write)
+
+  def _flush(self):
+    # The Cpu was reset, every translation is stale.
+    self._blocks.clear()
+    self._owners.clear()
+    self._sources.clear()
+    self._decoded = self._cpu._decoded
+
+  def _on_code_write(self, addr):
+    # Discard every block containing the instruction at addr.
+    for start in self._owners.pop(addr, ()):
+      self._blocks.pop(start, None)
+      self._sources.pop(start, None)
+
+  def _fetch(self, addr):
+    memory = self._cpu.memory
+    return (memory[addr] << 8) | memory[addr + 1]
+
+  def _scan(self, start):
+    # Collect the instructions of the block starting at start. Returns a
+    # list of (addr, opcode) pairs; the block ends after a jump or skip,
+    # or before the first instruction that can not be translated.
+    instructions = []
+    addr = start
+    while len(instructions) < self.max_block_len and addr + 1 < len(self._cpu.memory):
+      opcode = self._fetch(addr)
+      family = opcode >> 12
+      if 0x8 == family and (opcode & 0xF) not in (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE):
+        break
+      if family not in (0x1, 0x3, 0x4, 0x5, 0x6, 0x7, 0x8, 0x9, 0xA, 0xB, 0xD):
+        break
+      instructions.append((addr, opcode))
+      addr = addr + 2
+      if family in (0x1, 0x3, 0x4, 0x5, 0x9, 0xB):
+        break
+    return instructions
+
+  def _generate(self, instructions):
+    # Generate source of a function taking (cpu, V) and returning
+    # (next pc, instructions executed, True if the block drew a sprite).
+    used = set()
+    for addr, opcode in instructions:
+      family = opcode >> 12
+      used.add((opcode & 0x0F00) >> 8)
+      if family in (0x5, 0x8, 0x9, 0xD):
+        used.add((opcode & 0x00F0) >> 4)
+      if family in (0x8, 0xD):
+        used.add(0xF)
+      if 0xB == family:
+        used.add(0x0)
+    regs = sorted(used)
+
+    def writeback():
+      if not regs:
+        return []
+      return ['  {} = {}'.format(
+        ', '.join('V[{}]'.format(r) for r in regs),
+        ', '.join('v{:X}'.format(r) for r in regs))]
+
+    count = len(instructions)
+    drew = False
+    lines = ['def block(cpu, V):']
+    if regs:
+      lines.append('  {} = {}'.format(
+        ', '.join('v{:X}'.format(r) for r in regs),
+        ', '.join('V[{}]'.format(r) for r in regs)))
+
+    pc = None
+    for addr, opcode in instructions:
+      family = opcode >> 12
+      nnn = opcode & 0x0FFF
+      nn  = opcode & 0x00FF
+      n   = opcode & 0x000F
+      vx  = 'v{:X}'.format((opcode & 0x0F00) >> 8)
+      vy  = 'v{:X}'.format((opcode & 0x00F0) >> 4)
+      nxt = addr + 2
+
+      if 0x1 == family:
+        pc = '0x{:03X}'.format(nnn)
+      elif 0x3 == family:
+        pc = '0x{:03X} if {} == 0x{:02X} else 0x{:03X}'.format(nxt + 2, vx, nn, nxt)
+      elif 0x4 == family:
+        pc = '0x{:03X} if {} != 0x{:02X} else 0x{:03X}'.format(nxt + 2, vx, nn, nxt)
+      elif 0x5 == family:
+        pc = '0x{:03X} if {} == {} else 0x{:03X}'.format(nxt + 2, vx, vy, nxt)
+      elif 0x9 == family:
+        pc = '0x{:03X} if {} != {} else 0x{:03X}'.format(nxt + 2, vx, vy, nxt)
+      elif 0xB == family:
+        pc = 'v0 + 0x{:03X}'.format(nnn)
+      elif 0x6 == family:
+        lines.append('  {} = 0x{:02X}'.format(vx, nn))
+      elif 0x7 == family:
+        lines.append('  {0} = ({0} + 0x{1:02X}) & 0xFF'.format(vx, nn))
+      elif 0xA == family:
+        lines.append('  cpu.I = 0x{:03X}'.format(nnn))
+      elif 0xD == family:
+        # Registers are synced so that the Cpu handler sees them, VF
+        # carries the collision back.
+        drew = True
+        lines.extend(writeback())
+        lines.append('  cpu._x, cpu._y, cpu._n = {}, {}, {}'.format(
+          (opcode & 0x0F00) >> 8, (opcode & 0x00F0) >> 4, n))
+        lines.append('  cpu._op_drw()')
+        lines.append('  vF = V[15]')
+      elif 0x0 == n:
+        lines.append('  {} = {}'.format(vx, vy))
+      elif 0x1 == n:
+        lines.append('  {} |= {}'.format(vx, vy))
+      elif 0x2 == n:
+        lines.append('  {} &= {}'.format(vx, vy))
+      elif 0x3 == n:
+        lines.append('  {} ^= {}'.format(vx, vy))
+      elif 0x4 == n:
+        # Statements mirror the Cpu handlers so that aliasing of Vx and
+        # VF behaves the same.
+        lines.append('  {0} = {0} + {1}'.format(vx, vy))
+        lines.append('  vF = 0')
+        lines.append('  if {} > 0xFF:'.format(vx))
+        lines.append('    vF = 1')
+        lines.append('    {} &= 0xFF'.format(vx))
+      elif 0x5 == n:
+        lines.append('  vF = 0')
+        lines.append('  if {} > {}:'.format(vx, vy))
+        lines.append('    vF = 1')
+        lines.append('  {} -= {}'.format(vx, vy))
+        lines.append('  {} &= 0xFF'.format(vx))
+      elif 0x6 == n:
+        lines.append('  vF = {} & 0x01'.format(vx))
+        lines.append('  {0} = {0} >> 1'.format(vx))
+      elif 0x7 == n:
+        lines.append('  vF = 0')
+        lines.append('  if {} > {}:'.format(vy, vx))
+        lines.append('    vF = 1')
+        lines.append('  {0} = {1} - {0}'.format(vx, vy))
+        lines.append('  {} &= 0xFF'.format(vx))
+      elif 0xE == n:
+        lines.append('  vF = {} & 0x80'.format(vx))
+        lines.append('  {0} = ({0} << 1) & 0xFF'.format(vx))
+
+    if pc is None:
+      pc = '0x{:03X}'.format(instructions[-1][0] + 2)
+    lines.append('  pc = {}'.format(pc))
+    lines.extend(writeback())
+    lines.append('  return pc, {}, {}'.format(count, drew))
+    return '\n'.join(lines) + '\n'
+
+  def _translate(self, start):
+    cpu = self._cpu
+    instructions = self._scan(start)
+    if not instructions:
+      # Remember that start is left to the Cpu until it gets overwritten.
+      if start + 1 < len(cpu.memory):
+        if cpu._decoded[start] is None:
+          cpu._decoded[start] = cpu._decode_at(start)
+        self._owners.setdefault(start, set()).add(start)
+        self._blocks[start] = None
+      return None
+
+    source = self._generate(instructions)
+    namespace = {}
+    exec(compile(source, '<chip8 block 0x{:03X}>'.format(start), 'exec'), namespace)
+    block = namespace['block']
+
+    # Decode the covered instructions in the Cpu as well, so that writes to
+    # them are reported back through _on_code_write.
+    for addr, opcode in instructions:
+      if cpu._decoded[addr] is None:
+        cpu._decoded[addr] = cpu._decode_at(addr)
+      self._owners.setdefault(addr, set()).add(start)
+
+    self._blocks[start] = block
+    self._sources[start] = source
+    return block
+
+  def source(self, start):
+    ''' Return the generated source of the block starting at start, or None
+    if there is no such block. '''
+    if self._decoded is self._cpu._decoded and start not in self._blocks:
+      self._translate(start)
+    return self._sources.get(start)
+
+  def run(self, cycles):
+    ''' Execute at least cycles instructions, a whole block at a time.
+    Returns the number of instructions actually executed. On return
+    cpu.draw_flag is True if any sprite was drawn. '''
+    cpu = self._cpu
+    blocks = self._blocks
+    executed = 0
+    drew = False
+    while executed < cycles:
+      if cpu._decoded is not self._decoded:
+        self._flush()
+
+      pc = cpu.pc
+      block = blocks.get(pc, _MISSING)
+      if block is _MISSING and pc < len(cpu.memory):
+        block = self._translate(pc)
+
+      if block is None or block is _MISSING:
+        # Not translatable, let the Cpu take care of it.
+        cpu.emulate_cycle()
+        executed += 1
+        drew = drew or cpu.draw_flag
+        continue
+
+      cpu.pc, count, block_drew = block(cpu, cpu.V)
+      cpu.cycles += count
+      executed += count
+      drew = drew or block_drew
+
+    cpu.draw_flag = drew
+    return executed
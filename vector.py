@@ -0,0 +1,430 @@
+''' Lockstep chip8 emulation of many machines at once.
+
+VectorCpu keeps the state of n machines in stacked NumPy arrays and runs one
+instruction on all of them per step. The machines are grouped by the
+instruction they are at, and each group is executed by a single vectorized
+handler mirroring the one of chip8.Cpu, so the interpreter overhead is paid
+once per distinct instruction rather than once per machine. Requires numpy. '''
+
+import chip8
+
+class VectorCpu:
+
+  cols = chip8.Cpu.cols
+  rows = chip8.Cpu.rows
+  cycles_per_frame = chip8.Cpu.cycles_per_frame
+
+  def __init__(self, n, seed=None):
+    import numpy
+    self._numpy = numpy
+    self.n = n
+
+    # Seeds of the RND bytes of every machine, drawn from the same pools as
+    # chip8.Cpu: seed + i for machine i, or seeds from the system entropy.
+    if seed is None:
+      self.seed = numpy.array([chip8.random_seed() for i in range(n)], dtype=numpy.uint64)
+    else:
+      self.seed = numpy.arange(seed, seed + n, dtype=numpy.uint64)
+
+    # Handlers keyed by (family << 8) | sub, sub being the lowest nibble for
+    # family 0x8, the lowest byte for families 0x0, 0xE and 0xF and 0
+    # otherwise.
+    self._handlers = {
+      0x0E0 : self._op_cls,
+      0x0EE : self._op_ret,
+      0x100 : self._op_jmp,
+      0x200 : self._op_call,
+      0x300 : self._op_ske,
+      0x400 : self._op_skne,
+      0x500 : self._op_sker,
+      0x600 : self._op_ld,
+      0x700 : self._op_add,
+      0x800 : self._op_ldr,
+      0x801 : self._op_orr,
+      0x802 : self._op_andr,
+      0x803 : self._op_xorr,
+      0x804 : self._op_addr,
+      0x805 : self._op_subr,
+      0x806 : self._op_shr,
+      0x807 : self._op_subnr,
+      0x80E : self._op_shl,
+      0x900 : self._op_sner,
+      0xA00 : self._op_ldi,
+      0xB00 : self._op_jmpv0,
+      0xC00 : self._op_rnd,
+      0xD00 : self._op_drw,
+      0xE9E : self._op_skp,
+      0xEA1 : self._op_sknp,
+      0xF07 : self._op_ldv,
+      0xF0A : self._op_ldvk,
+      0xF15 : self._op_lddt,
+      0xF18 : self._op_ldst,
+      0xF1E : self._op_addi,
+      0xF29 : self._op_ldf,
+      0xF33 : self._op_ldb,
+      0xF55 : self._op_ldix,
+      0xF65 : self._op_ldxi,
+    }
+
+    self.reset()
+
+  def reset(self):
+    numpy = self._numpy
+    n = self.n
+    self.memory = numpy.zeros((n, len(chip8.Cpu._initial_memory)), dtype=numpy.uint8)
+    self.memory[:] = numpy.frombuffer(chip8.Cpu._initial_memory, dtype=numpy.uint8)
+    self.V = numpy.zeros((n, 16), dtype=numpy.uint8)
+    self.I = numpy.zeros(n, dtype=numpy.int32)
+    self.pc = numpy.full(n, 0x200, dtype=numpy.int32)
+    self.sp = numpy.full(n, -1, dtype=numpy.int32)
+    self.stack = numpy.zeros((n, 16), dtype=numpy.int32)
+    self.delay_timer = numpy.zeros(n, dtype=numpy.int32)
+    self.sound_timer = numpy.zeros(n, dtype=numpy.int32)
+    self.keyboard = numpy.zeros((n, 16), dtype=bool)
+    # Register LD Vx, K is blocked on, -1 if not blocked, see Cpu.key_wait.
+    self.key_wait = numpy.full(n, -1, dtype=numpy.int8)
+    self.pixels = numpy.zeros((n, self.rows, self.cols), dtype=numpy.uint8)
+    self.draw_flag = numpy.zeros(n, dtype=bool)
+
+    # RND pools of every machine, their numbers and the next byte in them.
+    self._random_k = numpy.zeros(n, dtype=numpy.int64)
+    self._random_pos = numpy.zeros(n, dtype=numpy.int64)
+    self._random_pool = numpy.array([self._pool(i) for i in range(n)], dtype=numpy.uint8)
+
+    # Instructions executed since reset, the same for every machine still
+    # running.
+    self.cycles = 0
+
+    # Machines still running. A machine hitting an error stops, with the
+    # exception kept in errors, while the others carry on.
+    self.running = numpy.ones(n, dtype=bool)
+    self.errors = {}
+
+  def _pool(self, i):
+    pool = chip8.random_pool(int(self.seed[i]), int(self._random_k[i]))
+    return self._numpy.frombuffer(pool, dtype=self._numpy.uint8)
+
+  def load_image(self, image):
+    ''' Reset and load image, a bytes-like application, into the memory of
+    every machine at 0x200. '''
+    numpy = self._numpy
+    self.reset()
+    image = bytes(memoryview(image)[:self.memory.shape[1] - 0x200])
+    self.memory[:, 0x200:0x200 + len(image)] = numpy.frombuffer(image, dtype=numpy.uint8)
+
+  def load_app(self, file_name):
+    with open(file_name, 'rb') as f:
+      self.load_image(f.read())
+
+  def snapshot(self, i):
+    ''' Return the state of machine i as a chip8.Cpu snapshot. '''
+    keys = 0
+    for key in reversed(range(16)):
+      keys = (keys << 1) | (1 if self.keyboard[i, key] else 0)
+    header = chip8.Cpu._snapshot_header.pack(chip8.Cpu._snapshot_magic,
+        chip8.Cpu._snapshot_version, int(self.pc[i]), int(self.I[i]),
+        int(self.sp[i]), self.V[i].tobytes(), *(int(item) for item in self.stack[i]),
+        int(self.delay_timer[i]), int(self.sound_timer[i]), self.cycles, keys,
+        int(self.seed[i]), int(self._random_k[i]), int(self._random_pos[i]),
+        int(self.key_wait[i]), -1)
+    return b''.join((header, self.memory[i].tobytes(),
+        self._numpy.packbits(self.pixels[i]).tobytes()))
+
+  def restore(self, i, blob):
+    ''' Load machine i from a chip8.Cpu snapshot. The cycle count is shared
+    by all machines and is left alone. '''
+    numpy = self._numpy
+    cpu = chip8.Cpu()
+    cpu.restore(blob)
+    self.pc[i] = cpu.pc
+    self.I[i] = cpu.I
+    self.sp[i] = cpu.sp
+    self.V[i] = cpu.V
+    self.stack[i] = cpu.stack
+    self.delay_timer[i] = cpu.delay_timer
+    self.sound_timer[i] = cpu.sound_timer
+    self.keyboard[i] = cpu.keyboard
+    self.key_wait[i] = -1 if cpu.key_wait is None else cpu.key_wait
+    self.seed[i] = cpu.seed
+    self._random_k[i] = cpu._random_k
+    self._random_pos[i] = cpu._random_pos
+    self._random_pool[i] = self._pool(i)
+    self.memory[i] = numpy.frombuffer(bytes(cpu.memory), dtype=numpy.uint8)
+    packed = numpy.frombuffer(cpu.framebuffer.pack(), dtype=numpy.uint8)
+    self.pixels[i] = numpy.unpackbits(packed).reshape(self.rows, self.cols)
+    self.running[i] = True
+    self.errors.pop(i, None)
+
+  def _fail(self, m, error):
+    # Stop machines m, keeping error as the reason.
+    for i in m:
+      self.errors[int(i)] = error
+    self.running[m] = False
+
+  def step(self):
+    ''' Execute one instruction on every running machine. '''
+    numpy = self._numpy
+    m = numpy.flatnonzero(self.running)
+
+    # Check the program counters and stack pointers.
+    pc = self.pc[m]
+    bad = pc + 1 >= self.memory.shape[1]
+    if bad.any():
+      for i in m[bad]:
+        self._fail([i], chip8.ProgramCounterOutOfRange('pc = {}'.format(self.pc[i])))
+      m, pc = m[~bad], pc[~bad]
+    bad = (self.sp[m] < -1) | (self.sp[m] >= self.stack.shape[1])
+    if bad.any():
+      for i in m[bad]:
+        self._fail([i], chip8.StackPointerOutOfRange('sp = {}'.format(self.sp[i])))
+      m, pc = m[~bad], pc[~bad]
+
+    self.draw_flag[:] = False
+    self.cycles = self.cycles + 1
+    if 0 == self.cycles % self.cycles_per_frame:
+      numpy.subtract(self.delay_timer, 1, out=self.delay_timer, where=self.delay_timer > 0)
+      numpy.subtract(self.sound_timer, 1, out=self.sound_timer, where=self.sound_timer > 0)
+
+    # Fetch and group the machines by instruction.
+    opcodes = (self.memory[m, pc].astype(numpy.int32) << 8) | self.memory[m, pc + 1]
+    self.pc[m] = pc + 2
+    family = opcodes >> 12
+    keys = family << 8
+    keys |= numpy.where(0x8 == family, opcodes & 0x000F, 0)
+    keys |= numpy.where((0x0 == family) | (family >= 0xE), opcodes & 0x00FF, 0)
+
+    # Execute.
+    for key in numpy.unique(keys):
+      group = keys == key
+      handler = self._handlers.get(int(key))
+      if handler is None:
+        for i, opcode in zip(m[group], opcodes[group]):
+          self._fail([i], chip8.UnsupportedOpcode('opcode = 0x{:04X}'.format(opcode)))
+      else:
+        handler(m[group], opcodes[group])
+
+  def run_cycles(self, cycles):
+    ''' Execute cycles instructions on every running machine, stopping early
+    if none is left. Returns the number of steps executed. '''
+    for step in range(cycles):
+      if not self.running.any():
+        return step
+      self.step()
+    return cycles
+
+  def run_frame(self):
+    ''' Execute instructions up to the next frame boundary. '''
+    return self.run_cycles(self.cycles_per_frame - self.cycles % self.cycles_per_frame)
+
+  # Vectorized handlers. Each one takes the indices of the machines in its
+  # group and their opcodes, and does what the chip8.Cpu handler of the same
+  # name does, statement by statement, so that the register quirks when x
+  # or y is 0xF stay the same.
+
+  def _op_cls(self, m, op):
+    # 0x00E0 - CLS.
+    self.pixels[m] = 0
+    self.draw_flag[m] = True
+
+  def _op_ret(self, m, op):
+    # 0x00EE - RET.
+    bad = self.sp[m] <= -1
+    if bad.any():
+      self._fail(m[bad], chip8.StackPointerOutOfRange())
+      m = m[~bad]
+    self.pc[m] = self.stack[m, self.sp[m]]
+    self.sp[m] -= 1
+
+  def _op_jmp(self, m, op):
+    # 0x1nnn - JP addr.
+    self.pc[m] = op & 0x0FFF
+
+  def _op_call(self, m, op):
+    # 0x2nnn - CALL addr.
+    bad = self.sp[m] + 1 >= self.stack.shape[1]
+    if bad.any():
+      self._fail(m[bad], chip8.StackPointerOutOfRange())
+      m, op = m[~bad], op[~bad]
+    self.sp[m] += 1
+    self.stack[m, self.sp[m]] = self.pc[m]
+    self.pc[m] = op & 0x0FFF
+
+  def _op_ske(self, m, op):
+    # 0x3xkk - SE Vx, byte.
+    self.pc[m] += 2 * (self.V[m, (op >> 8) & 0xF] == (op & 0xFF))
+
+  def _op_skne(self, m, op):
+    # 0x4xkk - SNE Vx, byte.
+    self.pc[m] += 2 * (self.V[m, (op >> 8) & 0xF] != (op & 0xFF))
+
+  def _op_sker(self, m, op):
+    # 0x5xy0 - SE Vx, Vy.
+    self.pc[m] += 2 * (self.V[m, (op >> 8) & 0xF] == self.V[m, (op >> 4) & 0xF])
+
+  def _op_ld(self, m, op):
+    # 0x6xkk - LD Vx, byte.
+    self.V[m, (op >> 8) & 0xF] = op & 0xFF
+
+  def _op_add(self, m, op):
+    # 0x7xkk - ADD Vx, byte.
+    x = (op >> 8) & 0xF
+    self.V[m, x] = (self.V[m, x] + (op & 0xFF)) & 0xFF
+
+  def _op_ldr(self, m, op):
+    # 0x8xy0 - LD Vx, Vy.
+    self.V[m, (op >> 8) & 0xF] = self.V[m, (op >> 4) & 0xF]
+
+  def _op_orr(self, m, op):
+    # 0x8xy1 - OR Vx, Vy.
+    x = (op >> 8) & 0xF
+    self.V[m, x] |= self.V[m, (op >> 4) & 0xF]
+
+  def _op_andr(self, m, op):
+    # 0x8xy2 - AND Vx, Vy.
+    x = (op >> 8) & 0xF
+    self.V[m, x] &= self.V[m, (op >> 4) & 0xF]
+
+  def _op_xorr(self, m, op):
+    # 0x8xy3 - XOR Vx, Vy.
+    x = (op >> 8) & 0xF
+    self.V[m, x] ^= self.V[m, (op >> 4) & 0xF]
+
+  def _op_addr(self, m, op):
+    # 0x8xy4 - ADD Vx, Vy. The sum is written to Vx before VF is cleared,
+    # so VF ends up 0 when x is 0xF.
+    x, y = (op >> 8) & 0xF, (op >> 4) & 0xF
+    total = self.V[m, x].astype(self._numpy.int32) + self.V[m, y]
+    self.V[m, x] = total & 0xFF
+    self.V[m, 0xF] = (total > 0xFF) & (x != 0xF)
+
+  def _op_subr(self, m, op):
+    # 0x8xy5 - SUB Vx, Vy.
+    x, y = (op >> 8) & 0xF, (op >> 4) & 0xF
+    self.V[m, 0xF] = 0
+    self.V[m, 0xF] = self.V[m, x] > self.V[m, y]
+    self.V[m, x] = self.V[m, x] - self.V[m, y]
+
+  def _op_shr(self, m, op):
+    # 0x8xy6 - SHR Vx.
+    x = (op >> 8) & 0xF
+    self.V[m, 0xF] = self.V[m, x] & 0x01
+    self.V[m, x] = self.V[m, x] >> 1
+
+  def _op_subnr(self, m, op):
+    # 0x8xy7 - SUBN Vx, Vy.
+    x, y = (op >> 8) & 0xF, (op >> 4) & 0xF
+    self.V[m, 0xF] = 0
+    self.V[m, 0xF] = self.V[m, y] > self.V[m, x]
+    self.V[m, x] = self.V[m, y] - self.V[m, x]
+
+  def _op_shl(self, m, op):
+    # 0x8xyE - SHL Vx.
+    x = (op >> 8) & 0xF
+    self.V[m, 0xF] = self.V[m, x] & 0x80
+    self.V[m, x] = self.V[m, x] << 1
+
+  def _op_sner(self, m, op):
+    # 0x9xy0 - SNE Vx, Vy.
+    self.pc[m] += 2 * (self.V[m, (op >> 8) & 0xF] != self.V[m, (op >> 4) & 0xF])
+
+  def _op_ldi(self, m, op):
+    # 0xAnnn - LD I, addr.
+    self.I[m] = op & 0x0FFF
+
+  def _op_jmpv0(self, m, op):
+    # 0xBnnn - JP V0, addr.
+    self.pc[m] = self.V[m, 0x0] + (op & 0x0FFF)
+
+  def _op_rnd(self, m, op):
+    # 0xCxkk - RND Vx, byte.
+    pool_size = self._random_pool.shape[1]
+    for i in m[self._random_pos[m] == pool_size]:
+      self._random_k[i] += 1
+      self._random_pos[i] = 0
+      self._random_pool[i] = self._pool(i)
+    byte = self._random_pool[m, self._random_pos[m]]
+    self._random_pos[m] += 1
+    self.V[m, (op >> 8) & 0xF] = byte & op & 0xFF
+
+  def _op_drw(self, m, op):
+    # 0xDxyn - DRW Vx, Vy, nibble. Drawn one sprite row at a time across
+    # the group, VF being cleared before the coordinates are read as the
+    # Cpu does.
+    numpy = self._numpy
+    x, y, n = (op >> 8) & 0xF, (op >> 4) & 0xF, op & 0xF
+    self.draw_flag[m] = True
+    self.V[m, 0xF] = 0
+    col = self.V[m, x].astype(numpy.int32) % self.cols
+    row = self.V[m, y].astype(numpy.int32) % self.rows
+    collision = numpy.zeros(len(m), dtype=bool)
+    cols = (col[:, None] + numpy.arange(8)) % self.cols
+    for yline in range(int(n.max()) if len(n) else 0):
+      g = n > yline
+      byte = self.memory[m[g], (self.I[m[g]] + yline) & 0xFFF]
+      bits = numpy.unpackbits(byte[:, None], axis=1)
+      index = (m[g][:, None], ((row[g] + yline) % self.rows)[:, None], cols[g])
+      region = self.pixels[index]
+      collision[g] |= (region & bits).any(axis=1)
+      self.pixels[index] = region ^ bits
+    self.V[m, 0xF] = collision
+
+  def _op_skp(self, m, op):
+    # 0xEx9E - SKP Vx.
+    key = self.V[m, (op >> 8) & 0xF] % 16
+    self.pc[m] += 2 * self.keyboard[m, key]
+
+  def _op_sknp(self, m, op):
+    # 0xExA1 - SKNP Vx.
+    key = self.V[m, (op >> 8) & 0xF] % 16
+    self.pc[m] += 2 * ~self.keyboard[m, key]
+
+  def _op_ldv(self, m, op):
+    # 0xFx07 - LD Vx, DT.
+    self.V[m, (op >> 8) & 0xF] = self.delay_timer[m]
+
+  def _op_ldvk(self, m, op):
+    # 0xFx0A - LD Vx, K. Machines with no key down block on it and execute
+    # it again.
+    keyboard = self.keyboard[m]
+    pressed = keyboard.any(axis=1)
+    self.V[m[pressed], (op[pressed] >> 8) & 0xF] = keyboard[pressed].argmax(axis=1)
+    self.key_wait[m[pressed]] = -1
+    self.key_wait[m[~pressed]] = (op[~pressed] >> 8) & 0xF
+    self.pc[m[~pressed]] -= 2
+
+  def _op_lddt(self, m, op):
+    # 0xFx15 - LD DT, Vx.
+    self.delay_timer[m] = self.V[m, (op >> 8) & 0xF]
+
+  def _op_ldst(self, m, op):
+    # 0xFx18 - LD ST, Vx.
+    self.sound_timer[m] = self.V[m, (op >> 8) & 0xF]
+
+  def _op_addi(self, m, op):
+    # 0xFx1E - ADD I, Vx.
+    self.I[m] = (self.I[m] + self.V[m, (op >> 8) & 0xF]) & 0xFFFF
+
+  def _op_ldf(self, m, op):
+    # 0xFx29 - LD F, Vx.
+    self.I[m] = (self.V[m, (op >> 8) & 0xF] % 16) * 5
+
+  def _op_ldb(self, m, op):
+    # 0xFx33 - LD B, Vx.
+    value = self.V[m, (op >> 8) & 0xF]
+    self.memory[m, self.I[m] & 0xFFF] = value // 100
+    self.memory[m, (self.I[m] + 1) & 0xFFF] = value // 10 % 10
+    self.memory[m, (self.I[m] + 2) & 0xFFF] = value % 10
+
+  def _op_ldix(self, m, op):
+    # 0xFx55 - LD [I], Vx.
+    x = (op >> 8) & 0xF
+    for i in range(int(x.max()) + 1):
+      g = m[x >= i]
+      self.memory[g, (self.I[g] + i) & 0xFFF] = self.V[g, i]
+
+  def _op_ldxi(self, m, op):
+    # 0xFx65 - LD Vx, [I].
+    x = (op >> 8) & 0xF
+    for i in range(int(x.max()) + 1):
+      g = m[x >= i]
+      self.V[g, i] = self.memory[g, (self.I[g] + i) & 0xFFF]